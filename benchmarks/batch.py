@@ -0,0 +1,43 @@
+"""Runs of examples/collatz.c for many values of n, one after the other
+and on pools of processes of several sizes.
+
+    python -m benchmarks.batch [runs]
+"""
+
+import os
+import sys
+import time
+
+from subc.batch import BatchStats, inputs, run_batch
+from subc.bytecode import assemble
+from subc.compiler import Compiler
+from subc.output import NULL
+from subc.tokenizer import tokenize
+from subc.virtual_machine import execute
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    compiler = Compiler(tokenize(open("examples/collatz.c").read()))
+    image = assemble(*compiler.parse_global_declarations())
+    jobs = [(0, inputs(compiler.globals(), {"n": n})) for n in range(1, runs + 1)]
+
+    start = time.perf_counter()
+    for _, patches in jobs:
+        data = bytearray(image.data)
+        for address, value in patches.items():
+            data[address : address + len(value)] = value
+        execute(image.pc_start, image.code, data, sink=NULL)
+    elapsed = time.perf_counter() - start
+    print(f"{runs} runs")
+    print(f"  {'serial':10} {elapsed:7.3f} s {runs / elapsed:9.1f} runs/s")
+    cores = os.cpu_count() or 1
+    for workers in sorted({1, max(1, cores // 2), cores}):
+        stats = BatchStats()
+        run_batch([image], jobs, workers=workers, stats=stats)
+        rate = stats.jobs / stats.seconds
+        print(f"  {workers:2} workers {stats.seconds:7.3f} s {rate:9.1f} runs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Allocations per second of the heap under a malloc/free stress program.
+
+    python -m benchmarks.heap [example.c ...]
+
+Each engine runs the example for at least a fifth of a second; the heap
+statistics of a run are printed with the rate of mallocs and frees.
+"""
+
+import sys
+import time
+
+from subc.bytecode import assemble
+from subc.compiler import Compiler
+from subc.heap import HeapStats
+from subc.output import NULL
+from subc.tokenizer import tokenize
+from subc.virtual_machine import ENGINES, execute
+
+EXAMPLES = ["examples/allocator.c"]
+
+
+def main():
+    for file_name in sys.argv[1:] or EXAMPLES:
+        compiler = Compiler(tokenize(open(file_name).read()))
+        image = assemble(*compiler.parse_global_declarations())
+        stats = HeapStats()
+        execute(image.pc_start, image.code, image.data, heap_stats=stats, sink=NULL)
+        print(f"{file_name}: {stats}")
+        for engine in ENGINES:
+            runs = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < 0.2:
+                execute(image.pc_start, image.code, image.data, engine, sink=NULL)
+                runs += 1
+            elapsed = time.perf_counter() - start
+            calls = (stats.mallocs + stats.frees) * runs
+            print(f"  {engine:8} {calls / elapsed / 1e3:8.1f} K mallocs and frees/sec")
+
+
+if __name__ == "__main__":
+    main()
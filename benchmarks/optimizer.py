@@ -0,0 +1,48 @@
+"""Code size and run time of the examples at each optimization level, and
+at the highest one with inlining.
+
+    python -m benchmarks.optimizer [example.c ...]
+"""
+
+import sys
+import time
+
+from subc.compiler import Compiler
+from subc.optimizer import INLINE_THRESHOLD, MAX_LEVEL, optimize
+from subc.output import NULL
+from subc.tokenizer import tokenize
+from subc.virtual_machine import execute
+
+EXAMPLES = [
+    "examples/fib.c",
+    "examples/bresenham.c",
+    "examples/star.c",
+    "examples/calls.c",
+]
+
+
+def run(file_name: str, level: int, inline_threshold: int = 0) -> tuple[int, float]:
+    compiler = Compiler(tokenize(open(file_name).read()))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    pc_start, program, _ = optimize(
+        pc_start, program, compiler.functions(), level, inline_threshold
+    )
+    size = len(program)
+
+    start = time.perf_counter()
+    execute(pc_start, program, data_segment, sink=NULL)
+    return size, time.perf_counter() - start
+
+
+def main():
+    for file_name in sys.argv[1:] or EXAMPLES:
+        print(file_name)
+        for level in range(MAX_LEVEL + 1):
+            size, elapsed = run(file_name, level)
+            print(f"  -O{level}: {size:5} words {elapsed * 1000:9.2f} ms")
+        size, elapsed = run(file_name, MAX_LEVEL, INLINE_THRESHOLD)
+        print(f"  -O{MAX_LEVEL} --inline: {size:5} words {elapsed * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
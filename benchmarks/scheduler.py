@@ -0,0 +1,58 @@
+"""Programs run one after the other, and together under the scheduler
+with slices of several sizes.
+
+    python -m benchmarks.scheduler [example.c] [instances]
+"""
+
+import asyncio
+import sys
+import time
+
+from subc.bytecode import assemble
+from subc.compiler import Compiler
+from subc.output import NULL, Output
+from subc.scheduler import Scheduler
+from subc.tokenizer import tokenize
+from subc.virtual_machine import VM
+
+SLICES = [100, 1000, 10_000]
+
+
+def main():
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "examples/factorial.c"
+    instances = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    image = assemble(
+        *Compiler(tokenize(open(file_name).read())).parse_global_declarations()
+    )
+
+    def instance():
+        return VM(
+            image.pc_start,
+            image.code,
+            image.data,
+            memory_size=4096,
+            output=Output(NULL),
+        )
+
+    start = time.perf_counter()
+    cycles = 0
+    for _ in range(instances):
+        vm = instance()
+        vm.run()
+        cycles += vm.cycles
+    elapsed = time.perf_counter() - start
+    print(f"{file_name}: {instances} instances, {cycles} cycles")
+    print(
+        f"  {'serial':12} {elapsed:7.3f} s {cycles / elapsed / 1e6:6.2f} M cycles/sec"
+    )
+    for slice in SLICES:
+        vms = [instance() for _ in range(instances)]
+        start = time.perf_counter()
+        asyncio.run(Scheduler(slice).gather(vms))
+        elapsed = time.perf_counter() - start
+        rate = cycles / elapsed / 1e6
+        print(f"  slice {slice:<6} {elapsed:7.3f} s {rate:6.2f} M cycles/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Copying and measuring a buffer with loops of instructions and with the
+builtins of subc.syscalls, on each engine.
+
+    python -m benchmarks.syscalls
+"""
+
+import time
+
+from subc.bytecode import assemble
+from subc.compiler import Compiler
+from subc.output import NULL
+from subc.profiler import Profile
+from subc.tokenizer import tokenize
+from subc.virtual_machine import ENGINES, execute
+
+LOOPS = """
+int main() {
+    char *a;
+    char *b;
+    int i;
+    int round;
+    int n;
+    a = malloc(4096);
+    b = malloc(4096);
+    round = 0;
+    while (round < 10) {
+        i = 0;
+        while (i < 4095) {
+            b[i] = a[i] + 1;
+            i++;
+        }
+        b[4095] = 0;
+        n = 0;
+        while (b[n]) n++;
+        round++;
+    }
+    return n & 255;
+}
+"""
+
+BUILTINS = """
+int main() {
+    char *a;
+    char *b;
+    int round;
+    int n;
+    a = malloc(4096);
+    b = malloc(4096);
+    round = 0;
+    while (round < 10) {
+        memset(a, 1, 4095);
+        memcpy(b, a, 4095);
+        b[4095] = 0;
+        n = strlen(b);
+        round++;
+    }
+    return n & 255;
+}
+"""
+
+
+def main():
+    for name, text in (("loops", LOOPS), ("builtins", BUILTINS)):
+        image = assemble(*Compiler(tokenize(text)).parse_global_declarations())
+        profile = Profile()
+        execute(image.pc_start, image.code, image.data, profile=profile, sink=NULL)
+        print(f"{name}: {profile.cycles()} cycles")
+        for engine in ENGINES:
+            start = time.perf_counter()
+            execute(image.pc_start, image.code, image.data, engine, sink=NULL)
+            print(f"  {engine:8} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Tokenizer throughput benchmark.
+
+python -m benchmarks.tokenizer [repeat]
+"""
+
+import glob
+import sys
+import time
+import tracemalloc
+
+from subc.tokenizer import TokenBuffer, tokenize
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    examples = "".join(open(f).read() + "\n" for f in sorted(glob.glob("examples/*.c")))
+    source = examples * repeat
+
+    start = time.perf_counter()
+    count = sum(1 for _ in tokenize(source))
+    elapsed = time.perf_counter() - start
+
+    size = len(source.encode()) / 1e6
+    print(f"{size:.2f} MB, {count} tokens in {elapsed:.3f}s")
+    print(f"{count / elapsed:,.0f} tokens/sec, {size / elapsed:.2f} MB/sec")
+
+    for name, container in (("list[Token]", list), ("TokenBuffer", TokenBuffer)):
+        tracemalloc.start()
+        tokens = container(tokenize(source))
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tokens
+        print(f"{name}: {used / count:.1f} bytes/token")
+
+
+if __name__ == "__main__":
+    main()
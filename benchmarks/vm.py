@@ -0,0 +1,57 @@
+"""Cycles per second of each interpreter engine on the examples.
+
+    python -m benchmarks.vm [example.c ...]
+
+Cycles are counted once by a profiled run of the table engine; each
+engine then runs the example for at least a fifth of a second, as does
+the example translated to a Python module by subc.aot.
+"""
+
+import sys
+import time
+
+from subc.aot import translate_program
+from subc.bytecode import assemble
+from subc.compiler import Compiler
+from subc.output import NULL
+from subc.profiler import Profile
+from subc.tokenizer import tokenize
+from subc.virtual_machine import ENGINES, execute
+
+EXAMPLES = ["examples/fib.c", "examples/bresenham.c", "examples/calls.c"]
+
+
+def count_cycles(image) -> int:
+    """number of instructions the program executes"""
+    profile = Profile()
+    execute(image.pc_start, image.code, image.data, profile=profile, sink=NULL)
+    return profile.cycles()
+
+
+def main():
+    for file_name in sys.argv[1:] or EXAMPLES:
+        compiler = Compiler(tokenize(open(file_name).read()))
+        image = assemble(*compiler.parse_global_declarations())
+        cycles = count_cycles(image)
+        print(f"{file_name}: {cycles} cycles")
+        module: dict = {}
+        exec(translate_program(image.pc_start, image.code, image.data), module)
+        runners = {
+            engine: lambda engine=engine: execute(
+                image.pc_start, image.code, image.data, engine, sink=NULL
+            )
+            for engine in ENGINES
+        }
+        runners["module"] = lambda: module["run"](sink=NULL)
+        for name, runner in runners.items():
+            runs = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < 0.2:
+                runner()
+                runs += 1
+            elapsed = time.perf_counter() - start
+            print(f"  {name:8} {cycles * runs / elapsed / 1e6:6.2f} M cycles/sec")
+
+
+if __name__ == "__main__":
+    main()
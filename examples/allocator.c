@@ -0,0 +1,54 @@
+struct Node {
+    int value;
+    struct Node *next;
+};
+
+int seed;
+
+int random() {
+    seed = (seed * 1103515245 + 12345) & 2147483647;
+    return seed / 65536;
+}
+
+int main() {
+    int round;
+    int i;
+    int sum;
+    struct Node *head;
+    struct Node *node;
+    int *buffer;
+    int *buffers;
+
+    round = 0;
+    sum = 0;
+    seed = 1;
+    while (round < 100) {
+        head = 0;
+        buffers = 0;
+        i = 0;
+        while (i < 20) {
+            node = malloc(sizeof(struct Node));
+            node->value = i;
+            node->next = head;
+            head = node;
+            buffer = malloc(8 + random() % 400);
+            *buffer = buffers;
+            buffers = buffer;
+            i++;
+        }
+        while (head != 0) {
+            node = head->next;
+            sum = sum + head->value;
+            free(head);
+            head = node;
+        }
+        while (buffers != 0) {
+            buffer = *buffers;
+            free(buffers);
+            buffers = buffer;
+        }
+        round++;
+    }
+    printf("%d\n", sum);
+    return 0;
+}
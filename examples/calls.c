@@ -0,0 +1,25 @@
+int square(int x) {
+    return x * x;
+}
+
+int max(int a, int b) {
+    if (a > b) return a;
+    return b;
+}
+
+int clamp(int x, int low, int high) {
+    if (x < low) return low;
+    if (x > high) return high;
+    return x;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 2000) {
+        total = total + clamp(square(i % 50) - 100, 0, 1000);
+        total = max(total - 7, 0);
+        i++;
+    }
+    printf("%d\n", total);
+}
@@ -0,0 +1,15 @@
+int n;
+
+int main() {
+    int steps;
+    steps = 0;
+    while (n > 1) {
+        if (n & 1)
+            n = 3 * n + 1;
+        else
+            n = n / 2;
+        steps++;
+    }
+    printf("%d\n", steps);
+    return steps;
+}
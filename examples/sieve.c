@@ -0,0 +1,28 @@
+int *primes;
+int count;
+
+int main() {
+    char *composite;
+    int i;
+    int j;
+    composite = malloc(20000);
+    primes = malloc(20000);
+    memset(composite, 0, 20000);
+    i = 2;
+    while (i < 20000) {
+        if (!composite[i]) {
+            primes[count] = i;
+            count++;
+            j = i * i;
+            while (j < 20000) {
+                composite[j] = 1;
+                j = j + i;
+            }
+        }
+        i++;
+    }
+    free(composite);
+    snapshot();
+    printf("%d primes, the last %d\n", count, primes[count - 1]);
+    return 0;
+}
@@ -1,16 +1,294 @@
+import argparse
+import contextlib
+import json
 import sys
 
+from subc.aot import translate_file
+from subc.batch import BatchStats, inputs, run_batch
+from subc.bytecode import Image, assemble, is_image, load
+from subc.cache import Cache, source_key
 from subc.compiler import Compiler
-from subc.tokenizer import tokenize
-from subc.virtual_machine import execute
+from subc.heap import HeapStats
+from subc.hooks import Trace
+from subc.optimizer import INLINE_THRESHOLD, optimize
+from subc.output import Output
+from subc.profiler import Profile
+from subc.snapshot import is_snapshot, restore, save
+from subc.tokenizer import tokenize_file
+from subc.virtual_machine import ENGINES, MEMORY_SIZE, VM, execute
 
 
 def main():
-    file_name = sys.argv[1]
-    src = open(file_name).read()
-    tokens = tokenize(src)
-    pc_start, program, data_segment = Compiler(tokens).parse_global_declarations()
-    execute(pc_start, program, data_segment)
+    if sys.argv[1:2] == ["batch"]:
+        batch(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(prog="subc")
+    parser.add_argument("file_name")
+    parser.add_argument("-O", dest="level", type=int, default=0, metavar="LEVEL")
+    parser.add_argument(
+        "--opt-report",
+        action="store_true",
+        help="print the instructions removed from each function and by each pass",
+    )
+    parser.add_argument(
+        "--inline",
+        action="store_true",
+        help="inline calls to small leaf functions",
+    )
+    parser.add_argument(
+        "--inline-threshold",
+        type=int,
+        default=INLINE_THRESHOLD,
+        metavar="N",
+        help="inline functions of at most N instructions",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always compile, without reading or writing the bytecode cache",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="switch",
+        help="interpreter to run the program with",
+    )
+    parser.add_argument(
+        "--mem",
+        type=memory_size,
+        metavar="SIZE",
+        help="bytes of memory to run the program with, e.g. 65536, 512K or 64M "
+        f"(default {MEMORY_SIZE})",
+    )
+    parser.add_argument(
+        "--heap-stats",
+        action="store_true",
+        help="print the allocations and use of the heap to stderr after the run",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="text",
+        choices=("text", "json", "collapsed"),
+        help="run on the table engine and print to stderr the cycles by opcode, "
+        "function and loop, as text, JSON or collapsed stacks for flame graphs",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="run on the table engine, writing each instruction run to the binary "
+        "trace FILE; python -m subc.hooks FILE prints it",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="run on the switch engine up to the first call of snapshot() and write "
+        "the state of the VM to FILE; running FILE resumes the program from there",
+    )
+    parser.add_argument(
+        "--snapshot-at",
+        type=int,
+        metavar="CYCLES",
+        help="take the snapshot after CYCLES instructions instead",
+    )
+    parser.add_argument(
+        "-o",
+        dest="output",
+        metavar="FILE",
+        help="write the compiled program image to FILE instead of running it",
+    )
+    parser.add_argument(
+        "--emit-py",
+        metavar="FILE",
+        help="write the program translated to a Python module to FILE instead of "
+        "running it",
+    )
+    args = parser.parse_args()
+    if args.profile and args.trace:
+        parser.error("--profile and --trace do not run together")
+
+    if is_snapshot(args.file_name):
+        # it resumes on the VM of the switch engine, in the memory it was saved with
+        options = {
+            "--engine": args.engine != "switch",
+            "--mem": args.mem is not None,
+            "--profile": args.profile,
+            "--trace": args.trace,
+            "--snapshot": args.snapshot or args.snapshot_at is not None,
+            "-o": args.output,
+            "--emit-py": args.emit_py,
+        }
+        for option, given in options.items():
+            if given:
+                parser.error(f"{option} does not apply to a snapshot")
+        stats = HeapStats() if args.heap_stats else None
+        restore(args.file_name, stats).run()
+        if stats is not None:
+            print(f"heap: {stats}", file=sys.stderr)
+        return
+    if args.mem is None:
+        args.mem = MEMORY_SIZE
+    if is_image(args.file_name):
+        image = load(args.file_name)
+        if args.emit_py:
+            translate_file(
+                args.emit_py, image.pc_start, image.code, image.data, args.mem
+            )
+        else:
+            run(image, args, {})
+        return
+
+    inline_threshold = args.inline_threshold if args.inline else 0
+    # the report and the names of functions are only known when compiling
+    cache = None if args.no_cache or args.opt_report or args.profile else Cache()
+    image = None
+    functions: dict[str, int] = {}
+    if cache is not None:
+        key = source_key(args.file_name, args.level, inline_threshold)
+        image = cache.get(key)
+    if image is None:
+        image, functions, _ = compile_file(
+            args.file_name, args.level, inline_threshold, args.opt_report
+        )
+        if cache is not None:
+            try:
+                cache.put(key, image)
+            except OSError:
+                pass  # e.g. a read-only home directory
+
+    if args.output:
+        image.save(args.output)
+    if args.emit_py:
+        translate_file(args.emit_py, image.pc_start, image.code, image.data, args.mem)
+    if not args.output and not args.emit_py:
+        run(image, args, functions)
+
+
+def run(image: Image, args, functions: dict[str, int]) -> None:
+    """run the image with the engine and memory of the options; functions
+    names the functions in the profile by their address"""
+    if args.snapshot:
+        take_snapshot(image, args)
+        return
+    stats = HeapStats() if args.heap_stats else None
+    profile = Profile(functions) if args.profile else None
+    with contextlib.ExitStack() as stack:
+        trace = None
+        if args.trace:
+            trace = Trace(file=stack.enter_context(open(args.trace, "wb")))
+            stack.callback(trace.flush)
+        execute(
+            image.pc_start,
+            image.code,
+            image.data,
+            args.engine,
+            args.mem,
+            stats,
+            profile,
+            trace,
+        )
+    if stats is not None:
+        print(f"heap: {stats}", file=sys.stderr)
+    if args.profile == "json":
+        print(profile.to_json(), file=sys.stderr)
+    elif args.profile == "collapsed":
+        print(profile.collapsed(), end="", file=sys.stderr)
+    elif profile is not None:
+        print(profile, file=sys.stderr)
+
+
+def take_snapshot(image: Image, args) -> None:
+    """run the image up to the snapshot point of the options and save it"""
+    output = Output()
+    vm = VM(image.pc_start, image.code, image.data, args.mem, output=output)
+    vm.stop_at_snapshot = args.snapshot_at is None
+    try:
+        vm.run(args.snapshot_at)
+    finally:
+        output.flush()
+    if vm.exit_code is not None:
+        sys.exit("the program exited before the snapshot")
+    save(vm, args.snapshot)
+    print(f"snapshot after {vm.cycles} cycles: {args.snapshot}", file=sys.stderr)
+
+
+def batch(argv: list[str]) -> None:
+    """run each program with each line of inputs on a pool of processes,
+    printing a JSON line of the results of each run"""
+    parser = argparse.ArgumentParser(prog="subc batch")
+    parser.add_argument("file_names", nargs="+", metavar="file_name")
+    parser.add_argument(
+        "--inputs",
+        metavar="FILE",
+        help='JSON lines, each an object of values of globals, e.g. {"n": 10}, to run '
+        "each program with; once without by default",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        metavar="N",
+        help="processes to run the programs in, one per core by default",
+    )
+    parser.add_argument("-O", dest="level", type=int, default=0, metavar="LEVEL")
+    parser.add_argument("--engine", choices=ENGINES, default="switch")
+    parser.add_argument("--mem", type=memory_size, default=MEMORY_SIZE, metavar="SIZE")
+    args = parser.parse_args(argv)
+
+    values = [{}]
+    if args.inputs:
+        with open(args.inputs) as file:
+            values = [json.loads(line) for line in file if line.strip()]
+    images = []
+    jobs = []
+    for program, file_name in enumerate(args.file_names):
+        if is_image(file_name):  # without the names of its globals
+            image, variables = load(file_name), {}
+        else:
+            image, _, variables = compile_file(file_name, args.level, 0, False)
+        images.append(image)
+        try:
+            jobs += [(program, inputs(variables, run)) for run in values]
+        except ValueError as error:
+            parser.error(f"{file_name}: {error}")
+
+    stats = BatchStats()
+    results = run_batch(images, jobs, args.engine, args.mem, args.workers, stats)
+    for (program, _), run, result in zip(jobs, values * len(images), results):
+        line = {
+            "file": args.file_names[program],
+            "inputs": run,
+            "exit_code": result.exit_code,
+            "output": result.output.decode(errors="replace"),
+        }
+        if result.error is not None:
+            line["error"] = result.error
+        print(json.dumps(line))
+    print(f"batch: {stats}", file=sys.stderr)
+
+
+def memory_size(text: str) -> int:
+    """a size in bytes, with an optional K, M or G suffix"""
+    scale = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}.get(text[-1:].upper(), 1)
+    return int(text[:-1] if scale > 1 else text) * scale
+
+
+def compile_file(
+    file_name: str, level: int, inline_threshold: int, opt_report: bool
+) -> tuple[Image, dict[str, int], dict[str, tuple[int, int]]]:
+    """compile and optimize a source file into a program image, returned
+    with the address of each function in it and the address and size of
+    each global"""
+    compiler = Compiler(tokenize_file(file_name))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    functions = compiler.functions()
+    if level or inline_threshold:
+        pc_start, program, report = optimize(
+            pc_start, program, functions, level, inline_threshold
+        )
+        functions = report.functions
+        if opt_report:
+            print(report, file=sys.stderr)
+    return assemble(pc_start, program, data_segment), functions, compiler.globals()
 
 
 if __name__ == "__main__":
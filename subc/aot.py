@@ -0,0 +1,229 @@
+"""Ahead-of-time translation of programs into Python modules.
+
+Each function of the program becomes a Python function taking the memory
+and the stack and base pointers of the frame its caller set up, and
+returning ax: JSR becomes a call of that function, RET a return, and TCALL
+a call in tail position, or a jump back to the entry when a function calls
+itself. A block reached from a single place is emitted there, nested in
+the branch that leads to it, so that straight-line code and the arms of an
+if need no dispatch; the other blocks are the cases of a loop over pc, as
+in the regions of subc.jit:
+
+    def f_0(memory, sp, bp):
+        pc = 0
+        while True:
+            if pc == 0:
+                ...
+
+The module holds the data segment and a copy of the runtime, of the
+allocator of subc.heap, of subc.output and of the builtins of
+subc.syscalls, so it runs without subc: its run() prints and returns what
+execute would.
+"""
+
+import inspect
+
+import subc.heap
+import subc.output
+import subc.syscalls
+from subc.bytecode import EXIT_STUB, INSTRUCTION_SIZES, assemble
+from subc.code_manager import Opcode
+from subc.jit import Translator, decode_block, region_blocks, successors
+from subc.virtual_machine import MEMORY_SIZE, leaders
+
+MAX_NESTING = 24  # blocks nested deeper than this go through the dispatch loop
+
+RUNTIME = r'''
+load_word = struct.Struct("<i").unpack_from
+store_word = struct.Struct("<I").pack_into
+
+
+class Halt(Exception):
+    """raised by EXIT to unwind the calls"""
+'''
+
+# the allocator, the output and the builtins, without the docstrings and
+# definitions of their modules that the runtime has
+HEAP = inspect.getsource(subc.heap).split("import struct\n", 1)[1]
+OUTPUT = inspect.getsource(subc.output).split("unpack_from\n", 1)[1]
+BUILTINS = inspect.getsource(subc.syscalls).split("from typing import Callable\n", 1)[1]
+
+MAIN = '''
+def run(memory_size=MEMORY_SIZE, sink=None):
+    """run the program with memory_size bytes of memory, writing its output
+    to sink, stdout by default, and returning its exit code"""
+    global heap, output
+    # each call nests a Python call and takes at least 8 bytes of the stack
+    limit = max(memory_size // 8, TAIL_CALL_DEPTH) + 1000
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), limit))
+    memory = bytearray(memory_size)
+    memory[: len(DATA)] = DATA
+    heap = Heap(memory, len(DATA))
+    output = Output(sink)
+    sp = memory_size - 4 & -4
+    store_word(memory, sp, RETURN_ADDRESS)
+    sp -= 4
+    store_word(memory, sp, 0)
+    try:
+        ax = main(memory, sp, sp)
+    except Halt as halt:
+        return halt.args[0]
+    finally:
+        output.flush()
+    ax = (ax + 0x80000000 & 0xFFFFFFFF) - 0x80000000  # pushed by the exit stub
+    output.exit(ax)
+    return ax
+
+
+if __name__ == "__main__":
+    run()
+'''
+
+
+class FunctionTranslator(Translator):
+    """Python source of a function of the program"""
+
+    def __init__(
+        self, program, ends: dict[int, int], entry: int, names: dict[int, str]
+    ) -> None:
+        blocks = region_blocks(program, ends, entry, len(ends), returns=True)
+        super().__init__(blocks, "    ")
+        self.program = program
+        self.ends = ends
+        self.entry = entry
+        self.names = names
+        self.deep_tail_calls = False  # whether calls in tail position nest
+
+        # blocks reached from more than one place, the call included, are
+        # the cases of the dispatch loop
+        predecessors = dict.fromkeys(blocks, 0)
+        predecessors[entry] += 1
+        for block in blocks:
+            for successor in successors(program, ends, block, returns=True):
+                predecessors[successor] += 1
+            _, opcode, operands = decode_block(program, block, ends[block])[-1]
+            if opcode == Opcode.TCALL and operands[1] == entry:
+                predecessors[entry] += 1
+        self.labels = [block for block in blocks if predecessors[block] > 1]
+
+    def translate_block(self, block: int) -> None:
+        instructions = decode_block(self.program, block, self.ends[block])
+        if not self.block(instructions, self.ends[block]):
+            raise ValueError(f"cannot translate the block at {block}")
+
+    def goto(self, address: str) -> None:
+        block = int(address)
+        if block not in self.region:
+            raise ValueError(f"jump from {self.entry} to {block} leaves the function")
+        if block not in self.labels and len(self.indent) < 4 * MAX_NESTING:
+            self.translate_block(block)
+        else:
+            if block not in self.labels:
+                self.labels.append(block)
+            self.emit(f"pc = {block}")
+
+    def call(self, target: int, following: int) -> None:
+        self.emit(f"store_word(memory, sp - 4, {following})")
+        self.emit("store_word(memory, sp - 8, bp)")
+        self.emit(f"ax = {self.names[target]}(memory, sp - 8, sp - 8)")
+        self.goto(str(following))
+
+    def tail_call(self, size: int, target: int) -> None:
+        self.emit(f"memory[bp + 8 : bp + {8 + size}] = memory[sp : sp + {size}]")
+        if target == self.entry:
+            self.emit("sp = bp")
+            self.goto(str(target))
+        else:
+            self.deep_tail_calls = True
+            self.emit(f"return {self.names[target]}(memory, bp, bp)")
+
+    def ret(self) -> None:
+        self.emit("return ax")
+
+    def function(self) -> list[str]:
+        """the lines of the function definition"""
+        body = []
+        if self.entry not in self.labels:
+            self.translate_block(self.entry)
+            body = self.lines
+        cases = []
+        for block in self.labels:  # grows while translating
+            self.lines = []
+            self.indent = " " * 12
+            self.translate_block(block)
+            cases.append(f"        {'elif' if cases else 'if'} pc == {block}:")
+            cases.extend(self.lines)
+        if cases:
+            if not body:
+                body = [f"    pc = {self.entry}"]
+            body += ["    while True:", *cases]
+        header = [
+            f"def {self.names[self.entry]}(memory, sp, bp, "
+            "load_word=load_word, store_word=store_word):"
+        ]
+        return header + body
+
+
+def functions(pc_start: int, program) -> dict[int, str]:
+    """the entry point of each function, with its name in the module"""
+    entries = {pc_start}
+    pc = 0
+    while pc < len(program):
+        opcode = program[pc]
+        size = INSTRUCTION_SIZES.get(opcode, 1)
+        if opcode in (Opcode.JSR, Opcode.TCALL):
+            entries.add(program[pc + size - 1])
+        pc += size
+    return {
+        entry: "main" if entry == pc_start else f"f_{entry}"
+        for entry in sorted(entries)
+    }
+
+
+def translate_program(
+    pc_start: int, program, data_segment, memory_size: int = MEMORY_SIZE
+) -> str:
+    """Source of a Python module running the program.
+
+    Like execute, it takes the code of an assembled Image or the compiler's
+    list of opcode names and operands; memory_size is the default size of
+    the memory of run().
+    """
+    if isinstance(program[0], str):
+        image = assemble(pc_start, program, data_segment)
+        program, data_segment = image.code, image.data
+    starts = leaders(pc_start, program)
+    ends = dict(zip(starts, starts[1:] + [len(program)]))
+    names = functions(pc_start, program)
+
+    definitions = []
+    deep_tail_calls = False
+    for entry in names:
+        translator = FunctionTranslator(program, ends, entry, names)
+        definitions.append("\n".join(translator.function()))
+        deep_tail_calls |= translator.deep_tail_calls
+
+    header = [
+        '"""generated by subc: run() runs the program and returns its exit code"""',
+        "import struct",
+        "import sys",
+        "from typing import Callable",
+        "",
+        f"DATA = {bytes(data_segment)!r}",
+        f"MEMORY_SIZE = {memory_size}",
+        f"RETURN_ADDRESS = {len(program) - len(EXIT_STUB)}  # of main, in the bytecode",
+        # calls between functions in tail position nest without using the stack
+        f"TAIL_CALL_DEPTH = {1 << 16 if deep_tail_calls else 0}",
+        "heap = None",
+        "output = None",
+    ]
+    sections = ["\n".join(header), RUNTIME, HEAP, OUTPUT, BUILTINS, *definitions, MAIN]
+    return "\n\n\n".join(section.strip("\n") for section in sections) + "\n"
+
+
+def translate_file(
+    file_name: str, pc_start: int, program, data_segment, memory_size: int = MEMORY_SIZE
+) -> None:
+    """write the module running the program to file_name"""
+    with open(file_name, "w") as file:
+        file.write(translate_program(pc_start, program, data_segment, memory_size))
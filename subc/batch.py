@@ -0,0 +1,172 @@
+"""Many runs of compiled programs across a pool of processes.
+
+The images of the programs are written once to a block of shared memory,
+which each worker of the pool maps as it starts and runs the code from in
+place; a job only costs a worker the private memory of its run, holding a
+copy of the data segment, the heap and the stack. A job names the image
+to run and the bytes to write over its data segment, usually the values
+of globals given with inputs(). Results come back in the order of the
+jobs, each with the exit code and the output of its run.
+
+    python -m subc batch examples/factorial.c --inputs inputs.jsonl
+"""
+
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterable, Optional, Sequence
+
+from subc.bytecode import Image, from_bytes
+from subc.virtual_machine import MEMORY_SIZE, execute
+
+CHUNK_SIZE = 16  # jobs sent to a worker at a time
+
+worker = None  # the Worker of a pool process
+
+
+class Result:
+    """the outcome of a job"""
+
+    __slots__ = ("exit_code", "output", "error", "seconds")
+
+    def __init__(
+        self,
+        exit_code: Optional[int],
+        output: bytes,
+        error: Optional[str],
+        seconds: float,
+    ) -> None:
+        self.exit_code = exit_code  # None if the run failed
+        self.output = output
+        self.error = error  # why the run failed
+        self.seconds = seconds
+
+
+class BatchStats:
+    """throughput of the batches run, updated as each one ends"""
+
+    __slots__ = ("jobs", "failures", "seconds", "busy", "workers")
+
+    def __init__(self) -> None:
+        self.jobs = 0
+        self.failures = 0
+        self.seconds = 0.0  # from the start to the end of the batches
+        self.busy = 0.0  # seconds the workers spent running jobs
+        self.workers = 0  # processes of the last pool
+
+    def __str__(self) -> str:
+        rate = self.jobs / self.seconds if self.seconds else 0.0
+        use = self.busy / (self.seconds * self.workers) if self.seconds else 0.0
+        return (
+            f"{self.jobs} jobs, {self.failures} failed, in {self.seconds:.3f} s, "
+            f"{rate:.1f} jobs/s on {self.workers} workers, {use:.0%} busy"
+        )
+
+
+class Worker:
+    """the images shared with a pool process and how it runs them"""
+
+    __slots__ = ("block", "images", "engine", "memory_size")
+
+    def __init__(self, name: str, spans: list, engine: str, memory_size: int) -> None:
+        self.block = shared_memory.SharedMemory(name)
+        self.images = [from_bytes(self.block.buf[start:end]) for start, end in spans]
+        self.engine = engine
+        self.memory_size = memory_size
+
+    def run(self, job: tuple) -> Result:
+        program, patches = job
+        image = self.images[program]
+        sink = io.BytesIO()
+        start = time.perf_counter()
+        try:
+            data = image.data
+            if patches:
+                data = bytearray(data)
+                for address, value in patches.items():
+                    if address < 0 or address + len(value) > len(data):
+                        raise IndexError(
+                            f"{len(value)} bytes at {address} are outside the data"
+                        )
+                    data[address : address + len(value)] = value
+            exit_code = execute(
+                image.pc_start,
+                image.code,
+                data,
+                self.engine,
+                self.memory_size,
+                sink=sink,
+            )
+            error = None
+        except Exception as exception:  # the other jobs go on
+            exit_code, error = None, f"{type(exception).__name__}: {exception}"
+        return Result(exit_code, sink.getvalue(), error, time.perf_counter() - start)
+
+
+def start_worker(name: str, spans: list, engine: str, memory_size: int) -> None:
+    global worker
+    worker = Worker(name, spans, engine, memory_size)
+
+
+def run_job(job: tuple) -> Result:
+    return worker.run(job)
+
+
+def inputs(
+    variables: dict[str, tuple[int, int]], values: dict[str, int]
+) -> dict[int, bytes]:
+    """the bytes setting globals to values, by name; variables gives the
+    address and size of each global, as Compiler.globals does"""
+    patches = {}
+    for name, value in values.items():
+        if name not in variables:
+            raise ValueError(f"the program has no global {name}")
+        address, size = variables[name]
+        patches[address] = (value & (1 << 8 * size) - 1).to_bytes(size, "little")
+    return patches
+
+
+def run_batch(
+    images: Sequence[Image],
+    jobs: Iterable[tuple[int, dict[int, bytes]]],
+    engine: str = "switch",
+    memory_size: int = MEMORY_SIZE,
+    workers: Optional[int] = None,
+    stats: Optional[BatchStats] = None,
+) -> list[Result]:
+    """Runs the jobs on a pool of workers, one per core unless given.
+
+    A job is the index of the image to run and the bytes to write over its
+    data segment by address. The results are in the order of the jobs;
+    the throughput of the batch is counted in stats when given.
+    """
+    blobs = [image.to_bytes() for image in images]
+    spans = []
+    offset = 0
+    for blob in blobs:
+        spans.append((offset, offset + len(blob)))
+        offset += len(blob)
+    workers = workers or os.cpu_count() or 1
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for blob, (start, end) in zip(blobs, spans):
+            block.buf[start:end] = blob
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            workers,
+            initializer=start_worker,
+            initargs=(block.name, spans, engine, memory_size),
+        ) as pool:
+            results = list(pool.map(run_job, jobs, chunksize=CHUNK_SIZE))
+        if stats is not None:
+            stats.jobs += len(results)
+            stats.failures += sum(result.error is not None for result in results)
+            stats.seconds += time.perf_counter() - start
+            stats.busy += sum(result.seconds for result in results)
+            stats.workers = workers
+        return results
+    finally:
+        block.close()
+        block.unlink()
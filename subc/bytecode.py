@@ -0,0 +1,102 @@
+"""Binary format of compiled programs.
+
+An image is the program assembled into int32 words, numeric opcodes with
+their operands inline at the same addresses as in the compiler's list,
+followed by a stub that exits with main's return value. On disk it is a
+header, the code words and the data segment bytes, all little endian, so
+that a file can be mapped into memory and run without parsing:
+
+    magic  version  entry point  code words  data bytes
+    4s     I        i            I           I
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+from subc.code_manager import OPERAND_OPCODES, WIDE_OPCODES, Opcode, wrap
+from subc.scope_manager import Sizes
+
+MAGIC = b"SUBC"
+VERSION = 1
+HEADER = struct.Struct("<4sIiII")
+
+# where main returns to: exit with its return value
+EXIT_STUB = (Opcode.PSH, Opcode.EXIT, Sizes.Int)
+
+# words taken by an instruction, its opcode included
+INSTRUCTION_SIZES = {
+    opcode: (
+        3 if opcode.name in WIDE_OPCODES else 2 if opcode.name in OPERAND_OPCODES else 1
+    )
+    for opcode in Opcode
+}
+
+
+class Image:
+    """an assembled program: its entry point, code words and data segment"""
+
+    __slots__ = ("pc_start", "code", "data")
+
+    def __init__(self, pc_start: int, code, data) -> None:
+        self.pc_start = pc_start
+        self.code = code  # array('i') or a memoryview cast to 'i'
+        self.data = data  # bytes-like
+
+    def to_bytes(self) -> bytes:
+        """the image in the file format"""
+        code = array("i", self.code)
+        if sys.byteorder == "big":
+            code.byteswap()
+        header = HEADER.pack(MAGIC, VERSION, self.pc_start, len(code), len(self.data))
+        return header + code.tobytes() + bytes(self.data)
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, "wb") as file:
+            file.write(self.to_bytes())
+
+
+def assemble(pc_start: int, program: list, data_segment: list) -> Image:
+    """encode the compiler's opcode names and operands into words, wrapping
+    operands out of range as the VM wraps the words it stores"""
+    code = array("i")
+    pc = 0
+    while pc < len(program):
+        opcode = program[pc]
+        size = INSTRUCTION_SIZES[Opcode[opcode]]
+        code.append(Opcode[opcode])
+        code.extend(wrap(int(operand)) for operand in program[pc + 1 : pc + size])
+        pc += size
+    code.extend(EXIT_STUB)
+    return Image(pc_start, code, bytes(data_segment))
+
+
+def from_bytes(buffer) -> Image:
+    """the image in a buffer in the file format, sharing its memory"""
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise ValueError("truncated subc image")
+    magic, version, pc_start, words, size = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a subc image of this version")
+    end = HEADER.size + words * Sizes.Int
+    if len(view) < end + size:
+        raise ValueError("truncated subc image")
+    code = view[HEADER.size : end].cast("i")
+    if sys.byteorder == "big":
+        code = array("i", code)
+        code.byteswap()
+    return Image(pc_start, code, view[end : end + size])
+
+
+def is_image(file_name: str) -> bool:
+    """whether the file holds an image rather than source code"""
+    with open(file_name, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def load(file_name: str) -> Image:
+    """map an image file into memory"""
+    with open(file_name, "rb") as file:
+        return from_bytes(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
@@ -0,0 +1,113 @@
+"""On-disk cache of compiled programs.
+
+Entries are keyed by a hash of the source, of the compiler's own source
+and of the compile options, so editing either misses the cache. Each is a
+program image in the subc.bytecode format, written atomically and mapped
+into memory on a hit; reading one bumps its mtime, and the least recently
+used entries are evicted once the cache outgrows its size limit.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import subc
+from subc.bytecode import Image, load
+
+CACHE_DIR = Path(
+    os.environ.get("SUBC_CACHE_DIR")
+    or Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "subc"
+)
+MAX_SIZE = 64 << 20  # bytes
+
+# modules whose code determines the compiled program
+COMPILER_MODULES = (
+    "grammar",
+    "tokenizer",
+    "scope_manager",
+    "code_manager",
+    "compiler",
+    "syscalls",  # builtins are compiled to their numbers
+    "bytecode",
+    "ir",
+    "optimizer",
+)
+
+_compiler_hash: Optional[bytes] = None
+
+
+def compiler_hash() -> bytes:
+    """hash of the compiler's source code"""
+    global _compiler_hash
+    if _compiler_hash is None:
+        digest = hashlib.sha256()
+        package = Path(subc.__file__).parent
+        for module in COMPILER_MODULES:
+            digest.update((package / f"{module}.py").read_bytes())
+        _compiler_hash = digest.digest()
+    return _compiler_hash
+
+
+def source_key(file_name: str, *options) -> str:
+    """cache key of a source file compiled with the given options"""
+    digest = hashlib.sha256(compiler_hash())
+    digest.update(repr(options).encode())
+    with open(file_name, "rb") as source:
+        while chunk := source.read(1 << 16):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Cache:
+    """a directory of compiled programs, bounded to max_size bytes"""
+
+    def __init__(self, directory: Path = CACHE_DIR, max_size: int = MAX_SIZE) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.subc"
+
+    def get(self, key: str) -> Optional[Image]:
+        """the program image stored under key, if any"""
+        path = self.path(key)
+        try:
+            image = load(str(path))
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)  # recently used, so evicted last
+        except OSError:
+            pass  # e.g. a read-only cache, or the entry was just evicted
+        return image
+
+    def put(self, key: str, image: Image) -> None:
+        """store a program image under key, evicting old entries"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as entry:
+                entry.write(image.to_bytes())
+            os.replace(temp, self.path(key))
+        except BaseException:
+            os.unlink(temp)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """remove the least recently used entries above max_size"""
+        entries = []
+        for path in self.directory.glob("*.subc"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -1,3 +1,164 @@
+import enum
+
+WORD_BITS = 32
+
+
+def wrap(value: int) -> int:
+    """value as a signed word, wrapped in two's complement as the VM stores it"""
+    return (value + (1 << WORD_BITS - 1) & (1 << WORD_BITS) - 1) - (1 << WORD_BITS - 1)
+
+
+# system calls, emitted as opcodes of their own followed by the size of
+# their arguments on the stack, or for SYS by the number of the builtin of
+# subc.syscalls it calls
+SYSCALL_OPCODES = {"MALLOC", "FREE", "PRINTF", "EXIT", "SYS"}
+
+# binary operators with an immediate right operand: PSH IMM k OP -> OPI k
+IMMEDIATE_OPCODES = {
+    op: op + "I"
+    for op in (
+        "ADD",
+        "SUB",
+        "SHL",
+        "SHR",
+        "AND",
+        "EQL",
+        "NEQ",
+        "LSS",
+        "GTR",
+        "LEQ",
+        "GEQ",
+    )
+}
+
+# loads and stores of locals and globals fused with their address
+FUSED_LOAD_STORE_OPCODES = {"LLI", "LLC", "LGI", "LGC", "SLI", "SLC", "SGI", "SGC"}
+
+# comparisons fused with a following BZ: the branch is taken when the
+# comparison fails and ax is left holding its result, as with the pair
+BRANCH_OPCODES = {
+    "LSS": "BGE",
+    "GTR": "BLE",
+    "LEQ": "BGT",
+    "GEQ": "BLT",
+    "EQL": "BNE",
+    "NEQ": "BEQ",
+}
+
+# compare-and-branch with an immediate: PSH IMM k BGE L -> BGEI k L
+IMMEDIATE_BRANCH_OPCODES = {op: op + "I" for op in BRANCH_OPCODES.values()}
+
+# opcodes that are followed by an operand
+OPERAND_OPCODES = {
+    "LEA",
+    "IMM",
+    "JMP",
+    "JSR",
+    "TCALL",
+    "BZ",
+    "BNZ",
+    "ENT",
+    "ADJ",
+    *SYSCALL_OPCODES,
+    *IMMEDIATE_OPCODES.values(),
+    *FUSED_LOAD_STORE_OPCODES,
+    *BRANCH_OPCODES.values(),
+    *IMMEDIATE_BRANCH_OPCODES.values(),
+}
+
+# opcodes followed by a second operand
+WIDE_OPCODES = {"TCALL", *IMMEDIATE_BRANCH_OPCODES.values()}
+
+# opcodes whose (last) operand is a code address
+JUMP_OPCODES = {
+    "JMP",
+    "JSR",
+    "TCALL",
+    "BZ",
+    "BNZ",
+    *BRANCH_OPCODES.values(),
+    *IMMEDIATE_BRANCH_OPCODES.values(),
+}
+
+# opcodes calling a function: JSR f and the tail call TCALL n f, which
+# moves the n bytes of arguments on the stack over those of the current
+# function and jumps to f in its place
+CALL_OPCODES = {"JSR", "TCALL"}
+
+
+class Opcode(enum.IntEnum):
+    """numeric opcodes of assembled programs, named as the compiler emits them"""
+
+    LEA = enum.auto()
+    IMM = enum.auto()
+    JMP = enum.auto()
+    JSR = enum.auto()
+    TCALL = enum.auto()
+    BZ = enum.auto()
+    BNZ = enum.auto()
+    ENT = enum.auto()
+    ADJ = enum.auto()
+    RET = enum.auto()
+    LI = enum.auto()
+    LC = enum.auto()
+    SI = enum.auto()
+    SC = enum.auto()
+    PSH = enum.auto()
+    IOR = enum.auto()
+    XOR = enum.auto()
+    AND = enum.auto()
+    EQL = enum.auto()
+    NEQ = enum.auto()
+    LSS = enum.auto()
+    GTR = enum.auto()
+    LEQ = enum.auto()
+    GEQ = enum.auto()
+    SHL = enum.auto()
+    SHR = enum.auto()
+    ADD = enum.auto()
+    SUB = enum.auto()
+    MUL = enum.auto()
+    DIV = enum.auto()
+    MOD = enum.auto()
+    NEG = enum.auto()
+    LLI = enum.auto()
+    LLC = enum.auto()
+    SLI = enum.auto()
+    SLC = enum.auto()
+    LGI = enum.auto()
+    LGC = enum.auto()
+    SGI = enum.auto()
+    SGC = enum.auto()
+    BGE = enum.auto()
+    BLE = enum.auto()
+    BGT = enum.auto()
+    BLT = enum.auto()
+    BNE = enum.auto()
+    BEQ = enum.auto()
+    BGEI = enum.auto()
+    BLEI = enum.auto()
+    BGTI = enum.auto()
+    BLTI = enum.auto()
+    BNEI = enum.auto()
+    BEQI = enum.auto()
+    ADDI = enum.auto()
+    SUBI = enum.auto()
+    SHLI = enum.auto()
+    SHRI = enum.auto()
+    ANDI = enum.auto()
+    EQLI = enum.auto()
+    NEQI = enum.auto()
+    LSSI = enum.auto()
+    GTRI = enum.auto()
+    LEQI = enum.auto()
+    GEQI = enum.auto()
+    PRINTF = enum.auto()
+    MALLOC = enum.auto()
+    FREE = enum.auto()
+    EXIT = enum.auto()
+    SYS = enum.auto()
+
+
 class Program:
     def __init__(self):
         self.instructions = []
@@ -8,7 +169,9 @@ class Program:
         opcodes = (x for x in self.instructions)
         for opcode in opcodes:
             asm += opcode
-            if opcode in {"LEA", "IMM", "JMP", "JSR", "BZ", "BNZ", "ENT", "ADJ"}:
+            if opcode in OPERAND_OPCODES:
+                asm += f" {next(opcodes)}"
+            if opcode in WIDE_OPCODES:
                 asm += f" {next(opcodes)}"
             asm += "\n"
 
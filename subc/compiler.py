@@ -1,29 +1,37 @@
 import sys
-from typing import Iterator, Optional
+from typing import Iterable, Optional
 
-from subc.code_manager import Program
+from subc.code_manager import BRANCH_OPCODES, Program
 from subc.grammar import get_prec
 from subc.scope_manager import RedeclaredError, SymbolTable, Types, UndeclaredError
+from subc.syscalls import BUILTINS
 from subc.tokenizer import Token
 
 # identifier kinds
-LOCAL, GLOBAL, MEMBER, FUNC, SYS, ENUM, *_ = range(10)
+LOCAL, GLOBAL, MEMBER, FUNC, SYS, ENUM, BUILTIN, *_ = range(10)
 
 
 class Compiler:
-    def __init__(self, tokens: Iterator[Token]) -> None:
-        self.tokens = tokens
+    def __init__(self, tokens: Iterable[Token]) -> None:
+        self.tokens = iter(tokens)
         self.curr_tk = next(self.tokens)
         self.curr_ty = Types.Int
         self.symbol_table = SymbolTable()
         self.program = Program()
         self.data_segment: list[int] = []
+        self.jump_target = -1  # latest address backpatched into a jump
+        self.last_call: tuple[int, int] = (-1, 0)  # address and argument size
+        self.sz_params = 0  # of the function being compiled
+        self.tail_calls: list[int] = []  # addresses of its TCALLs
+        self.address_taken = False  # whether it takes the address of a local
 
         # Declare system calls
         self.symbol_table.declare_id("malloc", Types.Void + Types.Ptr, "MALLOC", SYS)
         self.symbol_table.declare_id("free", Types.Void, "FREE", SYS)
         self.symbol_table.declare_id("printf", Types.Int, "PRINTF", SYS)
         self.symbol_table.declare_id("exit", Types.Int, "EXIT", SYS)
+        for number, builtin in enumerate(BUILTINS):
+            self.symbol_table.declare_id(builtin.name, Types.Int, number, BUILTIN)
 
     def error(self, msg: str) -> None:
         """Raise error"""
@@ -45,6 +53,66 @@ class Compiler:
             self.error(msg or f"expected {token}")
         return lexeme
 
+    def expect_number(self) -> int:
+        """expect a number or character literal and return its value"""
+        lexeme = self.expect("Num")
+        return ord(lexeme[1]) if lexeme.startswith("'") else int(lexeme)
+
+    def backpatch(self, index: int) -> None:
+        """make the jump operand at index point to the end of the program"""
+        self.program[index] = self.jump_target = len(self.program)
+
+    def branch_if_false(self) -> int:
+        """emit a branch taken when ax is zero, fused with the comparison that
+        computed ax if there is one; returns the index to backpatch"""
+        end = len(self.program)  # not a jump target, e.g. the end of a || b
+        if self.program[-1] in BRANCH_OPCODES and self.jump_target != end:
+            self.program[-1] = BRANCH_OPCODES[self.program[-1]]
+        else:
+            self.program.add("BZ")
+        self.program.add(0)
+        return len(self.program) - 1
+
+    def tail_call(self) -> None:
+        """turn a call whose value is returned into a TCALL reusing the frame,
+        when the callee takes no more arguments than the current function"""
+        index, sz_params = self.last_call
+        end = index + (4 if sz_params else 2)
+        if (
+            end == len(self.program)
+            and self.jump_target != end  # e.g. return a ? f(x) : g(y)
+            and sz_params <= self.sz_params
+        ):
+            address = self.program[index + 1]
+            del self.program.instructions[index:]
+            self.tail_calls.append(index)
+            self.program.add("TCALL", sz_params, address)
+
+    def keep_frame(self) -> None:
+        """turn the TCALLs of a function that took the address of one of its
+        locals or parameters back into calls, since the callee may use it:
+        JSR f, RET takes the words of TCALL n f"""
+        if self.address_taken:
+            for index in self.tail_calls:
+                address = self.program[index + 2]
+                self.program.instructions[index : index + 3] = ["JSR", address, "RET"]
+
+    def functions(self) -> dict[str, int]:
+        """get the code address of each function"""
+        return {
+            name: ident.value
+            for name, ident in self.symbol_table.levels[0].identifiers.items()
+            if ident.kind == FUNC
+        }
+
+    def globals(self) -> dict[str, tuple[int, int]]:
+        """get the data segment address and size of each global variable"""
+        return {
+            name: (ident.value, self.symbol_table.sizeof(ident.type))
+            for name, ident in self.symbol_table.levels[0].identifiers.items()
+            if ident.kind == GLOBAL
+        }
+
     ###########################################################
     ## EXPRESSION PARSER
     ###########################################################
@@ -52,12 +120,12 @@ class Compiler:
     def parse_expression(self, level: int = 0) -> None:
         # parse factor
         if self.curr_tk.type == "Num":
-            self.program.add("IMM", self.expect("Num"))
+            self.program.add("IMM", self.expect_number())
             self.curr_ty = Types.Int
 
         elif self.curr_tk.type == "Str":
             self.program.add("IMM", len(self.data_segment))
-            self.data_segment.extend(list(self.expect("Str")))
+            self.data_segment.extend(self.expect("Str").encode())
             self.data_segment.append(0)
             self.curr_ty = Types.Char + Types.Ptr
 
@@ -65,7 +133,7 @@ class Compiler:
             ident = self.symbol_table.get_id(self.expect("Id"))
 
             if self.accept("("):  # parse function call
-                if ident.kind not in (FUNC, SYS):
+                if ident.kind not in (FUNC, SYS, BUILTIN):
                     self.error("identifier is not a function")
                 sz_params = 0
                 while not self.accept(")"):
@@ -76,8 +144,12 @@ class Compiler:
                         self.expect(",")
 
                 if ident.kind == FUNC:
-                    self.program.add("JSR")
-                self.program.add(ident.value)
+                    self.last_call = (len(self.program), sz_params)
+                    self.program.add("JSR", ident.value)
+                elif ident.kind == BUILTIN:
+                    self.program.add("SYS", ident.value)
+                else:
+                    self.program.add(ident.value, sz_params)
 
                 if sz_params:
                     self.program.add("ADJ", sz_params)
@@ -132,9 +204,13 @@ class Compiler:
             self.program.add("LC" if self.curr_ty == Types.Char else "LI")
 
         elif self.accept("&"):  # address-of
+            start = len(self.program)
             self.parse_expression(get_prec("++"))
             if self.program[-1] in ("LC", "LI"):
                 self.program.instructions.pop()
+            code = self.program.instructions[start:]
+            if code[0] == "LEA" and (len(code) == 2 or code[2] not in ("LC", "LI")):
+                self.address_taken = True  # not through a pointer held there
             self.curr_ty += Types.Ptr
 
         elif self.curr_tk.type in ("++", "--"):  # pre-inc/dec
@@ -144,6 +220,7 @@ class Compiler:
             self.parse_expression(get_prec("++"))
             if not self.program[-1] in ("LC", "LI"):
                 self.error("bad lvalue in pre-increment")
+            self.program.instructions.insert(-1, "PSH")
             sz = self.symbol_table.get_add_size(self.curr_ty)
             self.program.add(
                 "PSH",
@@ -168,13 +245,11 @@ class Compiler:
             self.curr_ty = Types.Int
 
         elif self.accept("-"):  # unary minus
-            self.program.add("IMM")
             if self.curr_tk.type == "Num":
-                self.program.add(-int(self.expect("Num")))
+                self.program.add("IMM", -self.expect_number())
             else:
-                self.program.add(-1, "PSH")
                 self.parse_expression(get_prec("++"))
-                self.program.add("MUL")
+                self.program.add("PSH", "IMM", -1, "MUL")
 
         else:
             self.error("bad expression")
@@ -192,28 +267,26 @@ class Compiler:
                 self.program.add("SC" if self.curr_ty == Types.Char else "SI")
 
             elif self.accept("?"):  # ternary
-                self.program.add("BZ", 0)
-                b = len(self.program) - 1
+                b = self.branch_if_false()
                 self.parse_expression()
                 self.program.add("JMP", 0)
-                self.program[b] = len(self.program)
+                self.backpatch(b)
                 b = len(self.program) - 1
                 self.expect(":")
                 self.parse_expression(get_prec("?"))
-                self.program[b] = len(self.program)
+                self.backpatch(b)
 
             elif self.accept("||"):
                 self.program.add("BNZ", 0)
                 b = len(self.program) - 1
                 self.parse_expression(get_prec("&&"))
-                self.program[b] = len(self.program)
+                self.backpatch(b)
                 self.curr_ty = Types.Int
 
             elif self.accept("&&"):
-                self.program.add("BZ", 0)
-                b = len(self.program) - 1
+                b = self.branch_if_false()
                 self.parse_expression(get_prec("|"))
-                self.program[b] = len(self.program)
+                self.backpatch(b)
                 self.curr_ty = Types.Int
 
             elif self.accept("+"):
@@ -304,7 +377,7 @@ class Compiler:
                 ):
                     if self.accept(op):
                         self.program.add("PSH")
-                        self.parse_expression(get_prec(prec) + 1)
+                        self.parse_expression(get_prec(op) + 1)
                         self.program.add(prec)
                         self.curr_ty = Types.Int
                         break
@@ -325,29 +398,28 @@ class Compiler:
             self.expect("(")
             self.parse_expression()
             self.expect(")")
-            self.program.add("BZ", 0)
-            b = len(self.program) - 1
+            b = self.branch_if_false()
             offset = self.parse_statement(offset)
             if self.accept("else"):
                 self.program.add("JMP", 0)
-                self.program[b] = len(self.program)
+                self.backpatch(b)
                 b = len(self.program) - 1
                 offset = self.parse_statement(offset)
-            self.program[b] = len(self.program)
+            self.backpatch(b)
 
         elif self.accept("while"):
             a = len(self.program)
             self.expect("(")
             self.parse_expression()
             self.expect(")")
-            self.program.add("BZ", 0)
-            b = len(self.program) - 1
+            b = self.branch_if_false()
             offset = self.parse_statement(offset)
             self.program.add("JMP", a)
-            self.program[b] = len(self.program)
+            self.backpatch(b)
 
         elif self.accept("return"):
             self.parse_expression()
+            self.tail_call()
             self.program.add("RET")
             self.expect(";")
 
@@ -383,7 +455,7 @@ class Compiler:
                 while not self.accept("}"):
                     name = self.expect("Id")
                     if self.accept("="):
-                        i = int(self.expect("Num"))
+                        i = self.expect_number()
                     self.symbol_table.declare_id(name, Types.Int, i, ENUM)
                     if not self.curr_tk.type == "}":
                         self.expect(",", "expected , or }")
@@ -415,6 +487,10 @@ class Compiler:
                 ty += Types.Ptr
 
             name = self.expect("Id")
+            if kind == GLOBAL:  # a definition of the program shadows a builtin
+                builtin = self.symbol_table.levels[0].identifiers.get(name)
+                if builtin is not None and builtin.kind == BUILTIN:
+                    del self.symbol_table.levels[0].identifiers[name]
 
             if kind == GLOBAL and self.accept("("):  # parse function declaration
                 self.symbol_table.declare_id(name, ty, len(self.program), FUNC)
@@ -424,12 +500,16 @@ class Compiler:
                 while not self.accept(")"):  # parse parameter declarations
                     i = self.parse_declaration(FUNC, i)
                 self.symbol_table.fix_params(i)
+                self.sz_params = i
+                self.tail_calls = []
+                self.address_taken = False
 
                 self.expect("{")
-                i = 4
+                i = 0
                 while not self.accept("}"):  # parse function body
                     i = self.parse_statement(i)
 
+                self.keep_frame()
                 self.program.add("RET")
                 self.symbol_table.destroy_scope()
                 return offset
@@ -437,20 +517,24 @@ class Compiler:
             if self.symbol_table.sizeof(ty) == 0:
                 self.error("incomplete type")
 
-            offset = self.symbol_table.align(offset, ty)
-
-            if kind == MEMBER:  # parse struct or union member declaration
-                self.symbol_table.update_alignment(tag_type, ty)
-                self.symbol_table.declare_member(tag_type, name, ty, offset)
+            size = self.symbol_table.sizeof(ty)
+            if kind == LOCAL:  # below the locals so far, keeping sp int aligned
+                size = self.symbol_table.align(size, Types.Int)
+                self.symbol_table.declare_id(name, ty, -(offset + size), LOCAL)
+                self.program.add("ADJ", -size)
 
-            elif kind == LOCAL:
-                self.symbol_table.declare_id(name, ty, -offset, LOCAL)
-                self.program.add("ADJ", -self.symbol_table.sizeof(ty))
+            elif kind == GLOBAL:  # zeroed, in the data segment after the strings so far
+                offset = self.symbol_table.align(len(self.data_segment), ty)
+                self.data_segment.extend(bytes(offset + size - len(self.data_segment)))
+                self.symbol_table.declare_id(name, ty, offset, GLOBAL)
 
-            else:  # normal variable declaration
-                self.symbol_table.declare_id(
-                    name, ty, offset, kind if kind != FUNC else LOCAL
-                )
+            else:
+                offset = self.symbol_table.align(offset, ty)
+                if kind == MEMBER:  # parse struct or union member declaration
+                    self.symbol_table.update_alignment(tag_type, ty)
+                    self.symbol_table.declare_member(tag_type, name, ty, offset)
+                else:  # function parameter
+                    self.symbol_table.declare_id(name, ty, offset, LOCAL)
 
             if self.accept("="):  # assignment declaration
                 address = self.symbol_table.get_id(name).value
@@ -458,7 +542,7 @@ class Compiler:
                 self.parse_expression()
                 self.program.add("SC" if ty == Types.Char else "SI")
 
-            offset += self.symbol_table.sizeof(ty)
+            offset += size
 
             if kind == FUNC:  # function parameters should be aligned to int
                 offset = self.symbol_table.align(offset, Types.Int)
@@ -473,7 +557,7 @@ class Compiler:
 
     def parse_global_declarations(self) -> None:
         """parse global declarations"""
-        offset = len(self.data_segment)
+        offset = 0
         while self.curr_tk:
             try:
                 offset = self.parse_declaration(GLOBAL, offset)
@@ -0,0 +1,191 @@
+"""Allocator of the VM's heap, between the data segment and the stack.
+
+Blocks live in VM memory, each behind a 4-byte header holding its size, a
+multiple of 8 that includes the header, and two flags: whether the block
+is in use and whether the block before it is. Payloads are 8-byte aligned.
+
+Blocks of at most SMALL_MAX bytes are small: freed, they go on the free
+list of their size class, linked through their payloads, and stay marked
+in use so that they are never coalesced. Larger free blocks also end in a
+footer repeating their size, the boundary tag that lets free merge a block
+with free neighbours in O(1); they are kept in doubly linked lists binned
+by powers of two. New blocks are carved from the top of the heap, which
+grows towards the stack and comes back down when its last block is freed.
+
+The module only uses the standard library, so that modules translated by
+subc.aot can carry a copy of it.
+"""
+
+import struct
+
+WORD = struct.Struct("<I")
+
+USED = 1
+PREV_USED = 2  # the block before is in use, so has no footer to read
+MIN_BLOCK = 16  # header, the two links of a free block and its footer
+SMALL_MAX = 128  # largest small block, header included
+STACK_GAP = 1024  # bytes the heap leaves free below the stack pointer
+
+
+class HeapStats:
+    """allocations and use of the heap, updated as the program runs"""
+
+    __slots__ = ("mallocs", "frees", "live", "peak", "size", "heap")
+
+    def __init__(self) -> None:
+        self.mallocs = 0
+        self.frees = 0
+        self.live = 0  # bytes in blocks in use, headers included
+        self.peak = 0  # most live bytes at any time
+        self.size = 0  # bytes between the bottom and the top of the heap
+        self.heap = None  # the heap of the last run
+
+    @property
+    def fragmentation(self) -> float:
+        """share of the free bytes below the top of the heap that are not
+        in the largest free block"""
+        free = self.size - self.live
+        if not free or self.heap is None:
+            return 0.0
+        return 1 - self.heap.largest_free() / free
+
+    def __str__(self) -> str:
+        return (
+            f"{self.mallocs} mallocs, {self.frees} frees, {self.live} bytes live, "
+            f"{self.peak} peak, {self.size} heap, {self.fragmentation:.1%} fragmented"
+        )
+
+
+class Heap:
+    """the blocks between start and top in the memory of a program"""
+
+    def __init__(self, memory, start: int, stats=None) -> None:
+        self.memory = memory
+        self.start = ((start + 3) & -8) + 4  # headers at 8k + 4, payloads at 8k
+        self.top = self.start  # where the next block is carved
+        self.small = [0] * (SMALL_MAX // 8 + 1)  # free payloads by size // 8
+        self.large = [0] * 33  # free blocks by size.bit_length()
+        self.stats = HeapStats() if stats is None else stats
+        self.stats.heap = self
+
+    def word(self, address: int) -> int:
+        return WORD.unpack_from(self.memory, address)[0]
+
+    def set_word(self, address: int, value: int) -> None:
+        WORD.pack_into(self.memory, address, value)
+
+    def malloc(self, n: int, sp: int) -> int:
+        """address of a payload of at least n bytes, 0 if the heap cannot
+        grow that much below the stack at sp"""
+        size = max(MIN_BLOCK, (n + 4 + 7) & -8)
+        if size <= SMALL_MAX and self.small[size >> 3]:
+            payload = self.small[size >> 3]
+            self.small[size >> 3] = self.word(payload)
+        else:
+            block = self.take(size)
+            if not block:
+                if self.top + size > sp - STACK_GAP:
+                    return 0
+                block = self.top
+                self.top += size
+                self.set_word(block, size | USED | PREV_USED)
+            size = self.word(block) & -8
+            payload = block + 4
+
+        stats = self.stats
+        stats.mallocs += 1
+        stats.live += size
+        stats.peak = max(stats.peak, stats.live)
+        stats.size = self.top - self.start
+        return payload
+
+    def take(self, size: int) -> int:
+        """a free block of at least size bytes marked in use, split if it is
+        larger, or 0"""
+        k = size.bit_length()
+        block = self.large[k]
+        while block and self.word(block) & -8 < size:
+            block = self.word(block + 4)
+        if not block:
+            k = next((k for k in range(k + 1, len(self.large)) if self.large[k]), 0)
+            block = self.large[k]
+            if not block:
+                return 0
+        found = self.word(block) & -8
+        self.unlink(block, found)
+        if found - size >= MIN_BLOCK:
+            self.insert(block + size, found - size)
+            found = size
+        elif block + found < self.top:
+            following = block + found
+            self.set_word(following, self.word(following) | PREV_USED)
+        self.set_word(block, found | USED | PREV_USED)
+        return block
+
+    def free(self, payload: int) -> None:
+        """release the block of a payload returned by malloc"""
+        if not payload:
+            return
+        block = payload - 4
+        header = self.word(block)
+        size = header & -8
+        stats = self.stats
+        stats.frees += 1
+        stats.live -= size
+
+        if size <= SMALL_MAX:
+            self.set_word(payload, self.small[size >> 3])
+            self.small[size >> 3] = payload
+            return
+
+        if not header & PREV_USED:  # merge with the free block before
+            before = self.word(block - 4)
+            block -= before
+            size += before
+            self.unlink(block, before)
+        following = block + size
+        if following == self.top:  # give the block back to the top
+            self.top = block
+            stats.size = self.top - self.start
+            return
+        header = self.word(following)
+        if not header & USED:  # merge with the free block after
+            self.unlink(following, header & -8)
+            size += header & -8
+        else:
+            self.set_word(following, header & ~PREV_USED)
+        self.insert(block, size)
+
+    def insert(self, block: int, size: int) -> None:
+        """mark the block free and put it on the list of its bin; no two
+        free blocks are adjacent, so the block before is in use"""
+        self.set_word(block, size | PREV_USED)
+        self.set_word(block + size - 4, size)
+        k = size.bit_length()
+        head = self.large[k]
+        self.set_word(block + 4, head)
+        self.set_word(block + 8, 0)
+        if head:
+            self.set_word(head + 8, block)
+        self.large[k] = block
+
+    def unlink(self, block: int, size: int) -> None:
+        following, before = self.word(block + 4), self.word(block + 8)
+        if before:
+            self.set_word(before + 4, following)
+        else:
+            self.large[size.bit_length()] = following
+        if following:
+            self.set_word(following + 8, before)
+
+    def largest_free(self) -> int:
+        """size of the largest free block, free small blocks included"""
+        largest = (
+            max((size for size, head in enumerate(self.small) if head), default=0) * 8
+        )
+        for head in self.large:
+            block = head
+            while block:
+                largest = max(largest, self.word(block) & -8)
+                block = self.word(block + 4)
+        return largest
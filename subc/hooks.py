@@ -0,0 +1,188 @@
+"""Callbacks observing a run, and binary traces of its instructions.
+
+execute(..., hooks=...) runs the program on the handlers of the table
+engine through the dispatch loop of run_hooks, which only calls the
+methods that the Hooks given override; the engines' own loops stay as
+fast as without hooks. Trace records each instruction in a ring of
+packed records, written to a file a full ring at a time:
+
+    python -m subc examples/fib.c --trace fib.trace
+    python -m subc.hooks fib.trace
+"""
+
+import struct
+import sys
+from typing import BinaryIO, Iterator, Optional
+
+from subc.code_manager import Opcode
+from subc.syscalls import BUILTINS
+
+load_word = struct.Struct("<i").unpack_from
+
+JSR, TCALL, RET, PSH, SYS = map(
+    int, (Opcode.JSR, Opcode.TCALL, Opcode.RET, Opcode.PSH, Opcode.SYS)
+)
+SYSCALLS = {Opcode.PRINTF, Opcode.MALLOC, Opcode.FREE, Opcode.EXIT, SYS}
+WRITES = {
+    Opcode.SI, Opcode.SC, Opcode.SLI, Opcode.SLC, Opcode.SGI, Opcode.SGC,
+    PSH, JSR, TCALL, SYS,
+}  # fmt: skip
+
+MAGIC = b"SUBCTRC\0"
+RECORD = struct.Struct("<IIiII")  # pc, opcode, ax wrapped to 32 bits, sp, bp
+
+
+class Hooks:
+    """callbacks of a run, doing nothing; subclasses override those they
+    need, the others cost nothing"""
+
+    def on_instruction(self, pc: int, opcode: int, ax: int, sp: int, bp: int) -> None:
+        """the instruction at pc is about to run"""
+
+    def on_call(self, pc: int, target: int, tail: bool) -> None:
+        """the JSR at pc, or the TCALL with tail, called the function at target"""
+
+    def on_return(self, pc: int, address: int) -> None:
+        """the RET at pc returned to address"""
+
+    def on_syscall(self, pc: int, name: str, args: tuple) -> None:
+        """the system call at pc, named after its opcode or, for SYS, after
+        the builtin, is about to run with the arguments pushed for it in the
+        order of the call"""
+
+    def on_memory_write(self, pc: int, address: int, data: bytes) -> None:
+        """the instruction at pc wrote data at address; the allocator's
+        own bookkeeping is not reported"""
+
+
+def overridden(hooks: Hooks, name: str):
+    """the method of hooks, or None if it does nothing"""
+    method = getattr(hooks, name)
+    return None if getattr(method, "__func__", None) is getattr(Hooks, name) else method
+
+
+def run_hooks(
+    hooks: Hooks, pc_start: int, program, table: list, memory, registers
+) -> None:
+    """run the program from pc_start like the table engine, calling hooks;
+    registers() gives the current ax, sp and bp"""
+    instruction = overridden(hooks, "on_instruction")
+    call = overridden(hooks, "on_call")
+    ret = overridden(hooks, "on_return")
+    syscall = overridden(hooks, "on_syscall")
+    write = overridden(hooks, "on_memory_write")
+    pc = pc_start
+    while True:
+        opcode = program[pc]
+        if instruction is not None:
+            instruction(pc, opcode, *registers())
+        if syscall is not None and opcode in SYSCALLS:
+            sp = registers()[1]
+            if opcode == SYS:
+                builtin = BUILTINS[program[pc + 1]]
+                name, size = builtin.name, 4 * builtin.arity
+            else:
+                name, size = Opcode(opcode).name, program[pc + 1]
+            top = sp + size - 4  # the first argument is pushed first
+            syscall(
+                pc, name, tuple(load_word(memory, a)[0] for a in range(top, sp - 4, -4))
+            )
+        if write is not None and opcode in WRITES:
+            operand = program[pc + 1] if opcode != PSH else 0
+            address, size = written(opcode, operand, memory, *registers())
+        following = table[opcode](pc + 1)
+        if call is not None and (opcode == JSR or opcode == TCALL):
+            call(pc, following, opcode == TCALL)
+        elif ret is not None and opcode == RET:
+            ret(pc, following)
+        if write is not None and opcode in WRITES and size:
+            write(pc, address, bytes(memory[address : address + size]))
+        pc = following
+
+
+def written(
+    opcode: int, operand: int, memory, ax: int, sp: int, bp: int
+) -> tuple[int, int]:
+    """address and size of the bytes the instruction is about to write"""
+    if opcode in (Opcode.SI, Opcode.SC):
+        return load_word(memory, sp)[0], 4 if opcode == Opcode.SI else 1
+    if opcode in (Opcode.SLI, Opcode.SLC):
+        return bp + operand, 4 if opcode == Opcode.SLI else 1
+    if opcode in (Opcode.SGI, Opcode.SGC):
+        return operand, 4 if opcode == Opcode.SGI else 1
+    if opcode == PSH:
+        return sp - 4, 4
+    if opcode == JSR:  # the return address and bp
+        return sp - 8, 8
+    if opcode == SYS:  # the span given by the first and last arguments
+        builtin = BUILTINS[operand]
+        if not builtin.writes:
+            return 0, 0
+        args = builtin.args(memory, sp)  # the last argument first
+        return args[-1], args[0]
+    return bp + 8, operand  # TCALL copies the arguments over the caller's
+
+
+class Trace(Hooks):
+    """The instructions of a run, packed in a ring of capacity records.
+
+    Without a file the ring keeps the last capacity instructions; with one,
+    a full ring is written to it before it wraps, and flush writes the rest.
+    """
+
+    def __init__(
+        self, capacity: int = 1 << 16, file: Optional[BinaryIO] = None
+    ) -> None:
+        self.ring = bytearray(capacity * RECORD.size)
+        self.capacity = capacity
+        self.count = 0  # records traced
+        self.written = 0  # records written to the file
+        self.file = file
+        if file is not None:
+            file.write(MAGIC)
+
+    def on_instruction(self, pc: int, opcode: int, ax: int, sp: int, bp: int) -> None:
+        if self.count - self.written == self.capacity and self.file is not None:
+            self.flush()
+        ax = (ax + 0x80000000 & 0xFFFFFFFF) - 0x80000000
+        offset = self.count % self.capacity * RECORD.size
+        RECORD.pack_into(self.ring, offset, pc, opcode, ax, sp, bp)
+        self.count += 1
+
+    def flush(self) -> None:
+        """write the records not written yet to the file"""
+        while self.written < self.count:
+            i = self.written % self.capacity
+            n = min(self.count - self.written, self.capacity - i)
+            self.file.write(self.ring[i * RECORD.size : (i + n) * RECORD.size])
+            self.written += n
+        self.file.flush()
+
+    def records(self) -> Iterator[tuple]:
+        """the records in the ring, oldest first"""
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            yield RECORD.unpack_from(self.ring, n % self.capacity * RECORD.size)
+
+
+def read_trace(file: BinaryIO) -> Iterator[tuple]:
+    """the records of a trace file"""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a subc trace")
+    while True:
+        chunk = file.read(RECORD.size * 4096)
+        if not chunk:
+            return
+        yield from RECORD.iter_unpack(chunk)
+
+
+def format_record(record: tuple) -> str:
+    pc, opcode, ax, sp, bp = record
+    return f"{pc:5d}: {Opcode(opcode).name:6s} ax: {ax:11} sp: {sp:8} bp: {bp:8}"
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as trace:
+        sys.stdout.writelines(
+            f"{format_record(record)}\n" for record in read_trace(trace)
+        )
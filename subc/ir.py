@@ -0,0 +1,174 @@
+"""Intermediate representation used by the optimizer.
+
+The flat program is decoded into a list holding (opcode, operand)
+instructions and Labels. Jumps and calls refer to Labels instead of
+addresses, so passes may insert and remove instructions freely; the
+program is encoded again with all addresses relocated once they are done.
+Opcodes with two operands carry them as an (operand, Label) pair.
+
+A function's code can further be split into basic blocks linked into a
+control flow graph, for passes that need to follow control flow.
+"""
+
+from typing import Iterable, Optional
+
+from subc.code_manager import CALL_OPCODES, JUMP_OPCODES, OPERAND_OPCODES, WIDE_OPCODES
+
+
+class Label:
+    """a code address referred to by jumps and calls"""
+
+    __slots__ = ("address",)
+
+    def __init__(self) -> None:
+        self.address: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f"L{self.address}"
+
+
+def decode(program: list, addresses: Iterable[int] = ()) -> tuple[list, dict]:
+    """split the program into instructions, with code addresses replaced by
+    labels; `addresses` get a label even if nothing jumps to them"""
+    labels = {address: Label() for address in addresses}
+    pc = 0
+    while pc < len(program):
+        opcode = program[pc]
+        if opcode in WIDE_OPCODES:
+            labels.setdefault(program[pc + 2], Label())
+            pc += 3
+        elif opcode in OPERAND_OPCODES:
+            if opcode in JUMP_OPCODES:
+                labels.setdefault(program[pc + 1], Label())
+            pc += 2
+        else:
+            pc += 1
+
+    code = []
+    pc = 0
+    while pc < len(program):
+        if pc in labels:
+            code.append(labels[pc])
+        opcode = program[pc]
+        if opcode in WIDE_OPCODES:
+            code.append((opcode, (program[pc + 1], labels[program[pc + 2]])))
+            pc += 3
+        elif opcode in OPERAND_OPCODES:
+            operand = program[pc + 1]
+            code.append(
+                (opcode, labels[operand] if opcode in JUMP_OPCODES else operand)
+            )
+            pc += 2
+        else:
+            code.append((opcode, None))
+            pc += 1
+    if pc in labels:
+        code.append(labels[pc])
+    return code, labels
+
+
+def encode(code: list) -> list:
+    """lay out the instructions, resolving labels to addresses"""
+    pc = 0
+    for item in code:
+        if isinstance(item, Label):
+            item.address = pc
+        else:
+            pc += size(item[0])
+
+    program = []
+    for item in code:
+        if not isinstance(item, Label):
+            opcode, operand = item
+            program.append(opcode)
+            if opcode in WIDE_OPCODES:
+                program.extend((operand[0], operand[1].address))
+            elif opcode in JUMP_OPCODES:
+                program.append(operand.address)
+            elif opcode in OPERAND_OPCODES:
+                program.append(operand)
+    return program
+
+
+def size(opcode: str) -> int:
+    """number of words taken by an instruction"""
+    if opcode in WIDE_OPCODES:
+        return 3
+    return 2 if opcode in OPERAND_OPCODES else 1
+
+
+def target(instr: tuple) -> Label:
+    """the label a jump instruction refers to"""
+    return instr[1][1] if instr[0] in WIDE_OPCODES else instr[1]
+
+
+def retarget(instr: tuple, label: Label) -> tuple:
+    """the jump instruction with its target replaced"""
+    if instr[0] in WIDE_OPCODES:
+        return (instr[0], (instr[1][0], label))
+    return (instr[0], label)
+
+
+def count(code: list) -> int:
+    """number of instructions in the code"""
+    return sum(1 for item in code if not isinstance(item, Label))
+
+
+###########################################################
+## CONTROL FLOW GRAPH
+###########################################################
+
+# opcodes after which execution does not continue with the next instruction
+UNCONDITIONAL_OPCODES = {"JMP", "RET", "TCALL"}
+
+
+class BasicBlock:
+    """straight-line code entered only at the top through its labels"""
+
+    __slots__ = ("labels", "code", "successors")
+
+    def __init__(self) -> None:
+        self.labels: list[Label] = []
+        self.code: list[tuple] = []
+        self.successors: list[BasicBlock] = []
+
+    def __repr__(self) -> str:
+        return f"BasicBlock({self.labels}, {len(self.code)} instructions)"
+
+
+def build_cfg(code: list) -> list[BasicBlock]:
+    """split the code into basic blocks, in code order, and link each block
+    to the blocks control may pass to next"""
+    blocks = [BasicBlock()]
+    for item in code:
+        if isinstance(item, Label):
+            if blocks[-1].code:
+                blocks.append(BasicBlock())
+            blocks[-1].labels.append(item)
+        else:
+            blocks[-1].code.append(item)
+            if item[0] in JUMP_OPCODES and item[0] != "JSR" or item[0] == "RET":
+                blocks.append(BasicBlock())
+    if not blocks[-1].code and not blocks[-1].labels:
+        blocks.pop()
+
+    by_label = {label: block for block in blocks for label in block.labels}
+    for i, block in enumerate(blocks):
+        last = block.code[-1] if block.code else None
+        if last is not None and last[0] in JUMP_OPCODES and last[0] not in CALL_OPCODES:
+            if target(last) in by_label:
+                block.successors.append(by_label[target(last)])
+        if (last is None or last[0] not in UNCONDITIONAL_OPCODES) and i + 1 < len(
+            blocks
+        ):
+            block.successors.append(blocks[i + 1])
+    return blocks
+
+
+def linearize(blocks: list[BasicBlock]) -> list:
+    """turn the basic blocks back into code"""
+    code: list = []
+    for block in blocks:
+        code.extend(block.labels)
+        code.extend(block.code)
+    return code
@@ -0,0 +1,384 @@
+"""Translation of hot bytecode regions into Python functions.
+
+A region is a block of the threaded engine and the blocks of the same
+function reachable from it, so that a loop becomes one region. Its
+generated function runs the blocks as a state machine over pc, with the
+registers as locals, and returns the address to continue at once control
+leaves the region, through a call, a return or a jump outside it:
+
+    def region(memory, ax, sp, bp, heap, output):
+        pc = 12
+        while True:
+            if pc == 12:
+                ...
+            elif pc == 20:
+                ...  # return 40, ax, sp, bp to leave at 40
+
+Within a block, words pushed and popped again by the block stay in
+locals; the stack in memory is only written when a block ends or an
+instruction needs it, such as an access to the frame below bp, where the
+words pushed may be read back as the arguments of an inlined call.
+
+Functions are cached per program and region start; the least recently
+used is evicted once MAX_REGIONS are cached, so that long-lived processes
+running many programs, such as the workers of subc.batch, stay bounded.
+"""
+
+import hashlib
+from typing import Callable, Optional
+
+from subc.bytecode import INSTRUCTION_SIZES
+from subc.code_manager import Opcode
+
+HOT_THRESHOLD = 50  # block runs before its region is compiled
+MAX_REGION_BLOCKS = 32
+MAX_REGIONS = 4096  # regions cached over all programs
+
+# compiled regions by program hash and start address, None if translation
+# failed
+REGIONS: dict[tuple[bytes, int], Optional[Callable]] = {}
+
+BINARY = {
+    Opcode.IOR: "{} | ax",
+    Opcode.XOR: "{} ^ ax",
+    Opcode.AND: "{} & ax",
+    Opcode.EQL: "1 if {} == ax else 0",
+    Opcode.NEQ: "1 if {} != ax else 0",
+    Opcode.LSS: "1 if {} < ax else 0",
+    Opcode.GTR: "1 if {} > ax else 0",
+    Opcode.LEQ: "1 if {} <= ax else 0",
+    Opcode.GEQ: "1 if {} >= ax else 0",
+    Opcode.SHL: "{} << ax",
+    Opcode.SHR: "{} >> ax",
+    Opcode.ADD: "{} + ax",
+    Opcode.SUB: "{} - ax",
+    Opcode.MUL: "{} * ax",
+    Opcode.DIV: "{} // ax",
+    Opcode.MOD: "{} % ax",
+}
+IMMEDIATE = {
+    Opcode.ADDI: "ax + {}",
+    Opcode.SUBI: "ax - {}",
+    Opcode.SHLI: "ax << {}",
+    Opcode.SHRI: "ax >> {}",
+    Opcode.ANDI: "ax & {}",
+    Opcode.EQLI: "1 if ax == {} else 0",
+    Opcode.NEQI: "1 if ax != {} else 0",
+    Opcode.LSSI: "1 if ax < {} else 0",
+    Opcode.GTRI: "1 if ax > {} else 0",
+    Opcode.LEQI: "1 if ax <= {} else 0",
+    Opcode.GEQI: "1 if ax >= {} else 0",
+}
+# compare and branch: ax is the comparison, the branch is taken when it fails
+BRANCHES = {
+    Opcode.BGE: "<",
+    Opcode.BLE: ">",
+    Opcode.BGT: "<=",
+    Opcode.BLT: ">=",
+    Opcode.BNE: "==",
+    Opcode.BEQ: "!=",
+}
+IMMEDIATE_BRANCHES = {
+    Opcode.BGEI: "<",
+    Opcode.BLEI: ">",
+    Opcode.BGTI: "<=",
+    Opcode.BLTI: ">=",
+    Opcode.BNEI: "==",
+    Opcode.BEQI: "!=",
+}
+# opcodes leaving a value in ax that fits in a word, and ax as it was
+BOUNDED = {
+    Opcode.LEA, Opcode.IMM, Opcode.LI, Opcode.LC, Opcode.LLI, Opcode.LLC,
+    Opcode.LGI, Opcode.LGC, Opcode.EQL, Opcode.NEQ, Opcode.LSS, Opcode.GTR,
+    Opcode.LEQ, Opcode.GEQ, Opcode.EQLI, Opcode.NEQI, Opcode.LSSI, Opcode.GTRI,
+    Opcode.LEQI, Opcode.GEQI, Opcode.MALLOC, Opcode.SYS,
+}  # fmt: skip
+KEEPS_AX = {
+    Opcode.PSH, Opcode.SI, Opcode.SC, Opcode.SLI, Opcode.SLC, Opcode.SGI,
+    Opcode.SGC, Opcode.ADJ, Opcode.PRINTF, Opcode.FREE,
+}  # fmt: skip
+
+
+def program_key(program) -> bytes:
+    """hash identifying the program's code"""
+    return hashlib.blake2b(bytes(program), digest_size=16).digest()
+
+
+def plus(base: str, n: int) -> str:
+    return f"{base} + {n}" if n >= 0 else f"{base} - {-n}"
+
+
+def decode_block(program, start: int, end: int) -> list[tuple[int, int, list]]:
+    """the (address, opcode, operands) of the instructions in [start, end)"""
+    instructions = []
+    pc = start
+    while pc < end:
+        opcode = program[pc]
+        size = INSTRUCTION_SIZES.get(opcode, 1)
+        instructions.append((pc, opcode, list(program[pc + 1 : pc + size])))
+        pc += size
+    return instructions
+
+
+def successors(
+    program, ends: dict[int, int], block: int, returns: bool = False
+) -> list[int]:
+    """blocks control can go to from block, without following calls and
+    returns; with returns, a JSR goes on to the block after it"""
+    instructions = decode_block(program, block, ends[block])
+    if not instructions:
+        return []
+    _, opcode, operands = instructions[-1]
+    following = []
+    if opcode in (Opcode.JMP, Opcode.BZ, Opcode.BNZ) or opcode in BRANCHES:
+        following.append(operands[0])
+    elif opcode in IMMEDIATE_BRANCHES:
+        following.append(operands[1])
+    if opcode not in (Opcode.JMP, Opcode.RET, Opcode.EXIT, Opcode.TCALL):
+        if opcode != Opcode.JSR or returns:
+            following.append(ends[block])
+    return [address for address in following if address in ends]
+
+
+def region_blocks(
+    program,
+    ends: dict[int, int],
+    start: int,
+    limit: int = MAX_REGION_BLOCKS,
+    returns: bool = False,
+) -> list[int]:
+    """start addresses of the blocks of the region starting at start"""
+    region = [start]
+    seen = {start}
+    for block in region:
+        for successor in successors(program, ends, block, returns):
+            if successor not in seen and len(region) < limit:
+                seen.add(successor)
+                region.append(successor)
+    return region
+
+
+class Translator:
+    """Python source of the blocks of a region"""
+
+    def __init__(self, region: list[int], indent: str = " " * 12) -> None:
+        self.region = set(region)
+        self.lines: list[str] = []
+        self.indent = indent
+        self.pending: list[str] = []  # pushed words not yet written to memory
+        self.temps = 0
+        self.bounded = False  # whether ax is known to fit in a word
+
+    def emit(self, line: str) -> None:
+        self.lines.append(self.indent + line)
+
+    def push(self) -> None:
+        name = f"t{self.temps}"
+        self.temps += 1
+        if self.bounded:
+            self.emit(f"{name} = ax")
+        else:  # as it would read back from memory
+            self.emit(f"{name} = (ax + 0x80000000 & 0xFFFFFFFF) - 0x80000000")
+        self.pending.append(name)
+
+    def pop(self) -> str:
+        """expression of the word on top of the stack, popping it"""
+        if self.pending:
+            return self.pending.pop()
+        self.emit("sp += 4")
+        return "load_word(memory, sp - 4)[0]"
+
+    def flush(self) -> None:
+        """write the pending pushes to the stack in memory"""
+        for name in self.pending:
+            self.emit("sp -= 4")
+            self.emit(f"store_word(memory, sp, {name} & 0xFFFFFFFF)")
+        self.pending = []
+
+    def frame(self, n: int) -> str:
+        """address of the frame slot at bp + n, flushing the pending pushes
+        first if it is below bp, where they may lie"""
+        if n < 0:
+            self.flush()
+        return plus("bp", n)
+
+    def load(self, opcode, address: str) -> None:
+        if opcode in (Opcode.LC, Opcode.LLC, Opcode.LGC):  # chars are signed
+            self.emit(f"ax = (memory[{address}] ^ 0x80) - 0x80")
+        else:
+            self.emit(f"ax = load_word(memory, {address})[0]")
+
+    def store(self, opcode, address: str) -> None:
+        if opcode in (Opcode.SC, Opcode.SLC, Opcode.SGC):
+            self.emit(f"memory[{address}] = ax & 0xFF")
+        else:
+            self.emit(f"store_word(memory, {address}, ax & 0xFFFFFFFF)")
+
+    def goto(self, address: str) -> None:
+        """continue at address, leaving the region if it is outside"""
+        if address.isdigit() and int(address) in self.region:
+            self.emit(f"pc = {address}")
+        else:
+            self.emit(f"return {address}, ax, sp, bp")
+
+    def branch(self, taken: int, following: int) -> None:
+        """go to taken when ax is 0 and to following otherwise"""
+        for line, address in (("if ax:", following), ("else:", taken)):
+            self.emit(line)
+            self.indent += "    "
+            self.goto(str(address))
+            self.indent = self.indent[:-4]
+
+    def call(self, target: int, following: int) -> None:
+        self.emit(f"store_word(memory, sp - 4, {following})")
+        self.emit("sp -= 8")
+        self.emit("store_word(memory, sp, bp)")
+        self.emit("bp = sp")
+        self.goto(str(target))
+
+    def tail_call(self, size: int, target: int) -> None:
+        self.emit(f"memory[bp + 8 : bp + {8 + size}] = memory[sp : sp + {size}]")
+        self.emit("sp = bp")
+        self.goto(str(target))
+
+    def ret(self) -> None:
+        self.emit("sp = bp + 8")
+        self.emit("bp = load_word(memory, sp - 8)[0]")
+        self.goto("load_word(memory, sp - 4)[0]")
+
+    def block(self, instructions: list, end: int) -> bool:
+        """translate the block, False if it has an unknown opcode"""
+        self.bounded = False
+        for pc, opcode, operands in instructions:
+            following = pc + 1 + len(operands)
+            n = operands[0] if operands else None
+            if opcode == Opcode.LEA:
+                self.emit(f"ax = {self.frame(n)}")
+            elif opcode == Opcode.IMM:
+                self.emit(f"ax = {n}")
+            elif opcode in (Opcode.LI, Opcode.LC):
+                self.load(opcode, "ax")
+            elif opcode in (Opcode.SI, Opcode.SC):
+                self.store(opcode, self.pop())
+            elif opcode == Opcode.PSH:
+                self.push()
+            elif opcode in (Opcode.LLI, Opcode.LLC):
+                self.load(opcode, self.frame(n))
+            elif opcode in (Opcode.SLI, Opcode.SLC):
+                self.store(opcode, self.frame(n))
+            elif opcode in (Opcode.LGI, Opcode.LGC):
+                self.load(opcode, str(n))
+            elif opcode in (Opcode.SGI, Opcode.SGC):
+                self.store(opcode, str(n))
+            elif opcode in BINARY:
+                self.emit(f"ax = {BINARY[opcode].format(self.pop())}")
+            elif opcode in IMMEDIATE:
+                self.emit(f"ax = {IMMEDIATE[opcode].format(n)}")
+            elif opcode == Opcode.NEG:
+                self.emit("ax = -ax")
+            elif opcode == Opcode.ADJ:
+                self.flush()
+                self.emit(f"sp = {plus('sp', n)}")
+            elif opcode == Opcode.PRINTF:
+                self.flush()
+                self.emit(f"output.printf(memory, sp, {n})")
+            elif opcode == Opcode.MALLOC:
+                self.flush()
+                self.emit("ax = heap.malloc(load_word(memory, sp)[0], sp)")
+            elif opcode == Opcode.FREE:
+                self.flush()
+                self.emit("heap.free(load_word(memory, sp)[0])")
+            elif opcode == Opcode.SYS:
+                self.flush()
+                self.emit(f"ax = run_builtin({n}, memory, sp)")
+            elif opcode == Opcode.EXIT:
+                self.flush()
+                self.emit("ax = load_word(memory, sp)[0]")
+                self.emit("output.exit(ax)")
+                self.emit("raise Halt(ax)")
+                return True
+            elif opcode == Opcode.JMP:
+                self.flush()
+                self.goto(str(n))
+                return True
+            elif opcode in (Opcode.BZ, Opcode.BNZ):
+                self.flush()
+                if opcode == Opcode.BZ:
+                    self.branch(n, following)
+                else:
+                    self.branch(following, n)
+                return True
+            elif opcode in BRANCHES:
+                self.emit(f"ax = 1 if {self.pop()} {BRANCHES[opcode]} ax else 0")
+                self.flush()
+                self.branch(n, following)
+                return True
+            elif opcode in IMMEDIATE_BRANCHES:
+                self.emit(f"ax = 1 if ax {IMMEDIATE_BRANCHES[opcode]} {n} else 0")
+                self.flush()
+                self.branch(operands[1], following)
+                return True
+            elif opcode == Opcode.JSR:
+                self.flush()
+                self.call(n, following)
+                return True
+            elif opcode == Opcode.TCALL:
+                self.flush()
+                self.tail_call(n, operands[1])
+                return True
+            elif opcode == Opcode.RET:
+                self.flush()
+                self.ret()
+                return True
+            else:
+                return False
+            if opcode in BOUNDED:
+                self.bounded = True
+            elif opcode not in KEEPS_AX:
+                self.bounded = False
+        self.flush()
+        self.goto(str(end))
+        return True
+
+
+def translate(program, ends: dict[int, int], start: int) -> Optional[str]:
+    """source of the function running the region starting at start, None if
+    it cannot be translated"""
+    region = region_blocks(program, ends, start)
+    translator = Translator(region)
+    lines = [
+        # the memory accessors are bound as locals, which are faster to look up
+        "def region(memory, ax, sp, bp, heap, output, "
+        "load_word=load_word, store_word=store_word):",
+        f"    pc = {start}",
+        "    while True:",
+    ]
+    for i, block in enumerate(region):
+        translator.lines = []
+        translator.pending = []
+        if not translator.block(decode_block(program, block, ends[block]), ends[block]):
+            return None
+        lines.append(f"        {'if' if i == 0 else 'elif'} pc == {block}:")
+        lines.extend(translator.lines or [translator.indent + "pass"])
+    return "\n".join(lines) + "\n"
+
+
+def compile_region(
+    program, key: bytes, ends: dict[int, int], start: int, namespace: dict
+) -> Optional[Callable]:
+    """the function running the region starting at start, translated and
+    compiled on first use; namespace provides Halt, run_builtin, load_word and
+    store_word of subc.virtual_machine"""
+    if (key, start) in REGIONS:  # moved to the end, as the most recently used
+        function = REGIONS[key, start] = REGIONS.pop((key, start))
+        return function
+    source = translate(program, ends, start)
+    function = None
+    if source is not None:
+        scope = dict(namespace)
+        exec(compile(source, f"<subc region {start}>", "exec"), scope)
+        function = scope["region"]
+    REGIONS[key, start] = function
+    while len(REGIONS) > MAX_REGIONS:
+        del REGIONS[next(iter(REGIONS))]
+    return function
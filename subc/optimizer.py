@@ -0,0 +1,855 @@
+"""Optimizations on the code emitted by the compiler.
+
+Passes work on one function at a time, on the code representation of
+subc.ir. Peephole passes never match across a Label, since it marks a
+basic block boundary; dataflow passes work on the function's control flow
+graph.
+"""
+
+import operator
+import time
+from typing import Callable, Optional
+
+from subc.code_manager import (
+    BRANCH_OPCODES,
+    CALL_OPCODES,
+    IMMEDIATE_BRANCH_OPCODES,
+    IMMEDIATE_OPCODES,
+    JUMP_OPCODES,
+    SYSCALL_OPCODES,
+    wrap,
+)
+from subc.ir import (
+    UNCONDITIONAL_OPCODES,
+    Label,
+    build_cfg,
+    count,
+    decode,
+    encode,
+    linearize,
+    retarget,
+    target,
+)
+
+###########################################################
+## PEEPHOLE PASSES
+###########################################################
+
+Rule = tuple[tuple, Callable[[list], Optional[list]]]
+
+
+def peephole(code: list, rules: list[Rule]) -> list:
+    """rewrite instruction sequences matching the rules' opcode patterns
+
+    A pattern is a tuple of opcodes or sets of opcodes. Its rewrite gets the
+    matched instructions and returns their replacement, or None to keep
+    them. Rewriting happens on the tail of the output, so the result of one
+    rewrite is matched again together with the instructions before it.
+    """
+    by_last: dict[str, list[Rule]] = {}
+    for pattern, rewrite in rules:
+        last = pattern[-1]
+        for opcode in (last,) if isinstance(last, str) else last:
+            by_last.setdefault(opcode, []).append((pattern, rewrite))
+
+    out: list = []
+    for item in code:
+        out.append(item)
+        while not isinstance(out[-1], Label) and out[-1][0] in by_last:
+            for pattern, rewrite in by_last[out[-1][0]]:
+                tail = out[-len(pattern) :]
+                if len(tail) == len(pattern) and all(
+                    not isinstance(instr, Label)
+                    and (
+                        instr[0] == opcode
+                        if isinstance(opcode, str)
+                        else instr[0] in opcode
+                    )
+                    for instr, opcode in zip(tail, pattern)
+                ):
+                    replacement = rewrite(tail)
+                    if replacement is not None:
+                        del out[-len(pattern) :]
+                        out.extend(replacement)
+                        break
+            else:
+                break
+            if not out:
+                break
+    return out
+
+
+# binary operators as the virtual machine evaluates them: the left operand
+# is popped from the stack and the right one is in ax
+BINARY_OPS = {
+    "IOR": operator.or_,
+    "XOR": operator.xor,
+    "AND": operator.and_,
+    "EQL": lambda a, b: int(a == b),
+    "NEQ": lambda a, b: int(a != b),
+    "LSS": lambda a, b: int(a < b),
+    "GTR": lambda a, b: int(a > b),
+    "LEQ": lambda a, b: int(a <= b),
+    "GEQ": lambda a, b: int(a >= b),
+    "SHL": operator.lshift,
+    "SHR": operator.rshift,
+    "ADD": operator.add,
+    "SUB": operator.sub,
+    "MUL": operator.mul,
+    "DIV": operator.floordiv,
+    "MOD": operator.mod,
+}
+
+# operations x OP k that leave x unchanged
+IDENTITIES = {
+    ("ADD", 0),
+    ("SUB", 0),
+    ("IOR", 0),
+    ("XOR", 0),
+    ("SHL", 0),
+    ("SHR", 0),
+    ("MUL", 1),
+    ("DIV", 1),
+}
+
+
+def constant(value: int) -> Optional[list]:
+    """IMM value, or None if value does not fit a word: ax holds the exact
+    result of arithmetic at run time, which the folds leave to it"""
+    return [("IMM", value)] if wrap(value) == value else None
+
+
+def fold_binary(tail: list) -> Optional[list]:
+    """IMM a, PSH, IMM b, OP -> IMM (a OP b)"""
+    (_, a), _, (_, b), (opcode, _) = tail
+    if opcode in ("DIV", "MOD") and b == 0 or opcode in ("SHL", "SHR") and b < 0:
+        return None  # leave the fault to run time
+    return constant(BINARY_OPS[opcode](a, b))
+
+
+def fold_negate(tail: list) -> Optional[list]:
+    """IMM a, NEG -> IMM -a"""
+    return constant(-tail[0][1])
+
+
+def fold_address(tail: list) -> list:
+    """LEA a, PSH, IMM b, ADD -> LEA a + b"""
+    return [("LEA", tail[0][1] + tail[2][1])]
+
+
+# fused compare and branch opcodes -> the comparison they make
+BRANCH_OPS = {branch: BINARY_OPS[opcode] for opcode, branch in BRANCH_OPCODES.items()}
+IMMEDIATE_BRANCH_OPS = {
+    IMMEDIATE_BRANCH_OPCODES[branch]: compare for branch, compare in BRANCH_OPS.items()
+}
+
+
+def fold_branch(tail: list) -> list:
+    """a branch on a constant becomes a jump or falls through"""
+    opcode, operand = tail[-1]
+    if opcode in ("BZ", "BNZ"):
+        ax = tail[0][1]
+        taken = (ax == 0) == (opcode == "BZ")
+    else:  # the branches also leave the comparison in ax
+        if opcode in BRANCH_OPS:
+            ax, label = BRANCH_OPS[opcode](tail[0][1], tail[2][1]), operand
+        else:
+            k, label = operand
+            ax = IMMEDIATE_BRANCH_OPS[opcode](tail[0][1], k)
+        operand, taken = label, ax == 0
+    return [("IMM", ax), ("JMP", operand)] if taken else [("IMM", ax)]
+
+
+def reduce_immediate(tail: list) -> Optional[list]:
+    """simplify x OP k: drop identities, turn multiplication and division
+    by powers of two into shifts"""
+    (_, k), (opcode, _) = tail[1:]
+    if (opcode, k) in IDENTITIES:
+        return []
+    if opcode == "MUL":
+        if k == 0:
+            return [("IMM", 0)]
+        if k == -1:
+            return [("NEG", None)]
+    if k > 1 and k & (k - 1) == 0:  # power of two
+        if opcode == "MUL":
+            return [("PSH", None), ("IMM", k.bit_length() - 1), ("SHL", None)]
+        if opcode == "DIV":  # the VM divides with floor, same as >>
+            return [("PSH", None), ("IMM", k.bit_length() - 1), ("SHR", None)]
+        if opcode == "MOD":
+            return [("PSH", None), ("IMM", k - 1), ("AND", None)]
+    return None
+
+
+FOLD_RULES: list[Rule] = [
+    (("IMM", "PSH", "IMM", set(BINARY_OPS)), fold_binary),
+    (("IMM", "NEG"), fold_negate),
+    (("LEA", "PSH", "IMM", "ADD"), fold_address),
+    (("PSH", "IMM", set(BINARY_OPS)), reduce_immediate),
+    (("IMM", {"BZ", "BNZ"}), fold_branch),
+    (("IMM", "PSH", "IMM", set(BRANCH_OPS)), fold_branch),
+]
+
+
+def fold_constants(code: list) -> list:
+    """constant folding and strength reduction"""
+    return peephole(code, FOLD_RULES)
+
+
+###########################################################
+## BRANCHES
+###########################################################
+
+# value of ax when a conditional branch is taken: zero or non-zero
+TAKEN_WITH = {
+    "BZ": False,
+    "BNZ": True,
+    **{opcode: False for opcode in BRANCH_OPCODES.values()},
+    **{opcode: False for opcode in IMMEDIATE_BRANCH_OPCODES.values()},
+}
+
+
+def simplify_branches(code: list) -> list:
+    """collapse chains of jumps and invert conditional branches that only
+    skip over a jump"""
+    position = {item: i for i, item in enumerate(code) if isinstance(item, Label)}
+
+    def destination(label: Label) -> Optional[tuple]:
+        """the instruction executed after jumping to label"""
+        i = position.get(label)
+        while i is not None and i < len(code):
+            if not isinstance(code[i], Label):
+                return code[i]
+            i += 1
+        return None
+
+    def final_target(label: Label, taken_with: Optional[bool]) -> Label:
+        """follow unconditional jumps, and conditional ones known to be
+        taken given the value of ax"""
+        seen = set()
+        while label not in seen:
+            seen.add(label)
+            instr = destination(label)
+            if instr is None:
+                break
+            if (
+                instr[0] == "JMP"
+                or instr[0] in ("BZ", "BNZ")
+                and (TAKEN_WITH[instr[0]] == taken_with)
+            ):
+                label = instr[1]
+            else:
+                break
+        return label
+
+    code = [
+        (
+            retarget(item, final_target(target(item), TAKEN_WITH.get(item[0])))
+            if not isinstance(item, Label)
+            and item[0] in JUMP_OPCODES
+            and item[0] not in CALL_OPCODES
+            else item
+        )
+        for item in code
+    ]
+
+    out: list = []
+    for i, item in enumerate(code):
+        if isinstance(item, Label) or item[0] != "JMP":
+            out.append(item)
+            continue
+        following = set()
+        for j in range(i + 1, len(code)):
+            if not isinstance(code[j], Label):
+                break
+            following.add(code[j])
+        if item[1] in following:
+            continue  # jump to the next instruction
+        branch = out[-1] if out else None
+        if (
+            branch is not None
+            and not isinstance(branch, Label)
+            and branch[0] in ("BZ", "BNZ")
+            and branch[1] in following
+        ):  # BZ L1, JMP L2, L1: -> BNZ L2, L1:
+            out[-1] = ("BNZ" if branch[0] == "BZ" else "BZ", item[1])
+            continue
+        out.append(item)
+    return out
+
+
+def eliminate_unreachable_code(code: list) -> list:
+    """drop the basic blocks control never reaches from the function entry,
+    such as code after a return or a branch on a constant"""
+    blocks = build_cfg(code)
+    reached = {id(blocks[0])}
+    work = [blocks[0]]
+    while work:
+        for successor in work.pop().successors:
+            if id(successor) not in reached:
+                reached.add(id(successor))
+                work.append(successor)
+    return linearize([block for block in blocks if id(block) in reached])
+
+
+###########################################################
+## SUPERINSTRUCTIONS
+###########################################################
+
+# (address opcode, access opcode) -> fused opcode
+FUSED_LOADS = {
+    ("LEA", "LI"): "LLI",
+    ("LEA", "LC"): "LLC",
+    ("IMM", "LI"): "LGI",
+    ("IMM", "LC"): "LGC",
+}
+FUSED_STORES = {
+    ("LEA", "SI"): "SLI",
+    ("LEA", "SC"): "SLC",
+    ("IMM", "SI"): "SGI",
+    ("IMM", "SC"): "SGC",
+}
+
+# words pushed by the opcodes that may run between pushing an address and
+# storing to it; ADJ pops its operand in bytes
+STACK_EFFECTS = {
+    "PSH": 1,
+    "SI": -1,
+    "SC": -1,
+    **{opcode: -1 for opcode in BINARY_OPS},
+    **{opcode: 0 for opcode in ("LEA", "IMM", "LI", "LC", "NEG", "JSR")},
+    **{opcode: 0 for opcode in SYSCALL_OPCODES - {"EXIT"}},
+    **{opcode: 0 for opcode in IMMEDIATE_OPCODES.values()},
+    **{opcode: 0 for opcode in (*FUSED_LOADS.values(), *FUSED_STORES.values())},
+}
+
+# opcodes that set ax without reading it
+AX_WRITERS = {"LEA", "IMM", "JSR", *FUSED_LOADS.values()}
+
+
+def find_pop(code: list, start: int) -> Optional[int]:
+    """index of the instruction popping the word on top of the stack at
+    `start`, if it is popped in the same basic block"""
+    depth = 1
+    for i in range(start, len(code)):
+        item = code[i]
+        if item is None:
+            continue
+        if isinstance(item, Label):
+            return None
+        if item[0] == "ADJ":
+            depth -= item[1] // 4
+        elif item[0] in STACK_EFFECTS:
+            depth += STACK_EFFECTS[item[0]]
+        else:
+            return None
+        if depth <= 0:
+            return i if depth == 0 else None
+    return None
+
+
+def fuse_stores(code: list) -> list:
+    """LEA n, PSH, ..., SI -> ..., SLI n where the SI pops the pushed
+    address (IMM for globals, SC for chars)"""
+    code = list(code)
+    for i in range(len(code) - 2):
+        address = code[i]
+        if (
+            address is None
+            or isinstance(address, Label)
+            or address[0] not in ("LEA", "IMM")
+            or code[i + 1] != ("PSH", None)
+        ):
+            continue
+        j = find_pop(code, i + 2)
+        if j is None or code[j][0] not in ("SI", "SC"):
+            continue
+        first = code[i + 2][0]
+        if first in ("LI", "LC"):  # ++x, x++ load through the address in ax
+            code[i + 2] = (FUSED_LOADS[address[0], first], address[1])
+        elif first not in AX_WRITERS:
+            continue
+        code[i] = code[i + 1] = None
+        code[j] = (FUSED_STORES[address[0], code[j][0]], address[1])
+    return [item for item in code if item is not None]
+
+
+FUSE_RULES: list[Rule] = [
+    (
+        ({"LEA", "IMM"}, {"LI", "LC"}),
+        lambda tail: [(FUSED_LOADS[tail[0][0], tail[1][0]], tail[0][1])],
+    ),
+    (
+        ("PSH", "IMM", set(IMMEDIATE_OPCODES)),
+        lambda tail: [(IMMEDIATE_OPCODES[tail[2][0]], tail[1][1])],
+    ),
+    (
+        ("PSH", "IMM", set(IMMEDIATE_BRANCH_OPCODES)),
+        lambda tail: [(IMMEDIATE_BRANCH_OPCODES[tail[2][0]], (tail[1][1], tail[2][1]))],
+    ),
+]
+
+
+def fuse_instructions(code: list) -> list:
+    """replace frequent instruction sequences by superinstructions"""
+    return peephole(fuse_stores(code), FUSE_RULES)
+
+
+###########################################################
+## DATAFLOW PASSES
+###########################################################
+
+# opcodes that may write memory other than through a fused local store
+CLOBBERS = {"SI", "SC", "JSR", *SYSCALL_OPCODES}
+
+# opcodes that leave ax unchanged
+KEEPS_AX = {"PSH", "SI", "SC", "SLI", "SLC", "SGI", "SGC", "ADJ", "JMP", "BZ", "BNZ"}
+
+
+def address_taken(code: list) -> bool:
+    """whether the function computes the address of a local or parameter,
+    which may then be read and written through pointers"""
+    return any(not isinstance(item, Label) and item[0] == "LEA" for item in code)
+
+
+def overlaps(a: int, a_width: int, b: int, b_width: int) -> bool:
+    """whether the bytes [a, a + a_width) and [b, b + b_width) overlap"""
+    return a < b + b_width and b < a + a_width
+
+
+def propagate_constants(code: list) -> list:
+    """replace loads of int locals holding a known constant by the constant,
+    tracking stores of constants along all paths through the function"""
+    escaped = address_taken(code)
+    blocks = build_cfg(code)
+    index = {id(block): i for i, block in enumerate(blocks)}
+
+    # slots overwritten by pushes, which happens once inlined code released
+    # its locals; functions with no static stack depth have none inlined
+    pushed: dict[tuple[int, int], int] = {}
+    depths = stack_depths(code)
+    if depths is not None:
+        position = 0
+        for b, block in enumerate(blocks):
+            position += len(block.labels)
+            for i, (opcode, _) in enumerate(block.code):
+                if opcode == "PSH" and depths[position] is not None:
+                    pushed[b, i] = -depths[position] - 4
+                position += 1
+
+    def transfer(block, slots: dict, rewrite: bool) -> dict:
+        slots = dict(slots)
+        b = index[id(block)]
+        ax = None
+        for i, (opcode, operand) in enumerate(block.code):
+            if (b, i) in pushed:
+                for n in [n for n in slots if overlaps(n, 4, pushed[b, i], 4)]:
+                    del slots[n]
+            if opcode == "IMM":
+                ax = operand
+                continue
+            if opcode == "LLI":
+                ax = slots.get(operand)
+                if ax is not None and rewrite:
+                    block.code[i] = ("IMM", ax)
+                continue
+            if opcode in ("SLI", "SLC"):
+                width = 4 if opcode == "SLI" else 1
+                for n in [n for n in slots if overlaps(n, 4, operand, width)]:
+                    del slots[n]
+                if opcode == "SLI" and ax is not None and -(1 << 31) <= ax < 1 << 31:
+                    slots[operand] = ax  # as it reads back, unless the store wraps it
+            elif opcode in CLOBBERS and escaped:
+                slots.clear()
+            if opcode not in KEEPS_AX:
+                ax = None
+        return slots
+
+    entry: list[Optional[dict]] = [None] * len(blocks)
+    entry[0] = {}
+    work = [0]
+    while work:
+        i = work.pop()
+        slots = transfer(blocks[i], entry[i], False)
+        for successor in blocks[i].successors:
+            j = index[id(successor)]
+            if entry[j] is None:
+                merged = slots
+            else:
+                merged = {n: v for n, v in entry[j].items() if slots.get(n) == v}
+            if merged != entry[j]:
+                entry[j] = merged
+                work.append(j)
+
+    for i, block in enumerate(blocks):
+        if entry[i] is not None:
+            transfer(block, entry[i], True)
+    return linearize(blocks)
+
+
+def eliminate_redundant_loads(code: list) -> list:
+    """drop loads of int locals whose value is already in ax, as after a
+    store to them of another local or a load of the same local (x = y;
+    z = x or x * x)"""
+    escaped = address_taken(code)
+    out: list = []
+    in_ax: set[int] = set()  # locals known to hold the value in ax
+    for item in code:
+        if isinstance(item, Label):
+            in_ax = set()
+            out.append(item)
+            continue
+        opcode, operand = item
+        if opcode == "LLI":
+            if operand in in_ax:
+                continue
+            in_ax = {operand}
+        elif opcode in ("SLI", "SLC"):
+            # ax holds a word if it holds a local; otherwise the store may wrap it
+            word = bool(in_ax)
+            width = 4 if opcode == "SLI" else 1
+            in_ax = {n for n in in_ax if not overlaps(n, 4, operand, width)}
+            if opcode == "SLI" and word:
+                in_ax.add(operand)
+        elif opcode in CLOBBERS and escaped or opcode not in KEEPS_AX:
+            in_ax = set()
+        out.append(item)
+    return out
+
+
+def eliminate_dead_stores(code: list) -> list:
+    """drop stores to locals that are not read again before the function
+    returns or they are overwritten"""
+    if address_taken(code):
+        return code
+    blocks = build_cfg(code)
+    index = {id(block): i for i, block in enumerate(blocks)}
+
+    def step(live: set, opcode: str, operand) -> None:
+        """update the live bytes backwards over one instruction"""
+        if opcode == "LLI":
+            live.update(range(operand, operand + 4))
+        elif opcode == "LLC":
+            live.add(operand)
+        elif opcode == "SLI":
+            live.difference_update(range(operand, operand + 4))
+        elif opcode == "SLC":
+            live.discard(operand)
+
+    def live_out(block) -> set:
+        return set().union(*(live_in[index[id(s)]] for s in block.successors))
+
+    live_in: list[set] = [set() for _ in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            live = live_out(blocks[i])
+            for opcode, operand in reversed(blocks[i].code):
+                step(live, opcode, operand)
+            if live != live_in[i]:
+                live_in[i] = live
+                changed = True
+
+    for block in blocks:
+        live = live_out(block)
+        kept = []
+        for opcode, operand in reversed(block.code):
+            if opcode == "SLI" and live.isdisjoint(range(operand, operand + 4)):
+                continue
+            if opcode == "SLC" and operand not in live:
+                continue
+            step(live, opcode, operand)
+            kept.append((opcode, operand))
+        block.code = kept[::-1]
+    return linearize(blocks)
+
+
+# fused opcodes -> the binary operator they apply
+IMMEDIATE_OPS = {
+    fused: BINARY_OPS[opcode] for opcode, fused in IMMEDIATE_OPCODES.items()
+}
+
+
+def fold_immediate(tail: list) -> Optional[list]:
+    """IMM a, OPI b -> IMM (a OP b)"""
+    (_, a), (opcode, b) = tail
+    if opcode in ("SHLI", "SHRI") and b < 0:
+        return None
+    return constant(IMMEDIATE_OPS[opcode](a, b))
+
+
+FOLD_FUSED_RULES: list[Rule] = [
+    (("IMM", set(IMMEDIATE_OPS)), fold_immediate),
+    (("IMM", set(IMMEDIATE_BRANCH_OPS)), fold_branch),
+    (("IMM", AX_WRITERS), lambda tail: tail[1:]),
+]
+
+
+def fold_fused(code: list) -> list:
+    """constant folding of superinstructions and removal of constants
+    overwritten before use"""
+    return peephole(code, FOLD_FUSED_RULES)
+
+
+###########################################################
+## INLINING
+###########################################################
+
+# words pushed by each opcode, ADJ pops its operand in bytes
+DEPTH_EFFECTS = {
+    **STACK_EFFECTS,
+    **{opcode: 0 for opcode in ("EXIT", "JMP", "BZ", "BNZ", "RET", "TCALL")},
+    **{opcode: -1 for opcode in BRANCH_OPS},
+    **{opcode: 0 for opcode in IMMEDIATE_BRANCH_OPS},
+}
+
+# opcodes addressing the stack frame relative to bp
+FRAME_OPCODES = {"LEA", "LLI", "LLC", "SLI", "SLC"}
+
+INLINE_THRESHOLD = 32
+
+
+def stack_depths(code: list) -> Optional[list]:
+    """bytes between bp and sp before each item of the function's code,
+    None where it is never reached; None if the depth is not the same on
+    every path, as for locals declared in a loop"""
+    position = {item: i for i, item in enumerate(code) if isinstance(item, Label)}
+    depths: list[Optional[int]] = [None] * (len(code) + 1)
+    work = [(0, 0)]
+    while work:
+        i, depth = work.pop()
+        while i < len(code):
+            if depths[i] is not None:
+                if depths[i] != depth:
+                    return None
+                break
+            depths[i] = depth
+            item = code[i]
+            i += 1
+            if isinstance(item, Label):
+                continue
+            opcode, operand = item
+            if opcode == "ADJ":
+                depth -= operand
+            elif opcode in DEPTH_EFFECTS:
+                depth += 4 * DEPTH_EFFECTS[opcode]
+            else:
+                return None
+            if opcode in JUMP_OPCODES and opcode not in CALL_OPCODES:
+                if target(item) not in position:
+                    return None
+                work.append((position[target(item)], depth))
+            if opcode in UNCONDITIONAL_OPCODES:
+                break
+    return depths
+
+
+def inlinable(body: list, threshold: int) -> Optional[list]:
+    """stack depths of a leaf function small enough to inline"""
+    if count(body) > threshold:
+        return None
+    if any(not isinstance(item, Label) and item[0] in CALL_OPCODES for item in body):
+        return None
+    return stack_depths(body)
+
+
+def inline_body(body: list, callee_depths: list, depth: int) -> list:
+    """copy of the callee's code to run at a call site where the caller has
+    `depth` bytes on the stack, arguments included. Its locals live below
+    the arguments and a return adjusts the stack back to them."""
+    labels = {item: Label() for item in body if isinstance(item, Label)}
+    end = Label()
+    code: list = []
+    for i, item in enumerate(body):
+        if isinstance(item, Label):
+            code.append(labels[item])
+            continue
+        opcode, operand = item
+        if opcode in FRAME_OPCODES:  # no return address and bp in between
+            code.append((opcode, operand - depth - (8 if operand > 0 else 0)))
+        elif opcode == "RET":
+            if callee_depths[i]:
+                code.append(("ADJ", callee_depths[i]))
+            if i < len(body) - 1:
+                code.append(("JMP", end))
+        elif opcode in JUMP_OPCODES:
+            code.append(retarget(item, labels[target(item)]))
+        else:
+            code.append(item)
+    code.append(end)
+    return code
+
+
+def inline_calls(functions: list[tuple], threshold: int) -> dict[str, int]:
+    """replace calls to small leaf functions by a copy of their code,
+    returns the number of calls inlined per callee"""
+    callees = {}
+    for name, body in functions:
+        if name is not None:
+            depths = inlinable(body, threshold)
+            if depths is not None:
+                callees[body[0]] = (name, body, depths)
+
+    def is_call(item) -> bool:
+        return not isinstance(item, Label) and item[0] == "JSR" and item[1] in callees
+
+    inlined: dict[str, int] = {}
+    for f, (name, body) in enumerate(functions):
+        depths = stack_depths(body) if any(map(is_call, body)) else None
+        if depths is None:
+            continue
+        code: list = []
+        for i, item in enumerate(body):
+            if not is_call(item) or depths[i] is None:  # e.g. after a return
+                code.append(item)
+                continue
+            callee, callee_body, callee_depths = callees[item[1]]
+            code.extend(inline_body(callee_body, callee_depths, depths[i]))
+            inlined[callee] = inlined.get(callee, 0) + 1
+        functions[f] = (name, code)
+    return inlined
+
+
+###########################################################
+## DRIVER
+###########################################################
+
+
+class PassStats:
+    """time spent in a pass and instructions it removed, over all functions"""
+
+    __slots__ = ("seconds", "removed")
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.removed = 0
+
+
+class Report:
+    """instructions removed from each function and statistics of each pass"""
+
+    def __init__(self) -> None:
+        self.removed: dict[str, int] = {}
+        self.inlined: dict[str, int] = {}  # calls inlined per callee
+        self.unreachable: list[str] = []  # functions main never calls
+        self.functions: dict[str, int] = {}  # address of each function kept
+        self.passes: dict[str, PassStats] = {}
+
+    def __str__(self) -> str:
+        lines = [f"{name}: -{removed}" for name, removed in self.removed.items()]
+        lines.extend(f"{name}: inlined {n}x" for name, n in self.inlined.items())
+        lines.extend(f"{name}: unreachable" for name in self.unreachable)
+        for name, stats in self.passes.items():
+            lines.append(f"{name:26} {stats.seconds * 1000:8.3f} ms {-stats.removed:6}")
+        return "\n".join(lines)
+
+
+class PassManager:
+    """the optimization passes of each level, run in the order they were
+    registered over every function"""
+
+    def __init__(self) -> None:
+        self.passes: list[tuple[int, Callable[[list], list]]] = []
+
+    def register(self, level: int, opt_pass: Callable[[list], list]) -> None:
+        """run opt_pass at optimization levels >= level"""
+        self.passes.append((level, opt_pass))
+
+    def run(self, code: list, level: int, report: Report) -> list:
+        """run the passes of the level over the code of a function"""
+        for min_level, opt_pass in self.passes:
+            if level < min_level:
+                continue
+            stats = report.passes.setdefault(opt_pass.__name__, PassStats())
+            size = count(code)
+            start = time.perf_counter()
+            code = opt_pass(code)
+            stats.seconds += time.perf_counter() - start
+            stats.removed += size - count(code)
+        return code
+
+
+PASSES = PassManager()
+PASSES.register(1, fold_constants)
+PASSES.register(1, simplify_branches)
+PASSES.register(1, eliminate_unreachable_code)
+PASSES.register(2, fuse_instructions)
+PASSES.register(2, propagate_constants)
+PASSES.register(2, fold_constants)
+PASSES.register(2, fold_fused)
+PASSES.register(2, eliminate_redundant_loads)
+PASSES.register(2, eliminate_dead_stores)
+PASSES.register(2, fold_fused)
+PASSES.register(2, eliminate_redundant_loads)
+PASSES.register(2, simplify_branches)
+PASSES.register(2, eliminate_unreachable_code)
+
+MAX_LEVEL = 2
+
+
+def split_functions(code: list, names: dict) -> list[tuple[Optional[str], list]]:
+    """split the code at the function entry labels"""
+    functions: list[tuple[Optional[str], list]] = [(None, [])]
+    for item in code:
+        if isinstance(item, Label) and item in names:
+            functions.append((names[item], []))
+        functions[-1][1].append(item)
+    return [(name, body) for name, body in functions if body]
+
+
+def reachable_functions(functions: list[tuple], entry: Label) -> set[int]:
+    """indices of the functions called, directly or not, from the one at
+    entry"""
+    by_label = {body[0]: i for i, (_, body) in enumerate(functions)}
+    reached = {by_label[entry]}
+    work = [by_label[entry]]
+    while work:
+        for item in functions[work.pop()][1]:
+            if isinstance(item, Label) or item[0] not in CALL_OPCODES:
+                continue
+            callee = by_label[target(item)]
+            if callee not in reached:
+                reached.add(callee)
+                work.append(callee)
+    return reached
+
+
+def optimize(
+    pc_start: int,
+    program: list,
+    functions: dict[str, int],
+    level: int = 1,
+    inline_threshold: int = 0,
+) -> tuple[int, list, Report]:
+    """optimize the program, returns the new entry point, the program and a
+    report of what was removed. Leaf functions of at most inline_threshold
+    instructions are inlined into their callers."""
+    code_in, labels = decode(program, [pc_start, *functions.values()])
+    names = {labels[address]: name for name, address in functions.items()}
+
+    code = []
+    report = Report()
+    functions = split_functions(code_in, names)
+    if inline_threshold:
+        report.inlined = inline_calls(functions, inline_threshold)
+    if level > 0 or inline_threshold:
+        reached = reachable_functions(functions, labels[pc_start])
+        report.unreachable = [
+            name for i, (name, _) in enumerate(functions) if i not in reached and name
+        ]
+        functions = [function for i, function in enumerate(functions) if i in reached]
+    for name, body in functions:
+        size = count(body)
+        body = PASSES.run(body, level, report)
+        if name is not None:
+            report.removed[name] = size - count(body)
+        code.extend(body)
+
+    program = encode(code)
+    report.functions = {
+        name: label.address
+        for label, name in names.items()
+        if label.address is not None
+    }
+    return labels[pc_start].address, program, report
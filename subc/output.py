@@ -0,0 +1,85 @@
+"""Buffered output of the PRINTF system call.
+
+A run writes its output to an Output, which formats it into a buffer and
+writes the buffer to the sink once it fills and when the program exits.
+The sink is a binary file such as an open file or io.BytesIO, NULL to
+drop the output, or None for sys.stdout. Format strings are decoded once
+per address and reused while the bytes there stay the same, as those of
+string literals do.
+
+The module only uses the standard library, so that modules translated by
+subc.aot can carry a copy of it.
+"""
+
+import struct
+import sys
+
+load_word = struct.Struct("<i").unpack_from
+
+BUFFER_SIZE = 1 << 16  # characters buffered before writing to the sink
+
+
+class Null:
+    """sink dropping everything written to it"""
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+NULL = Null()
+
+
+class Output:
+    """the output of a run, buffered on its way to a sink"""
+
+    __slots__ = ("sink", "parts", "size", "formats")
+
+    def __init__(self, sink=None) -> None:
+        self.sink = sink
+        self.parts: list[str] = []
+        self.size = 0  # characters in parts
+        self.formats: dict[int, tuple[bytes, str]] = {}  # raw and decoded, by address
+
+    def printf(self, memory, sp: int, size: int) -> None:
+        """print the format string and arguments pushed in the size bytes
+        above sp"""
+        start = sp - 4 + size
+        address = load_word(memory, start)[0]
+        raw, string = self.formats.get(address, (b"", None))
+        end = address + len(raw)
+        if string is None or memory[end] != 0 or memory[address:end] != raw:
+            raw = bytes(memory[address : memory.find(b"\0", address)])
+            string = raw.decode().replace("\\n", "\n")
+            self.formats[address] = raw, string
+        args = tuple(load_word(memory, a)[0] for a in range(start - 4, sp - 4, -4))
+        self.write(string % args)
+
+    def write(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def exit(self, exit_code: int) -> None:
+        """print the exit code of the program and flush the buffer"""
+        self.write(f"exit({exit_code})\n")
+        self.flush()
+
+    def flush(self) -> None:
+        """write the buffered output to the sink"""
+        text = "".join(self.parts)
+        self.parts.clear()
+        self.size = 0
+        sink = self.sink
+        if sink is None:  # looked up now, as it may be redirected
+            sink = sys.stdout
+            if not hasattr(sink, "buffer"):  # a text stream, e.g. io.StringIO
+                sink.write(text)
+                return
+            sink.flush()  # text printed before goes first
+            sink = sink.buffer
+        sink.write(text.encode())
+        sink.flush()
@@ -0,0 +1,140 @@
+"""Where the cycles of a run go.
+
+A Profile runs the program on the handlers of the table engine through a
+dispatch loop of its own, so that the engines run as fast as ever when
+nothing is profiled. It counts the instructions run of each opcode, the
+cycles of each call stack, following JSR, TCALL and RET, and the jumps
+back to each loop head. Call stacks are interned in a tree as they are
+entered, which keeps a call O(1) however deep the recursion.
+"""
+
+import json
+from typing import Optional
+
+from subc.code_manager import Opcode
+
+JSR, TCALL, RET = int(Opcode.JSR), int(Opcode.TCALL), int(Opcode.RET)
+
+
+class Profile:
+    """cycles of runs by opcode, by call stack and by loop"""
+
+    __slots__ = ("names", "opcodes", "stacks", "loops")
+
+    def __init__(self, functions: Optional[dict[str, int]] = None) -> None:
+        # functions missing from the symbols are named by their address
+        self.names = {address: name for name, address in (functions or {}).items()}
+        self.opcodes: dict[str, int] = {}  # instructions run by opcode name
+        self.stacks: dict[tuple, int] = {}  # cycles by stack of function addresses
+        self.loops: dict[tuple, int] = {}  # backward jumps by (function, target)
+
+    def run(self, pc_start: int, program, table: list) -> None:
+        """run the program from pc_start, each handler of table running an
+        instruction and returning the address of the next, until one raises"""
+        self.names.setdefault(pc_start, "main")
+        frames = [(-1, pc_start)]  # the caller's stack and the function, by stack
+        stacks = {frames[0]: 0}
+        cycles = [0]
+        counts = [0] * len(table)
+        loops = self.loops
+        callers = []  # stacks to return to
+        stack = 0
+        pc = pc_start
+        try:
+            while True:
+                opcode = program[pc]
+                counts[opcode] += 1
+                cycles[stack] += 1
+                following = table[opcode](pc + 1)
+                if opcode == JSR or opcode == TCALL:
+                    if opcode == JSR:
+                        callers.append(stack)
+                        frame = (stack, following)
+                    else:  # replaces the frame of the current function
+                        frame = (frames[stack][0], following)
+                    stack = stacks.get(frame, -1)
+                    if stack < 0:
+                        stack = stacks[frame] = len(frames)
+                        frames.append(frame)
+                        cycles.append(0)
+                elif opcode == RET:
+                    if callers:  # main returns to the exit stub
+                        stack = callers.pop()
+                elif following <= pc:
+                    loop = (frames[stack][1], following)
+                    loops[loop] = loops.get(loop, 0) + 1
+                pc = following
+        finally:
+            for opcode, n in enumerate(counts):
+                if n:
+                    name = Opcode(opcode).name
+                    self.opcodes[name] = self.opcodes.get(name, 0) + n
+            for stack, n in enumerate(cycles):
+                if n:
+                    path = []
+                    while stack >= 0:
+                        stack, function = frames[stack]
+                        path.append(function)
+                    path = tuple(reversed(path))
+                    self.stacks[path] = self.stacks.get(path, 0) + n
+
+    def name(self, address: int) -> str:
+        return self.names.get(address, f"f_{address}")
+
+    def cycles(self) -> int:
+        return sum(self.stacks.values())
+
+    def functions(self) -> dict[str, tuple[int, int]]:
+        """inclusive and exclusive cycles by function, most inclusive first"""
+        inclusive: dict[int, int] = {}
+        exclusive: dict[int, int] = {}
+        for path, n in self.stacks.items():
+            for function in set(path):  # recursion counts once
+                inclusive[function] = inclusive.get(function, 0) + n
+            exclusive[path[-1]] = exclusive.get(path[-1], 0) + n
+        return {
+            self.name(function): (n, exclusive.get(function, 0))
+            for function, n in sorted(inclusive.items(), key=lambda item: -item[1])
+        }
+
+    def collapsed(self) -> str:
+        """the stacks in the collapsed format of flame graph tools, one
+        "main;caller;callee cycles" line per stack"""
+        return "".join(
+            f"{';'.join(map(self.name, path))} {n}\n"
+            for path, n in sorted(self.stacks.items())
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "cycles": self.cycles(),
+                "opcodes": self.opcodes,
+                "functions": {
+                    name: {"inclusive": inclusive, "exclusive": exclusive}
+                    for name, (inclusive, exclusive) in self.functions().items()
+                },
+                "loops": [
+                    {"function": self.name(function), "address": address, "hits": n}
+                    for (function, address), n in self.hot_loops()
+                ],
+            },
+            indent=2,
+        )
+
+    def hot_loops(self) -> list[tuple[tuple, int]]:
+        return sorted(self.loops.items(), key=lambda item: -item[1])
+
+    def __str__(self) -> str:
+        cycles = self.cycles()
+        lines = [f"{cycles} cycles", "", f"{'opcode':12} {'count':>10} {'share':>7}"]
+        for name, n in sorted(self.opcodes.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:12} {n:10} {n / cycles:7.1%}")
+        lines += ["", f"{'function':12} {'inclusive':>10} {'exclusive':>10}"]
+        for name, (inclusive, exclusive) in self.functions().items():
+            lines.append(f"{name:12} {inclusive:10} {exclusive:10}")
+        if self.loops:
+            lines += ["", f"{'loop':12} {'address':>10} {'hits':>10}"]
+            for (function, address), n in self.hot_loops():
+                lines.append(f"{self.name(function):12} {address:10} {n:10}")
+        return "\n".join(lines)
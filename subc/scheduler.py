@@ -0,0 +1,55 @@
+"""Many programs run at once under asyncio, a slice of cycles at a time.
+
+Each VM runs in a task of the event loop, which runs slice instructions
+of it, then yields to the other tasks; as the event loop runs ready tasks
+in turn, thousands of programs share a thread fairly. A program running
+more than the cycle limit of the scheduler is stopped with
+CycleLimitError.
+
+    scheduler = Scheduler(slice=10_000, max_cycles=10_000_000)
+    exit_codes = asyncio.run(scheduler.gather(vms))
+"""
+
+import asyncio
+from typing import Iterable, Optional
+
+from subc.virtual_machine import VM
+
+SLICE = 10_000  # cycles run before yielding, by default
+
+
+class CycleLimitError(Exception):
+    """raised when a program runs more cycles than its limit"""
+
+
+class Scheduler:
+    """runs VMs in turns of slice cycles, at most max_cycles each"""
+
+    def __init__(self, slice: int = SLICE, max_cycles: Optional[int] = None) -> None:
+        if slice < 1:
+            raise ValueError("a slice runs at least one cycle")
+        self.slice = slice
+        self.max_cycles = max_cycles
+
+    async def run(self, vm: VM) -> int:
+        """run the program to its end, yielding to the other tasks between
+        slices; returns its exit code"""
+        slice, max_cycles = self.slice, self.max_cycles
+        try:
+            while True:
+                budget = slice
+                if max_cycles is not None:
+                    budget = min(budget, max_cycles - vm.cycles)
+                    if budget <= 0:
+                        raise CycleLimitError(f"the program ran {vm.cycles} cycles")
+                exit_code = vm.run(budget)
+                if exit_code is not None:
+                    return exit_code
+                await asyncio.sleep(0)
+        finally:
+            vm.output.flush()  # what a stopped program printed
+
+    async def gather(self, vms: Iterable[VM]) -> list:
+        """run the programs together; the exit code of each, or the
+        exception that stopped it"""
+        return await asyncio.gather(*map(self.run, vms), return_exceptions=True)
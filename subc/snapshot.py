@@ -0,0 +1,105 @@
+"""Snapshots of VMs, restored to resume their program where it stopped.
+
+A program that spends its first cycles building the same tables calls
+snapshot() once they are built; run with stop_at_snapshot, a VM returns
+there, or after any number of cycles given to VM.run, and save writes its
+registers, heap and memory to a file. restore maps the file into a new
+VM, whose memory is a private copy-on-write mapping of the file, so that
+restoring takes the same time however long the program took to set it
+up: each page is read when the program first touches it.
+
+    python -m subc examples/sieve.c --snapshot sieve.snap
+    python -m subc sieve.snap
+
+The file is a header, the program image in the subc.bytecode format and
+the memory, aligned to be mapped. Zeroed stretches of memory are skipped,
+leaving holes where the file system supports sparse files.
+"""
+
+import mmap
+import struct
+from typing import Optional
+
+from subc.bytecode import Image, from_bytes
+from subc.heap import SMALL_MAX, Heap, HeapStats
+from subc.output import Output
+from subc.virtual_machine import VM
+
+MAGIC = b"SUBSNAP\0"
+VERSION = 1
+SMALL_LISTS, LARGE_LISTS = SMALL_MAX // 8 + 1, 33  # free lists of the heap
+# magic, version, registers, cycles, heap, its stats, image and memory
+# sizes, offset of the memory
+HEADER = struct.Struct(f"<8sI iiiqQ II{SMALL_LISTS}I{LARGE_LISTS}I QQQQ IIQ")
+CHUNK = 1 << 16  # bytes of memory written, or skipped if zero, at a time
+
+
+def save(vm: VM, file_name: str) -> None:
+    """write the state of a VM that has not exited to a snapshot file"""
+    if vm.exit_code is not None:
+        raise ValueError("the program has exited")
+    image = Image(0, vm.program, b"").to_bytes()  # the data is in the memory
+    heap, stats, memory = vm.heap, vm.heap.stats, vm.memory
+    offset = -(-(HEADER.size + len(image)) // mmap.ALLOCATIONGRANULARITY)
+    offset *= mmap.ALLOCATIONGRANULARITY
+    header = HEADER.pack(
+        MAGIC, VERSION, vm.pc, vm.sp, vm.bp, vm.ax, vm.cycles,
+        heap.start, heap.top, *heap.small, *heap.large,
+        stats.mallocs, stats.frees, stats.live, stats.peak,
+        len(image), len(memory), offset,
+    )  # fmt: skip
+    with open(file_name, "wb") as file:
+        file.write(header)
+        file.write(image)
+        file.seek(offset)
+        for start in range(0, len(memory), CHUNK):
+            chunk = memory[start : start + CHUNK]
+            if chunk.count(0) == len(chunk):
+                file.seek(len(chunk), 1)
+            else:
+                file.write(chunk)
+        file.truncate()
+
+
+def is_snapshot(file_name: str) -> bool:
+    """whether the file holds a snapshot"""
+    with open(file_name, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def restore(
+    file_name: str,
+    heap_stats: Optional[HeapStats] = None,
+    output: Optional[Output] = None,
+) -> VM:
+    """a VM in the state saved to a snapshot file, which it runs on from; the
+    use of its heap goes on being counted in heap_stats when given"""
+    with open(file_name, "rb") as file:
+        fields = HEADER.unpack(file.read(HEADER.size))
+        magic, version, pc, sp, bp, ax, cycles, start, top = fields[:9]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a subc snapshot of this version")
+        small = fields[9 : 9 + SMALL_LISTS]
+        large = fields[9 + SMALL_LISTS : 9 + SMALL_LISTS + LARGE_LISTS]
+        mallocs, frees, live, peak, image_size, memory_size, offset = fields[-7:]
+        head = mmap.mmap(file.fileno(), offset, access=mmap.ACCESS_READ)
+        image = from_bytes(memoryview(head)[HEADER.size : HEADER.size + image_size])
+        memory = mmap.mmap(
+            file.fileno(), memory_size, access=mmap.ACCESS_COPY, offset=offset
+        )
+
+    heap = Heap(memory, 0, heap_stats)
+    heap.start, heap.top = start, top
+    heap.small[:], heap.large[:] = small, large
+    stats = heap.stats
+    stats.mallocs, stats.frees, stats.live, stats.peak = mallocs, frees, live, peak
+    stats.size = top - start
+
+    vm = VM.__new__(VM)  # without booting a fresh memory
+    vm.program, vm.memory, vm.heap = image.code, memory, heap
+    vm.output = Output() if output is None else output
+    vm.pc, vm.sp, vm.bp, vm.ax = pc, sp, bp, ax
+    vm.cycles = cycles
+    vm.exit_code = None
+    vm.stop_at_snapshot = vm.at_snapshot = False
+    return vm
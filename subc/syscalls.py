@@ -0,0 +1,121 @@
+"""Builtin functions run natively by the VM.
+
+The compiler declares each builtin registered here, and compiles a call
+to one into SYS n, n being its number, which the engines run by calling
+run_builtin: a bulk operation on the bytes of memory costs one
+instruction instead of a loop of them. Builtins are numbered in the order
+they are registered, and the numbers are in compiled programs, so new
+ones go at the end.
+
+Copies go through memoryviews, which handle overlapping spans without a
+temporary copy; spans of at least NUMPY_THRESHOLD bytes are filled with
+NumPy when it is installed.
+
+The module only needs the standard library, so that modules translated
+by subc.aot can carry a copy of it.
+"""
+
+import struct
+from typing import Callable
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NUMPY_THRESHOLD = 1 << 16
+
+
+class Builtin:
+    """a builtin function of the VM"""
+
+    __slots__ = ("name", "function", "arity", "args", "writes")
+
+    def __init__(self, function: Callable, writes: bool) -> None:
+        self.name = function.__name__
+        self.function = function  # (memory, *args) -> int
+        self.arity = function.__code__.co_argcount - 1
+        # the arguments are pushed in order, so the last is at sp
+        self.args = struct.Struct(f"<{self.arity}i").unpack_from
+        self.writes = writes  # the first and last arguments are a span written
+
+
+BUILTINS: list[Builtin] = []  # by number
+
+
+def builtin(writes: bool = False) -> Callable:
+    """register the decorated function as the next builtin"""
+
+    def register(function: Callable) -> Callable:
+        BUILTINS.append(Builtin(function, writes))
+        return function
+
+    return register
+
+
+def run_builtin(number: int, memory, sp: int) -> int:
+    """run builtin number with the arguments pushed above sp, returning its
+    result"""
+    builtin = BUILTINS[number]
+    return builtin.function(memory, *reversed(builtin.args(memory, sp)))
+
+
+def check_span(memory, address: int, n: int) -> None:
+    if address < 0 or n < 0 or address + n > len(memory):
+        raise IndexError(f"{n} bytes at {address} are outside the memory")
+
+
+def string_end(memory, address: int) -> int:
+    """address of the 0 ending the string at address"""
+    check_span(memory, address, 1)
+    end = memory.find(b"\0", address)
+    if end < 0:
+        raise IndexError(f"the string at {address} runs past the end of the memory")
+    return end
+
+
+@builtin(writes=True)
+def memcpy(memory, dest: int, src: int, n: int) -> int:
+    check_span(memory, dest, n)
+    check_span(memory, src, n)
+    with memoryview(memory) as view:
+        view[dest : dest + n] = view[src : src + n]
+    return dest
+
+
+@builtin(writes=True)
+def memmove(memory, dest: int, src: int, n: int) -> int:
+    return memcpy(memory, dest, src, n)  # memcpy already handles overlaps
+
+
+@builtin(writes=True)
+def memset(memory, dest: int, c: int, n: int) -> int:
+    check_span(memory, dest, n)
+    if numpy is not None and n >= NUMPY_THRESHOLD:
+        numpy.frombuffer(memory, numpy.uint8)[dest : dest + n] = c & 0xFF
+    else:
+        memory[dest : dest + n] = bytes((c & 0xFF,)) * n
+    return dest
+
+
+@builtin()
+def strlen(memory, s: int) -> int:
+    return string_end(memory, s) - s
+
+
+@builtin()
+def strcmp(memory, a: int, b: int) -> int:
+    """-1, 0 or 1 as the string at a sorts before, with or after the one at b"""
+    a = memory[a : string_end(memory, a)]
+    b = memory[b : string_end(memory, b)]
+    return (a > b) - (a < b)
+
+
+@builtin()
+def snapshot(memory) -> int:
+    """0; a VM told to stop here returns 1 from it, as do the runs restored
+    from the snapshot taken then (see subc.snapshot)"""
+    return 0
+
+
+SNAPSHOT = len(BUILTINS) - 1  # the number of snapshot
@@ -1,45 +1,191 @@
 import collections
 import re
 import sys
-from typing import Iterator, Optional
+from array import array
+from typing import Generator, Iterable, Iterator, TextIO
 
 from subc import grammar
 
 Token = collections.namedtuple("Token", ["type", "lexeme", "line", "col"])
 
+KEYWORDS = frozenset(t for t in grammar.TOKEN_TYPES if t.isidentifier())
+OPERATORS = tuple(t for t in grammar.TOKEN_TYPES if not t.isidentifier())
 
-def tokenize(source: str) -> Iterator[Token]:
-    """Tokenize the source code."""
-    i = 0
-    line = col = 1
-
-    def accept(pattern: str) -> Optional[str]:
-        nonlocal i, line, col
-        if match := re.match(pattern, source[i:]):
-            text = match.group()
-            i += len(text)
-            line += text.count("\n")
-            col = len(text.splitlines()[-1])
-            return text
-        return None
-
-    while i < len(source):
-        if accept(r"\s+|\/\*(.|\n)*?\*\/|\/\/.*"):  # whitespace and comments
+# one alternation tried at each position; the order of the alternatives
+# mirrors the priority of the original token-by-token matching. An
+# unterminated block comment runs to the end of the buffer so that a
+# streaming reader knows to fetch more input.
+PATTERN = "|".join(
+    (
+        r"(?P<skip>\s+|/\*[\s\S]*?(?:\*/|\Z)|//.*)",  # whitespace and comments
+        r"(?P<Str>\".*\")",  # strings
+        r"(?P<Chr>'\w')",  # chars
+        r"(?P<Id>[_a-zA-Z][_a-zA-Z0-9]*)",  # identifiers and keywords
+        r"(?P<Num>\d+)",  # numbers
+        "(?P<Op>" + "|".join(re.escape(op) for op in OPERATORS) + ")",
+    )
+)
+TOKEN_RE = re.compile(PATTERN)
+
+# token kinds in the order used for their small-int ids in a TokenBuffer
+KINDS = tuple(dict.fromkeys(grammar.TOKEN_TYPES + ("Str", "Num", "Id")))
+KIND_IDS = {kind: i for i, kind in enumerate(KINDS)}
+
+CHUNK_SIZE = 1 << 16
+
+
+def scan(
+    text: str, pos: int, limit: int, line: int, line_start: int
+) -> Generator[Token, None, tuple[int, int, int]]:
+    """Yield the tokens of text[pos:limit].
+
+    Stops early at a match running past `limit` and returns the position
+    and line state (line, index of the line's first character) to resume
+    from once more text is available.
+    """
+    match_at = TOKEN_RE.match
+    keywords = KEYWORDS
+
+    while pos < limit:
+        match = match_at(text, pos)
+        if match is None:
+            print(text[pos : text.find(" ", pos)])
+            sys.exit()
+
+        start, end = match.span()
+        if end > limit:
+            break
+        pos = end
+        kind = match.lastgroup
+
+        if kind == "skip":
+            newlines = text.count("\n", start, end)
+            if newlines:
+                line += newlines
+                line_start = text.rindex("\n", start, end) + 1
             continue
 
-        for token in grammar.TOKEN_TYPES:
-            if accept(re.escape(token)):
-                yield Token(token, token, line, col)
-                break
-        else:
-            if match := accept(r"\".*\""):  # strings
-                yield Token("Str", match[1:-1], line, col)
-            elif match := accept(r"\'\w\'"):  # chars
-                yield Token("Num", match[1:-1], line, col)
-            elif match := accept(r"[_a-zA-Z][_a-zA-Z0-9]*"):  # identifiers
-                yield Token("Id", match, line, col)
-            elif match := accept(r"\d+"):  # numbers
-                yield Token("Num", match, line, col)
+        col = start - line_start + 1
+        lexeme = match.group()
+        if kind == "Id":
+            if lexeme in keywords:
+                yield Token(lexeme, lexeme, line, col)
             else:
-                print(source[i : source.index(" ", i)])
-                sys.exit()
+                yield Token("Id", lexeme, line, col)
+        elif kind == "Op":
+            yield Token(lexeme, lexeme, line, col)
+        elif kind == "Num":
+            yield Token("Num", lexeme, line, col)
+        elif kind == "Str":
+            yield Token("Str", lexeme[1:-1], line, col)
+        else:  # chars, quoted to tell '0' from 0
+            yield Token("Num", lexeme, line, col)
+
+    return pos, line, line_start
+
+
+def tokenize(source: str) -> Iterator[Token]:
+    """Tokenize the source code."""
+    return scan(source, 0, len(source), 1, 0)
+
+
+def tokenize_stream(stream: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Token]:
+    """Tokenize source code read from a text stream in chunks.
+
+    Scanning stops before the last newline read so far until the stream is
+    exhausted, so tokens never straddle a chunk boundary; a block comment
+    that does is kept in the buffer until its end has been read.
+    """
+    buffer = ""
+    pos = 0
+    line, line_start = 1, 0
+
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = buffer[pos:] + chunk
+        line_start -= pos
+        limit = len(buffer) if not chunk else buffer.rfind("\n")
+        pos, line, line_start = yield from scan(buffer, 0, limit, line, line_start)
+        if not chunk:
+            return
+
+
+def tokenize_file(file_name: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Token]:
+    """Tokenize a source file without reading it into memory at once."""
+    with open(file_name) as stream:
+        yield from tokenize_stream(stream, chunk_size)
+
+
+class TokenBuffer:
+    """Compact token storage.
+
+    Tokens are kept column-wise: kind ids in an array('H'), line/col in
+    array('I') columns and lexemes as indices into one table of interned
+    strings. Iterating yields a TokenCursor, which the Compiler consumes
+    like a stream of Tokens.
+    """
+
+    def __init__(self, tokens: Iterable[Token]) -> None:
+        self.kinds = array("H")
+        self.lexemes = array("I")
+        self.lines = array("I")
+        self.cols = array("I")
+        self.table: list[str] = []
+
+        intern: dict[str, int] = {}
+        kind_ids = KIND_IDS
+        for kind, lexeme, line, col in tokens:
+            lexeme_id = intern.get(lexeme)
+            if lexeme_id is None:
+                lexeme_id = intern[lexeme] = len(self.table)
+                self.table.append(sys.intern(lexeme))
+            self.kinds.append(kind_ids[kind])
+            self.lexemes.append(lexeme_id)
+            self.lines.append(line)
+            self.cols.append(col)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        return Token(
+            KINDS[self.kinds[index]],
+            self.table[self.lexemes[index]],
+            self.lines[index],
+            self.cols[index],
+        )
+
+    def __iter__(self) -> "TokenCursor":
+        return TokenCursor(self)
+
+
+class TokenCursor:
+    """Iterator over a TokenBuffer that yields itself, moved to the next
+    token, so that walking the tokens allocates nothing."""
+
+    __slots__ = ("buffer", "index", "type", "lexeme")
+
+    def __init__(self, buffer: TokenBuffer) -> None:
+        self.buffer = buffer
+        self.index = -1
+        self.type = self.lexeme = None
+
+    def __iter__(self) -> "TokenCursor":
+        return self
+
+    def __next__(self) -> "TokenCursor":
+        buffer = self.buffer
+        index = self.index = self.index + 1
+        if index >= len(buffer.kinds):
+            raise StopIteration
+        self.type = KINDS[buffer.kinds[index]]
+        self.lexeme = buffer.table[buffer.lexemes[index]]
+        return self
+
+    @property
+    def line(self) -> int:
+        return self.buffer.lines[self.index]
+
+    @property
+    def col(self) -> int:
+        return self.buffer.cols[self.index]
@@ -1,189 +1,1278 @@
-import enum
+import mmap
+import struct
+from itertools import count
+from typing import Optional
 
+from subc.bytecode import EXIT_STUB, INSTRUCTION_SIZES, assemble
+from subc.code_manager import Opcode
+from subc.heap import Heap, HeapStats
+from subc.hooks import Hooks, run_hooks
+from subc.jit import HOT_THRESHOLD, compile_region, program_key
+from subc.output import Output
+from subc.profiler import Profile
 from subc.scope_manager import Sizes
+from subc.syscalls import SNAPSHOT, run_builtin
 
+MEMORY_SIZE = 1 << 16  # bytes, by default
+MMAP_THRESHOLD = 1 << 20  # larger memories are anonymous maps, zeroed lazily
 
-class Opcode(enum.Enum):
-    ADD = enum.auto()
-    SUB = enum.auto()
-    MUL = enum.auto()
-    DIV = enum.auto()
-    MOD = enum.auto()
-    EQ = enum.auto()
-    NE = enum.auto()
-    LT = enum.auto()
-    GT = enum.auto()
-    LE = enum.auto()
-    GE = enum.auto()
-    SHL = enum.auto()
-    SHR = enum.auto()
-    AND = enum.auto()
-    OR = enum.auto()
-    XOR = enum.auto()
-    NOT = enum.auto()
-    NEG = enum.auto()
-    PSH = enum.auto()
-    POP = enum.auto()
-    LEA = enum.auto()
-    IMM = enum.auto()
-    JMP = enum.auto()
-    JSR = enum.auto()
-    BZ = enum.auto()
-    BNZ = enum.auto()
-    ADJ = enum.auto()
-
-
-def execute(pc_start: int, program: list, data_segment) -> int:
-    """Runs the program and returns the exit code."""
-    program.extend(("PSH", "EXIT"))  # EXIT for main return
-    memory = [0] * 2048
-    memory[: len(data_segment)] = data_segment
-    heap = len(data_segment)
+# ints are 4 bytes little endian at any address; stores wrap to 32 bits
+load_word = struct.Struct("<i").unpack_from  # (memory, address) -> (word,)
+store_word = struct.Struct("<I").pack_into  # (memory, address, word & MASK)
+MASK = 0xFFFFFFFF
+
+# opcodes as plain ints, which the dispatch chain compares faster
+(
+    LEA, IMM, JMP, JSR, TCALL, BZ, BNZ, ENT, ADJ, RET, LI, LC, SI, SC, PSH,
+    IOR, XOR, AND, EQL, NEQ, LSS, GTR, LEQ, GEQ, SHL, SHR, ADD, SUB, MUL, DIV, MOD, NEG,
+    LLI, LLC, SLI, SLC, LGI, LGC, SGI, SGC,
+    BGE, BLE, BGT, BLT, BNE, BEQ, BGEI, BLEI, BGTI, BLTI, BNEI, BEQI,
+    ADDI, SUBI, SHLI, SHRI, ANDI, EQLI, NEQI, LSSI, GTRI, LEQI, GEQI,
+    PRINTF, MALLOC, FREE, EXIT, SYS,
+) = map(int, Opcode)  # fmt: skip
+
+
+def execute(
+    pc_start: int,
+    program,
+    data_segment,
+    engine: str = "switch",
+    memory_size: int = MEMORY_SIZE,
+    heap_stats: Optional[HeapStats] = None,
+    profile: Optional[Profile] = None,
+    hooks: Optional[Hooks] = None,
+    sink=None,
+) -> int:
+    """Runs the program and returns the exit code.
+
+    The program is the code of an assembled Image, or the compiler's list of
+    opcode names and operands, which is assembled first. `engine` selects
+    the interpreter among ENGINES; all give the same results. The program
+    gets memory_size bytes of memory, holding the data segment at address 0
+    followed by the heap, and the stack at the top. The use of the heap is
+    counted in heap_stats when given. With a Profile, the program runs on
+    the table engine whatever `engine` says, and its cycles are counted in
+    the profile; so it does with Hooks, which are called as it runs, but not
+    together with a Profile. The output is buffered on its way to sink (see
+    subc.output), stdout unless given.
+    """
+    if profile is not None and hooks is not None:
+        raise ValueError("a run takes a profile or hooks, not both")
+    if isinstance(program[0], str):
+        image = assemble(pc_start, program, data_segment)
+        program, data_segment = image.code, image.data
+    output = Output(sink)
+    try:
+        if profile is not None or hooks is not None:
+            return run_table(
+                pc_start,
+                program,
+                data_segment,
+                memory_size,
+                heap_stats,
+                output,
+                profile,
+                hooks,
+            )
+        return ENGINES[engine](
+            pc_start, program, data_segment, memory_size, heap_stats, output
+        )
+    finally:
+        output.flush()  # also when the run fails
 
-    # initialize processor registers
-    pc = pc_start
-    sp = (len(memory) - 1) & -Sizes.Int  # round down towards multiple of Int size
-    bp = 0
-    ax = 0
 
-    memory[sp] = len(program) - 2  # return address
+def allocate(size: int):
+    """zeroed, writable memory of size bytes"""
+    if size >= MMAP_THRESHOLD:
+        return mmap.mmap(-1, size)
+    return bytearray(size)
+
+
+def boot(
+    program, data_segment, memory_size: int = MEMORY_SIZE, heap_stats=None, output=None
+) -> tuple:
+    """the initial memory, stack pointer, heap and output, with a frame for
+    main that returns to the exit stub"""
+    if memory_size < len(data_segment) + 2 * Sizes.Int:
+        raise ValueError(f"{memory_size} bytes of memory do not fit the program")
+    memory = allocate(memory_size)
+    memory[: len(data_segment)] = data_segment
+    sp = (memory_size - Sizes.Int) & -Sizes.Int  # the top word
+    store_word(memory, sp, len(program) - len(EXIT_STUB))  # return address
     sp -= Sizes.Int
-    memory[sp] = bp  # base pointer
+    store_word(memory, sp, 0)  # base pointer
+    heap = Heap(memory, len(data_segment), heap_stats)
+    return memory, sp, heap, Output() if output is None else output
+
+
+class VM:
+    """A program booted in its memory, run a slice of cycles at a time.
+
+    Between runs the registers are kept in the object, so that the program
+    can be paused after any instruction and resumed later, interleaved with
+    others (see subc.scheduler). Instructions are decoded with a chain of
+    comparisons, as in run_switch.
+    """
+
+    __slots__ = (
+        "program", "memory", "heap", "output", "pc", "sp", "bp", "ax", "cycles",
+        "exit_code", "stop_at_snapshot", "at_snapshot",
+    )  # fmt: skip
+
+    def __init__(
+        self,
+        pc_start: int,
+        program,
+        data_segment,
+        memory_size: int = MEMORY_SIZE,
+        heap_stats=None,
+        output=None,
+    ) -> None:
+        if isinstance(program[0], str):
+            image = assemble(pc_start, program, data_segment)
+            program, data_segment = image.code, image.data
+        self.program = program
+        self.memory, self.sp, self.heap, self.output = boot(
+            program, data_segment, memory_size, heap_stats, output
+        )
+        self.pc = pc_start
+        self.bp = self.sp
+        self.ax = 0
+        self.cycles = 0  # instructions run so far
+        self.exit_code: Optional[int] = None  # once the program exited
+        self.stop_at_snapshot = False  # whether run returns at a call of snapshot()
+        self.at_snapshot = False  # whether the last run did
+
+    def run(self, max_cycles: Optional[int] = None) -> Optional[int]:
+        """run at most max_cycles instructions, or up to EXIT if None, or
+        up to a call of snapshot() if stop_at_snapshot; returns the exit
+        code once the program exited, None until then"""
+        if self.exit_code is not None:
+            return self.exit_code
+        self.at_snapshot = False
+        program, memory = self.program, self.memory
+        heap, output = self.heap, self.output
+        pc, sp, bp, ax = self.pc, self.sp, self.bp, self.ax
+        cycle = -1
+        try:
+            for cycle in count() if max_cycles is None else range(max_cycles):
+                opcode = program[pc]
+                pc += 1
+
+                if opcode == LEA:
+                    ax = bp + program[pc]
+                    pc += 1
+                elif opcode == IMM:
+                    ax = program[pc]
+                    pc += 1
+                elif opcode == JMP:
+                    pc = program[pc]
+                elif opcode == JSR:
+                    sp -= Sizes.Int
+                    store_word(memory, sp, pc + 1)
+                    sp -= Sizes.Int
+                    store_word(memory, sp, bp)
+                    bp = sp
+                    pc = program[pc]
+                elif opcode == BZ:
+                    if not ax:
+                        pc = program[pc]
+                    else:
+                        pc += 1
+                elif opcode == BNZ:
+                    if ax:
+                        pc = program[pc]
+                    else:
+                        pc += 1
+                elif opcode == ADJ:
+                    sp += program[pc]
+                    pc += 1
+                elif opcode == RET:
+                    sp = bp
+                    bp = load_word(memory, sp)[0]
+                    sp += Sizes.Int
+                    pc = load_word(memory, sp)[0]
+                    sp += Sizes.Int
+                elif opcode == LI:
+                    ax = load_word(memory, ax)[0]
+                elif opcode == LC:  # chars are signed
+                    ax = (memory[ax] ^ 0x80) - 0x80
+                elif opcode == SI:
+                    store_word(memory, load_word(memory, sp)[0], ax & MASK)
+                    sp += Sizes.Int
+                elif opcode == SC:
+                    memory[load_word(memory, sp)[0]] = ax & 0xFF
+                    sp += Sizes.Int
+                elif opcode == PSH:
+                    sp -= Sizes.Int
+                    store_word(memory, sp, ax & MASK)
+                elif opcode == LLI:
+                    ax = load_word(memory, bp + program[pc])[0]
+                    pc += 1
+                elif opcode == LLC:
+                    ax = (memory[bp + program[pc]] ^ 0x80) - 0x80
+                    pc += 1
+                elif opcode == SLI:
+                    store_word(memory, bp + program[pc], ax & MASK)
+                    pc += 1
+                elif opcode == SLC:
+                    memory[bp + program[pc]] = ax & 0xFF
+                    pc += 1
+                elif opcode == LGI:
+                    ax = load_word(memory, program[pc])[0]
+                    pc += 1
+                elif opcode == LGC:
+                    ax = (memory[program[pc]] ^ 0x80) - 0x80
+                    pc += 1
+                elif opcode == SGI:
+                    store_word(memory, program[pc], ax & MASK)
+                    pc += 1
+                elif opcode == SGC:
+                    memory[program[pc]] = ax & 0xFF
+                    pc += 1
+                elif opcode == TCALL:  # reuse the frame: arguments go over ours
+                    size = program[pc]
+                    memory[bp + 8 : bp + 8 + size] = memory[sp : sp + size]
+                    sp = bp
+                    pc = program[pc + 1]
+                elif opcode == BGE:
+                    ax = int(load_word(memory, sp)[0] < ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BLE:
+                    ax = int(load_word(memory, sp)[0] > ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BGT:
+                    ax = int(load_word(memory, sp)[0] <= ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BLT:
+                    ax = int(load_word(memory, sp)[0] >= ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BNE:
+                    ax = int(load_word(memory, sp)[0] == ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BEQ:
+                    ax = int(load_word(memory, sp)[0] != ax)
+                    sp += Sizes.Int
+                    pc = pc + 1 if ax else program[pc]
+                elif opcode == BGEI:
+                    ax = int(ax < program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == BLEI:
+                    ax = int(ax > program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == BGTI:
+                    ax = int(ax <= program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == BLTI:
+                    ax = int(ax >= program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == BNEI:
+                    ax = int(ax == program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == BEQI:
+                    ax = int(ax != program[pc])
+                    pc = pc + 2 if ax else program[pc + 1]
+                elif opcode == ADDI:
+                    ax += program[pc]
+                    pc += 1
+                elif opcode == SUBI:
+                    ax -= program[pc]
+                    pc += 1
+                elif opcode == LSSI:
+                    ax = int(ax < program[pc])
+                    pc += 1
+                elif opcode == GTRI:
+                    ax = int(ax > program[pc])
+                    pc += 1
+                elif opcode == LEQI:
+                    ax = int(ax <= program[pc])
+                    pc += 1
+                elif opcode == GEQI:
+                    ax = int(ax >= program[pc])
+                    pc += 1
+                elif opcode == EQLI:
+                    ax = int(ax == program[pc])
+                    pc += 1
+                elif opcode == NEQI:
+                    ax = int(ax != program[pc])
+                    pc += 1
+                elif opcode == SHLI:
+                    ax <<= program[pc]
+                    pc += 1
+                elif opcode == SHRI:
+                    ax >>= program[pc]
+                    pc += 1
+                elif opcode == ANDI:
+                    ax &= program[pc]
+                    pc += 1
+
+                elif opcode == IOR:
+                    ax = load_word(memory, sp)[0] | ax
+                    sp += Sizes.Int
+                elif opcode == XOR:
+                    ax = load_word(memory, sp)[0] ^ ax
+                    sp += Sizes.Int
+                elif opcode == AND:
+                    ax = load_word(memory, sp)[0] & ax
+                    sp += Sizes.Int
+                elif opcode == EQL:
+                    ax = int(load_word(memory, sp)[0] == ax)
+                    sp += Sizes.Int
+                elif opcode == NEQ:
+                    ax = int(load_word(memory, sp)[0] != ax)
+                    sp += Sizes.Int
+                elif opcode == LSS:
+                    ax = int(load_word(memory, sp)[0] < ax)
+                    sp += Sizes.Int
+                elif opcode == GTR:
+                    ax = int(load_word(memory, sp)[0] > ax)
+                    sp += Sizes.Int
+                elif opcode == LEQ:
+                    ax = int(load_word(memory, sp)[0] <= ax)
+                    sp += Sizes.Int
+                elif opcode == GEQ:
+                    ax = int(load_word(memory, sp)[0] >= ax)
+                    sp += Sizes.Int
+                elif opcode == SHL:
+                    ax = load_word(memory, sp)[0] << ax
+                    sp += Sizes.Int
+                elif opcode == SHR:
+                    ax = load_word(memory, sp)[0] >> ax
+                    sp += Sizes.Int
+
+                elif opcode == ADD:
+                    ax = load_word(memory, sp)[0] + ax
+                    sp += Sizes.Int
+                elif opcode == SUB:
+                    ax = load_word(memory, sp)[0] - ax
+                    sp += Sizes.Int
+                elif opcode == MUL:
+                    ax = load_word(memory, sp)[0] * ax
+                    sp += Sizes.Int
+                elif opcode == DIV:
+                    ax = load_word(memory, sp)[0] // ax
+                    sp += Sizes.Int
+                elif opcode == MOD:
+                    ax = load_word(memory, sp)[0] % ax
+                    sp += Sizes.Int
+                elif opcode == NEG:
+                    ax = -ax
+
+                elif opcode == PRINTF:
+                    output.printf(memory, sp, program[pc])
+                    pc += 1
+
+                elif opcode == MALLOC:
+                    pc += 1
+                    ax = heap.malloc(load_word(memory, sp)[0], sp)
+
+                elif opcode == FREE:
+                    pc += 1
+                    heap.free(load_word(memory, sp)[0])
+
+                elif opcode == SYS:
+                    if program[pc] == SNAPSHOT and self.stop_at_snapshot:
+                        self.at_snapshot = True
+                        ax = 1
+                        pc += 1
+                        return None
+                    ax = run_builtin(program[pc], memory, sp)
+                    pc += 1
+
+                elif opcode == EXIT:
+                    exit_code = load_word(memory, sp)[0]
+                    output.exit(exit_code)
+                    self.exit_code = exit_code
+                    return exit_code
+
+                else:
+                    print("unrecognized opcode")
+                    print(opcode)
+                    exit()
+        finally:
+            self.pc, self.sp, self.bp, self.ax = pc, sp, bp, ax
+            self.cycles += cycle + 1
+        return None
+
+
+def run_switch(
+    pc_start: int,
+    program,
+    data_segment,
+    memory_size: int = MEMORY_SIZE,
+    heap_stats=None,
+    output=None,
+) -> int:
+    """interpreter decoding each instruction with a chain of comparisons"""
+    return VM(pc_start, program, data_segment, memory_size, heap_stats, output).run()
+
+
+class Halt(Exception):
+    """raised by the EXIT handler of run_table to leave the dispatch loop"""
+
+    def __init__(self, exit_code: int) -> None:
+        super().__init__(exit_code)
+        self.exit_code = exit_code
+
+
+def run_table(
+    pc_start: int,
+    program,
+    data_segment,
+    memory_size: int = MEMORY_SIZE,
+    heap_stats=None,
+    output=None,
+    profile=None,
+    hooks=None,
+) -> int:
+    """interpreter indexing a table of handlers by opcode; each handler
+    runs one instruction and returns the address of the next. A Profile
+    given as profile runs the dispatch loop instead, counting cycles, and
+    so does run_hooks with hooks."""
+    memory, sp, heap, output = boot(
+        program, data_segment, memory_size, heap_stats, output
+    )
     bp = sp
+    ax = 0
+    INT = int(Sizes.Int)
+
+    def lea(pc):
+        nonlocal ax
+        ax = bp + program[pc]
+        return pc + 1
+
+    def imm(pc):
+        nonlocal ax
+        ax = program[pc]
+        return pc + 1
+
+    def jmp(pc):
+        return program[pc]
+
+    def jsr(pc):
+        nonlocal sp, bp
+        store_word(memory, sp - INT, pc + 1)
+        sp -= 2 * INT
+        store_word(memory, sp, bp)
+        bp = sp
+        return program[pc]
+
+    def tcall(pc):  # reuse the frame: arguments go over ours
+        nonlocal sp
+        size = program[pc]
+        memory[bp + 8 : bp + 8 + size] = memory[sp : sp + size]
+        sp = bp
+        return program[pc + 1]
+
+    def bz(pc):
+        return pc + 1 if ax else program[pc]
+
+    def bnz(pc):
+        return program[pc] if ax else pc + 1
+
+    def adj(pc):
+        nonlocal sp
+        sp += program[pc]
+        return pc + 1
+
+    def ret(pc):
+        nonlocal sp, bp
+        sp = bp + 2 * INT
+        bp = load_word(memory, sp - 2 * INT)[0]
+        return load_word(memory, sp - INT)[0]
+
+    def load(pc):
+        nonlocal ax
+        ax = load_word(memory, ax)[0]
+        return pc
+
+    def load_char(pc):
+        nonlocal ax
+        ax = (memory[ax] ^ 0x80) - 0x80
+        return pc
+
+    def store(pc):
+        nonlocal sp
+        store_word(memory, load_word(memory, sp)[0], ax & MASK)
+        sp += INT
+        return pc
+
+    def store_char(pc):
+        nonlocal sp
+        memory[load_word(memory, sp)[0]] = ax & 0xFF
+        sp += INT
+        return pc
+
+    def psh(pc):
+        nonlocal sp
+        sp -= INT
+        store_word(memory, sp, ax & MASK)
+        return pc
+
+    def load_local(pc):
+        nonlocal ax
+        ax = load_word(memory, bp + program[pc])[0]
+        return pc + 1
+
+    def load_local_char(pc):
+        nonlocal ax
+        ax = (memory[bp + program[pc]] ^ 0x80) - 0x80
+        return pc + 1
+
+    def store_local(pc):
+        store_word(memory, bp + program[pc], ax & MASK)
+        return pc + 1
+
+    def store_local_char(pc):
+        memory[bp + program[pc]] = ax & 0xFF
+        return pc + 1
+
+    def load_global(pc):
+        nonlocal ax
+        ax = load_word(memory, program[pc])[0]
+        return pc + 1
+
+    def load_global_char(pc):
+        nonlocal ax
+        ax = (memory[program[pc]] ^ 0x80) - 0x80
+        return pc + 1
+
+    def store_global(pc):
+        store_word(memory, program[pc], ax & MASK)
+        return pc + 1
+
+    def store_global_char(pc):
+        memory[program[pc]] = ax & 0xFF
+        return pc + 1
+
+    def ior(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] | ax
+        sp += INT
+        return pc
+
+    def xor(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] ^ ax
+        sp += INT
+        return pc
+
+    def and_(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] & ax
+        sp += INT
+        return pc
+
+    def eql(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] == ax)
+        sp += INT
+        return pc
+
+    def neq(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] != ax)
+        sp += INT
+        return pc
+
+    def lss(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] < ax)
+        sp += INT
+        return pc
+
+    def gtr(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] > ax)
+        sp += INT
+        return pc
+
+    def leq(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] <= ax)
+        sp += INT
+        return pc
+
+    def geq(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] >= ax)
+        sp += INT
+        return pc
+
+    def shl(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] << ax
+        sp += INT
+        return pc
+
+    def shr(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] >> ax
+        sp += INT
+        return pc
+
+    def add(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] + ax
+        sp += INT
+        return pc
+
+    def sub(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] - ax
+        sp += INT
+        return pc
+
+    def mul(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] * ax
+        sp += INT
+        return pc
+
+    def div(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] // ax
+        sp += INT
+        return pc
+
+    def mod(pc):
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] % ax
+        sp += INT
+        return pc
+
+    def neg(pc):
+        nonlocal ax
+        ax = -ax
+        return pc
+
+    # compare and branch: the branch is taken when the comparison fails
+    def bge(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] < ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def ble(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] > ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def bgt(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] <= ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def blt(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] >= ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def bne(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] == ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def beq(pc):
+        nonlocal ax, sp
+        ax = int(load_word(memory, sp)[0] != ax)
+        sp += INT
+        return pc + 1 if ax else program[pc]
+
+    def bgei(pc):
+        nonlocal ax
+        ax = int(ax < program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def blei(pc):
+        nonlocal ax
+        ax = int(ax > program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def bgti(pc):
+        nonlocal ax
+        ax = int(ax <= program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def blti(pc):
+        nonlocal ax
+        ax = int(ax >= program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def bnei(pc):
+        nonlocal ax
+        ax = int(ax == program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def beqi(pc):
+        nonlocal ax
+        ax = int(ax != program[pc])
+        return pc + 2 if ax else program[pc + 1]
+
+    def addi(pc):
+        nonlocal ax
+        ax += program[pc]
+        return pc + 1
+
+    def subi(pc):
+        nonlocal ax
+        ax -= program[pc]
+        return pc + 1
+
+    def shli(pc):
+        nonlocal ax
+        ax <<= program[pc]
+        return pc + 1
+
+    def shri(pc):
+        nonlocal ax
+        ax >>= program[pc]
+        return pc + 1
+
+    def andi(pc):
+        nonlocal ax
+        ax &= program[pc]
+        return pc + 1
+
+    def eqli(pc):
+        nonlocal ax
+        ax = int(ax == program[pc])
+        return pc + 1
+
+    def neqi(pc):
+        nonlocal ax
+        ax = int(ax != program[pc])
+        return pc + 1
+
+    def lssi(pc):
+        nonlocal ax
+        ax = int(ax < program[pc])
+        return pc + 1
+
+    def gtri(pc):
+        nonlocal ax
+        ax = int(ax > program[pc])
+        return pc + 1
+
+    def leqi(pc):
+        nonlocal ax
+        ax = int(ax <= program[pc])
+        return pc + 1
+
+    def geqi(pc):
+        nonlocal ax
+        ax = int(ax >= program[pc])
+        return pc + 1
+
+    def printf_(pc):
+        output.printf(memory, sp, program[pc])
+        return pc + 1
+
+    def malloc(pc):
+        nonlocal ax
+        ax = heap.malloc(load_word(memory, sp)[0], sp)
+        return pc + 1
+
+    def free(pc):
+        heap.free(load_word(memory, sp)[0])
+        return pc + 1
+
+    def sys_(pc):
+        nonlocal ax
+        ax = run_builtin(program[pc], memory, sp)
+        return pc + 1
+
+    def exit_(pc):
+        exit_code = load_word(memory, sp)[0]
+        output.exit(exit_code)
+        raise Halt(exit_code)
+
+    def unrecognized(pc):
+        print("unrecognized opcode")
+        print(program[pc - 1])
+        exit()
 
-    cycle = 0
-    while True:
-        cycle += 1
+    handlers = {
+        LEA: lea, IMM: imm, JMP: jmp, JSR: jsr, TCALL: tcall, BZ: bz, BNZ: bnz,
+        ADJ: adj, RET: ret, LI: load, LC: load_char, SI: store, SC: store_char,
+        PSH: psh, IOR: ior, XOR: xor, AND: and_, EQL: eql, NEQ: neq, LSS: lss, GTR: gtr,
+        LEQ: leq, GEQ: geq, SHL: shl, SHR: shr, ADD: add, SUB: sub, MUL: mul,
+        DIV: div, MOD: mod, NEG: neg,
+        LLI: load_local, LLC: load_local_char,
+        SLI: store_local, SLC: store_local_char,
+        LGI: load_global, LGC: load_global_char,
+        SGI: store_global, SGC: store_global_char,
+        BGE: bge, BLE: ble, BGT: bgt, BLT: blt, BNE: bne, BEQ: beq,
+        BGEI: bgei, BLEI: blei, BGTI: bgti, BLTI: blti, BNEI: bnei, BEQI: beqi,
+        ADDI: addi, SUBI: subi, SHLI: shli, SHRI: shri, ANDI: andi,
+        EQLI: eqli, NEQI: neqi, LSSI: lssi, GTRI: gtri, LEQI: leqi, GEQI: geqi,
+        PRINTF: printf_, MALLOC: malloc, FREE: free, EXIT: exit_, SYS: sys_,
+    }  # fmt: skip
+    table = [handlers.get(opcode, unrecognized) for opcode in range(max(Opcode) + 1)]
+
+    pc = pc_start
+    try:
+        if profile is not None:
+            profile.run(pc_start, program, table)
+        if hooks is not None:
+            run_hooks(hooks, pc_start, program, table, memory, lambda: (ax, sp, bp))
+        while True:
+            pc = table[program[pc]](pc + 1)
+    except Halt as halt:
+        return halt.exit_code
+
+
+# opcodes ending a basic block of threaded code
+TERMINATORS = {
+    JMP, JSR, TCALL, BZ, BNZ, RET, EXIT,
+    BGE, BLE, BGT, BLT, BNE, BEQ, BGEI, BLEI, BGTI, BLTI, BNEI, BEQI,
+}  # fmt: skip
+
+
+class Block:
+    """threaded code of a basic block: closures run in order, then `exit`
+    returns the block to continue with"""
+
+    __slots__ = ("ops", "exit")
+
+    def __init__(self) -> None:
+        self.ops: list = []
+        self.exit = None
+
+
+def leaders(pc_start: int, program) -> list[int]:
+    """addresses of the first instruction of each basic block, in order"""
+    starts = {pc_start, len(program) - len(EXIT_STUB)}
+    pc = 0
+    while pc < len(program):
         opcode = program[pc]
-        pc += 1
-
-        # z = {"LEA", "IMM", "JMP", "JSR", "BZ", "BNZ", "ADJ"}
-        # print(
-        #     "{:3d}: {:4s} {:3s} ".format(
-        #         cycle, opcode, str(program[pc]) if opcode in z else ""
-        #     ),
-        #     end="",
-        # )
-        # print("ax: {:4} bp: {:4} sp: {:4}  ".format(ax, bp, sp), end="")
-        # for x in memory[-48::4]:
-        #     print(f"{x:4},", end=" ")
-        # print()
-
-        if opcode == "LEA":
-            ax = bp + int(program[pc])
-            pc += 1
-        elif opcode == "IMM":
-            ax = int(program[pc])
-            pc += 1
-        elif opcode == "JMP":
-            pc = int(program[pc])
-        elif opcode == "JSR":
-            sp -= Sizes.Int
-            memory[sp] = pc + 1
-            sp -= Sizes.Int
-            memory[sp] = bp
-            bp = sp
-            pc = int(program[pc])
-        elif opcode == "BZ":
-            if not ax:
-                pc = int(program[pc])
-            else:
-                pc += 1
-        elif opcode == "BNZ":
-            if ax:
-                pc = int(program[pc])
-            else:
-                pc += 1
-        elif opcode == "ADJ":
-            sp += int(program[pc])
-            pc += 1
-        elif opcode == "RET":
-            sp = bp
-            bp = memory[sp]
-            sp += Sizes.Int
-            pc = memory[sp]
-            sp += Sizes.Int
-        elif opcode == "LI":
-            ax = memory[ax]
-        elif opcode == "LC":
-            ax = memory[ax]
-        elif opcode == "SI":
-            memory[memory[sp]] = ax
-            sp += Sizes.Int
-        elif opcode == "SC":
-            memory[memory[sp]] = ax
-            sp += Sizes.Int
-        elif opcode == "PSH":
-            sp -= Sizes.Int
-            memory[sp] = ax
-
-        elif opcode == "IOR":
-            ax = memory[sp] | ax
-            sp += Sizes.Int
-        elif opcode == "XOR":
-            ax = memory[sp] ^ ax
-            sp += Sizes.Int
-        elif opcode == "AND":
-            ax = memory[sp] & ax
-            sp += Sizes.Int
-        elif opcode == "EQL":
-            ax = int(memory[sp] == ax)
-            sp += Sizes.Int
-        elif opcode == "NEQ":
-            ax = int(memory[sp] != ax)
-            sp += Sizes.Int
-        elif opcode == "LSS":
-            ax = int(memory[sp] < ax)
-            sp += Sizes.Int
-        elif opcode == "GTR":
-            ax = int(memory[sp] > ax)
-            sp += Sizes.Int
-        elif opcode == "LEQ":
-            ax = int(memory[sp] <= ax)
-            sp += Sizes.Int
-        elif opcode == "GEQ":
-            ax = int(memory[sp] >= ax)
-            sp += Sizes.Int
-        elif opcode == "SHL":
-            ax = memory[sp] << ax
-            sp += Sizes.Int
-        elif opcode == "SHR":
-            ax = memory[sp] >> ax
-            sp += Sizes.Int
-
-        elif opcode == "ADD":
-            ax = memory[sp] + ax
-            sp += Sizes.Int
-        elif opcode == "SUB":
-            ax = memory[sp] - ax
-            sp += Sizes.Int
-        elif opcode == "MUL":
-            ax = memory[sp] * ax
-            sp += Sizes.Int
-        elif opcode == "DIV":
-            ax = memory[sp] // ax
-            sp += Sizes.Int
-        elif opcode == "MOD":
-            ax = memory[sp] % ax
-            sp += Sizes.Int
-
-        elif opcode == "PRINTF":
-            start = sp - Sizes.Int + program[pc + 1]
-            string = "".join(memory[memory[start] : memory.index(0, memory[start])])
-            string = string.replace("\\n", "\n")
-            args = tuple(memory[start - Sizes.Int : sp - Sizes.Int : -Sizes.Int])
-            print(string % args, end="")
-
-        elif opcode == "MALLOC":
-            args = memory[sp : sp + program[pc + 1]]
-            ax = heap
-            heap += args[0]
-
-        elif opcode == "EXIT":
-            print(f"exit({memory[sp]})")
-            return memory[sp]
-
-        else:
+        size = INSTRUCTION_SIZES.get(opcode, 1)
+        if opcode in TERMINATORS:
+            starts.add(pc + size)  # also where a JSR returns to
+            if opcode not in (RET, EXIT):
+                starts.add(program[pc + size - 1])
+        pc += size
+    return sorted(start for start in starts if start < len(program))
+
+
+def run_threaded(
+    pc_start: int,
+    program,
+    data_segment,
+    memory_size: int = MEMORY_SIZE,
+    heap_stats=None,
+    output=None,
+    hot: int = 0,
+) -> int:
+    """interpreter running code pre-decoded into closures per basic block,
+    with operands bound and jump targets resolved to blocks. With hot > 0
+    it counts the runs of each block and, once a block has run hot times,
+    switches to a Python function compiled from the region of code around
+    it (see subc.jit)."""
+    memory, sp, heap, output = boot(
+        program, data_segment, memory_size, heap_stats, output
+    )
+    bp = sp
+    ax = 0
+    INT = int(Sizes.Int)
+
+    # instructions that do not end a block, by opcode: without operands
+    # the closure itself, otherwise a factory binding the operand
+
+    def lea(n):
+        def op():
+            nonlocal ax
+            ax = bp + n
+
+        return op
+
+    def imm(n):
+        def op():
+            nonlocal ax
+            ax = n
+
+        return op
+
+    def adj(n):
+        def op():
+            nonlocal sp
+            sp += n
+
+        return op
+
+    def load():
+        nonlocal ax
+        ax = load_word(memory, ax)[0]
+
+    def load_char():
+        nonlocal ax
+        ax = (memory[ax] ^ 0x80) - 0x80
+
+    def store():
+        nonlocal sp
+        store_word(memory, load_word(memory, sp)[0], ax & MASK)
+        sp += INT
+
+    def store_char():
+        nonlocal sp
+        memory[load_word(memory, sp)[0]] = ax & 0xFF
+        sp += INT
+
+    def psh():
+        nonlocal sp
+        sp -= INT
+        store_word(memory, sp, ax & MASK)
+
+    def load_local(n):
+        def op():
+            nonlocal ax
+            ax = load_word(memory, bp + n)[0]
+
+        return op
+
+    def load_local_char(n):
+        def op():
+            nonlocal ax
+            ax = (memory[bp + n] ^ 0x80) - 0x80
+
+        return op
+
+    def store_local(n):
+        def op():
+            store_word(memory, bp + n, ax & MASK)
+
+        return op
+
+    def store_local_char(n):
+        def op():
+            memory[bp + n] = ax & 0xFF
+
+        return op
+
+    def load_global(n):
+        def op():
+            nonlocal ax
+            ax = load_word(memory, n)[0]
+
+        return op
+
+    def load_global_char(n):
+        def op():
+            nonlocal ax
+            ax = (memory[n] ^ 0x80) - 0x80
+
+        return op
+
+    def store_global(n):
+        def op():
+            store_word(memory, n, ax & MASK)
+
+        return op
+
+    def store_global_char(n):
+        def op():
+            memory[n] = ax & 0xFF
+
+        return op
+
+    def binary(operator):
+        """closure applying operator to the popped word and ax"""
+
+        def op():
+            nonlocal ax, sp
+            ax = operator(load_word(memory, sp)[0], ax)
+            sp += INT
+
+        return op
+
+    def add():
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] + ax
+        sp += INT
+
+    def sub():
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] - ax
+        sp += INT
+
+    def mul():
+        nonlocal ax, sp
+        ax = load_word(memory, sp)[0] * ax
+        sp += INT
+
+    def neg():
+        nonlocal ax
+        ax = -ax
+
+    def addi(n):
+        def op():
+            nonlocal ax
+            ax += n
+
+        return op
+
+    def subi(n):
+        def op():
+            nonlocal ax
+            ax -= n
+
+        return op
+
+    def immediate(operator):
+        """factory of closures applying operator to ax and an operand"""
+
+        def bind(n):
+            def op():
+                nonlocal ax
+                ax = operator(ax, n)
+
+            return op
+
+        return bind
+
+    def printf_(n):
+        def op():
+            output.printf(memory, sp, n)
+
+        return op
+
+    def malloc(n):
+        def op():
+            nonlocal ax
+            ax = heap.malloc(load_word(memory, sp)[0], sp)
+
+        return op
+
+    def free(n):
+        def op():
+            heap.free(load_word(memory, sp)[0])
+
+        return op
+
+    def sys_(n):
+        def op():
+            nonlocal ax
+            ax = run_builtin(n, memory, sp)
+
+        return op
+
+    def unrecognized(opcode):
+        def op():
             print("unrecognized opcode")
             print(opcode)
             exit()
+
+        return op
+
+    simple = {
+        LI: load, LC: load_char, SI: store, SC: store_char, PSH: psh, NEG: neg,
+        ADD: add, SUB: sub, MUL: mul,
+        IOR: binary(int.__or__), XOR: binary(int.__xor__), AND: binary(int.__and__),
+        EQL: binary(lambda a, b: int(a == b)), NEQ: binary(lambda a, b: int(a != b)),
+        LSS: binary(lambda a, b: int(a < b)), GTR: binary(lambda a, b: int(a > b)),
+        LEQ: binary(lambda a, b: int(a <= b)), GEQ: binary(lambda a, b: int(a >= b)),
+        SHL: binary(int.__lshift__), SHR: binary(int.__rshift__),
+        DIV: binary(int.__floordiv__), MOD: binary(int.__mod__),
+    }  # fmt: skip
+    with_operand = {
+        LEA: lea, IMM: imm, ADJ: adj,
+        LLI: load_local, LLC: load_local_char,
+        SLI: store_local, SLC: store_local_char,
+        LGI: load_global, LGC: load_global_char,
+        SGI: store_global, SGC: store_global_char,
+        ADDI: addi, SUBI: subi,
+        SHLI: immediate(int.__lshift__), SHRI: immediate(int.__rshift__),
+        ANDI: immediate(int.__and__),
+        EQLI: immediate(lambda a, b: int(a == b)),
+        NEQI: immediate(lambda a, b: int(a != b)),
+        LSSI: immediate(lambda a, b: int(a < b)),
+        GTRI: immediate(lambda a, b: int(a > b)),
+        LEQI: immediate(lambda a, b: int(a <= b)),
+        GEQI: immediate(lambda a, b: int(a >= b)),
+        PRINTF: printf_, MALLOC: malloc, FREE: free, SYS: sys_,
+    }  # fmt: skip
+
+    # instructions ending a block, bound to the blocks they continue with
+
+    def jmp(target):
+        return lambda: target
+
+    def jsr(target, returns):
+        def exit():
+            nonlocal sp, bp
+            store_word(memory, sp - INT, returns)
+            sp -= 2 * INT
+            store_word(memory, sp, bp)
+            bp = sp
+            return target
+
+        return exit
+
+    def tcall(size, target):
+        def exit():
+            nonlocal sp
+            memory[bp + 8 : bp + 8 + size] = memory[sp : sp + size]
+            sp = bp
+            return target
+
+        return exit
+
+    def ret():
+        nonlocal sp, bp
+        sp = bp + 2 * INT
+        bp = load_word(memory, sp - 2 * INT)[0]
+        return blocks[load_word(memory, sp - INT)[0]]
+
+    def exit_():
+        exit_code = load_word(memory, sp)[0]
+        output.exit(exit_code)
+        raise Halt(exit_code)
+
+    def bz(target, following):
+        return lambda: following if ax else target
+
+    def bnz(target, following):
+        return lambda: target if ax else following
+
+    def branch(compare, target, following):
+        """pop and compare with ax, branch when the comparison fails"""
+
+        def exit():
+            nonlocal ax, sp
+            ax = int(compare(load_word(memory, sp)[0], ax))
+            sp += INT
+            return following if ax else target
+
+        return exit
+
+    def branch_immediate(compare, k, target, following):
+        """compare ax with k, branch when the comparison fails"""
+
+        def exit():
+            nonlocal ax
+            ax = int(compare(ax, k))
+            return following if ax else target
+
+        return exit
+
+    compares = {
+        BGE: int.__lt__, BLE: int.__gt__, BGT: int.__le__,
+        BLT: int.__ge__, BNE: int.__eq__, BEQ: int.__ne__,
+    }  # fmt: skip
+    immediate_compares = {
+        BGEI: int.__lt__, BLEI: int.__gt__, BGTI: int.__le__,
+        BLTI: int.__ge__, BNEI: int.__eq__, BEQI: int.__ne__,
+    }  # fmt: skip
+
+    starts = leaders(pc_start, program)
+    blocks = {start: Block() for start in starts}
+    for start, end in zip(starts, starts[1:] + [len(program)]):
+        block = blocks[start]
+        pc = start
+        while pc < end:
+            opcode = program[pc]
+            size = INSTRUCTION_SIZES.get(opcode, 1)
+            operands = program[pc + 1 : pc + size]
+            pc += size
+            if opcode in simple:
+                block.ops.append(simple[opcode])
+            elif opcode in with_operand:
+                block.ops.append(with_operand[opcode](*operands))
+            elif opcode == JMP:
+                block.exit = jmp(blocks[operands[0]])
+            elif opcode == JSR:
+                block.exit = jsr(blocks[operands[0]], pc)
+            elif opcode == TCALL:
+                block.exit = tcall(operands[0], blocks[operands[1]])
+            elif opcode == RET:
+                block.exit = ret
+            elif opcode == EXIT:
+                block.exit = exit_
+            elif opcode in (BZ, BNZ):
+                following = blocks.get(pc)
+                make = bz if opcode == BZ else bnz
+                block.exit = make(blocks[operands[0]], following)
+            elif opcode in compares:
+                block.exit = branch(
+                    compares[opcode], blocks[operands[0]], blocks.get(pc)
+                )
+            elif opcode in immediate_compares:
+                k, target = operands
+                block.exit = branch_immediate(
+                    immediate_compares[opcode], k, blocks[target], blocks.get(pc)
+                )
+            else:
+                block.ops.append(unrecognized(opcode))
+        if block.exit is None:  # falls through into the next block
+            block.exit = jmp(blocks.get(end))
+
+    block = blocks[pc_start]
+    if not hot:
+        try:
+            while True:
+                for op in block.ops:
+                    op()
+                block = block.exit()
+        except Halt as halt:
+            return halt.exit_code
+
+    key = program_key(program)
+    ends = dict(zip(starts, starts[1:] + [len(program)]))
+    address = {block: start for start, block in blocks.items()}
+    namespace = {
+        "Halt": Halt,
+        "run_builtin": run_builtin,
+        "load_word": load_word,
+        "store_word": store_word,
+    }
+    runs = dict.fromkeys(address, 0)
+    regions: dict = {}  # compiled regions by block, None if untranslatable
+    try:
+        while True:
+            region = regions.get(block)
+            if region is not None:
+                pc, ax, sp, bp = region(memory, ax, sp, bp, heap, output)
+                block = blocks[pc]
+                continue
+            runs[block] += 1
+            if runs[block] == hot:
+                regions[block] = compile_region(
+                    program, key, ends, address[block], namespace
+                )
+                continue
+            for op in block.ops:
+                op()
+            block = block.exit()
+    except Halt as halt:
+        return halt.exit_code
+
+
+def run_jit(
+    pc_start: int,
+    program,
+    data_segment,
+    memory_size: int = MEMORY_SIZE,
+    heap_stats=None,
+    output=None,
+) -> int:
+    """threaded interpreter compiling hot regions to Python"""
+    return run_threaded(
+        pc_start, program, data_segment, memory_size, heap_stats, output, HOT_THRESHOLD
+    )
+
+
+ENGINES = {
+    "switch": run_switch,
+    "table": run_table,
+    "threaded": run_threaded,
+    "jit": run_jit,
+}
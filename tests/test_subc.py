@@ -1,6 +1,29 @@
+import asyncio
+import importlib.util
+import io
+import json
+import os
+
+import pytest
+
+from subc import jit
+from subc.aot import translate_file
+from subc.batch import BatchStats, inputs, run_batch
+from subc.bytecode import EXIT_STUB, assemble, is_image, load
+from subc.cache import Cache, source_key
+from subc.code_manager import Opcode
 from subc.compiler import Compiler
-from subc.tokenizer import tokenize
-from subc.virtual_machine import execute
+from subc.heap import Heap, HeapStats
+from subc.hooks import Hooks, Trace, read_trace
+from subc.jit import MAX_REGIONS, REGIONS, program_key
+from subc.optimizer import optimize
+from subc.output import NULL, Output
+from subc.profiler import Profile
+from subc.scheduler import CycleLimitError, Scheduler
+from subc.snapshot import is_snapshot, restore, save
+from subc.syscalls import strcmp, strlen
+from subc.tokenizer import Token, TokenBuffer, tokenize, tokenize_stream
+from subc.virtual_machine import ENGINES, VM, execute
 
 
 def test():
@@ -9,3 +32,803 @@ def test():
     tokens = tokenize(text)
     pc_start, program, data_segment = Compiler(tokens).parse_global_declarations()
     assert execute(pc_start, program, data_segment) == 0
+
+
+def test_tokenize():
+    text = "int integer; /* a\n b */ x->y >= 'c';\n  printf(\"%d\\n\", 42);"
+    assert list(tokenize(text)) == [
+        Token("int", "int", 1, 1),
+        Token("Id", "integer", 1, 5),
+        Token(";", ";", 1, 12),
+        Token("Id", "x", 2, 7),
+        Token("->", "->", 2, 8),
+        Token("Id", "y", 2, 10),
+        Token(">=", ">=", 2, 12),
+        Token("Num", "'c'", 2, 15),
+        Token(";", ";", 2, 18),
+        Token("Id", "printf", 3, 3),
+        Token("(", "(", 3, 9),
+        Token("Str", "%d\\n", 3, 10),
+        Token(",", ",", 3, 16),
+        Token("Num", "42", 3, 18),
+        Token(")", ")", 3, 20),
+        Token(";", ";", 3, 21),
+    ]
+
+
+def test_char_literals(capsys):
+    text = "int main() { printf(\"%d %d %d\\n\", '0', '9', 'a'); return '1'; }"
+    assert execute(*Compiler(tokenize(text)).parse_global_declarations()) == 49
+    assert capsys.readouterr().out == "48 57 97\nexit(49)\n"
+
+
+def test_tokenize_stream():
+    text = open("examples/comments.c").read() + open("examples/linked_list.c").read()
+    expected = list(tokenize(text))
+    for chunk_size in (1, 5, 64):
+        assert list(tokenize_stream(io.StringIO(text), chunk_size)) == expected
+
+
+def test_token_buffer():
+    text = open("examples/linked_list.c").read()
+    buffer = TokenBuffer(tokenize(text))
+    assert [buffer[i] for i in range(len(buffer))] == list(tokenize(text))
+
+    pc_start, program, data_segment = Compiler(buffer).parse_global_declarations()
+    expected = Compiler(tokenize(text)).parse_global_declarations()
+    assert (pc_start, program, data_segment) == expected
+
+
+FOLDING = """
+int main() {
+    int x = 6;
+    int *p = &x;
+    printf("%d %d %d %d\\n", 2 * 3 + 4, x * 8, x / 4 + -x, *(p + 0) * 1);
+    return x % 4 + (16 / 2);
+}
+"""
+
+
+def test_fold_constants(capsys):
+    compiler = Compiler(tokenize(FOLDING))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    size = len(program)
+    pc_start, program, report = optimize(pc_start, program, compiler.functions())
+    assert report.removed["main"] > 0 and len(program) < size
+    assert "SHL" in program and "SHR" in program and "NEG" in program
+    assert "MUL" not in program and "DIV" not in program
+
+    assert execute(pc_start, program, data_segment) == 10
+    assert capsys.readouterr().out == "10 48 -5 6\nexit(10)\n"
+
+
+OVERFLOW = """
+int main() {
+    int x;
+    x = 100000 * 100000;
+    printf("%d %d\\n", x, -(0 - 2147483647 - 1) + 100000 * 100000 / 3);
+    printf("%d\\n", 3000000000);
+    if (65536 * 65536) printf("taken\\n");
+    printf("%d\\n", 0 == 65536 * 65536);
+    return 0;
+}
+"""
+
+
+def test_fold_overflow(capsys):
+    # constants overflowing a word are left to run time, where ax holds them
+    # exactly until they are stored; literals wrap as the VM's words do
+    for level in (0, 1, 2):
+        compiler = Compiler(tokenize(OVERFLOW))
+        pc_start, program, data_segment = compiler.parse_global_declarations()
+        pc_start, program, _ = optimize(pc_start, program, compiler.functions(), level)
+        image = assemble(pc_start, program, data_segment)
+        assert execute(image.pc_start, image.code, image.data) == 0
+        assert (
+            capsys.readouterr().out
+            == "1410065408 -1677461846\n-1294967296\ntaken\n0\nexit(0)\n"
+        )
+
+
+def run(text, level=0):
+    compiler = Compiler(tokenize(text))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    pc_start, program, _ = optimize(pc_start, program, compiler.functions(), level)
+    return execute(pc_start, program, data_segment), program
+
+
+def test_superinstructions(capsys):
+    for name in ("star", "linked_list", "bresenham", "fib"):
+        text = open(f"examples/{name}.c").read()
+        exit_code, program = run(text)
+        expected = capsys.readouterr().out
+        fused_exit_code, fused = run(text, 2)
+        assert (fused_exit_code, capsys.readouterr().out) == (exit_code, expected)
+        assert len(fused) < len(program)
+        assert "LLI" in fused and "SLI" in fused
+
+
+BRANCHES = """
+int main() {
+    int i = 0;
+    int n = 0;
+    while (i < 10) {
+        if (i == 3 || i == 5) {
+            if (n) n = n + 1000; else n = 1;
+        } else {
+            if (i > 6 && i != 8) n = n + 100; else n = n + 1;
+        }
+        i++;
+    }
+    return n > 2000 ? n : 0;
+}
+"""
+
+
+def test_branches():
+    for level in (0, 1, 2):
+        exit_code, program = run(BRANCHES, level)
+        assert exit_code == 2206
+    assert {"BGEI", "BLEI", "EQLI"} <= set(program)
+    for pc, opcode in enumerate(program):
+        if opcode == "JMP":
+            assert program[program[pc + 1]] != "JMP"
+
+
+DATAFLOW = """
+int main() {
+    int a = 3;
+    int b = 4;
+    int c = a * b;
+    int d = c;
+    b = 100;
+    b = d + d;
+    if (a < 5) d = 1; else d = 2;
+    return b + d;
+}
+"""
+
+
+def test_dataflow():
+    for level in (0, 1, 2):
+        exit_code, program = run(DATAFLOW, level)
+        assert exit_code == 25
+    # a and the constant branch fold away, the store of 100 is dead and
+    # d + d loads d once
+    assert "MUL" not in program and 100 not in program
+    assert "BGEI" not in program and program.count("LLI") <= 3
+
+
+WRAPPED_STORE = """
+int big(int a) {
+    int x;
+    x = a + 1;
+    if (x < 0) return 1;
+    return 2;
+}
+int main() { return big(2147483647); }
+"""
+
+
+def test_wrapped_store():
+    for level in (0, 1, 2):  # x is read back wrapped, not the sum left in ax
+        compiler = Compiler(tokenize(WRAPPED_STORE))
+        pc_start, program, data_segment = compiler.parse_global_declarations()
+        pc_start, program, _ = optimize(pc_start, program, compiler.functions(), level)
+        for engine in ENGINES:
+            assert execute(pc_start, program, data_segment, engine) == 1
+
+
+DEAD_CODE = """
+int unused(int x) { return x * 7; }
+int twice(int x) { return x + x; }
+int helper(int x) { return twice(x) + 1; }
+int main() {
+    if (0) printf("never\\n");
+    return helper(4);
+    printf("after return\\n");
+}
+"""
+
+
+def test_dead_code(capsys):
+    exit_code, program = run(DEAD_CODE)
+    assert exit_code == 9 and "MUL" in program
+    compiler = Compiler(tokenize(DEAD_CODE))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    pc_start, program, report = optimize(pc_start, program, compiler.functions())
+    assert report.unreachable == ["unused"]
+    assert "MUL" not in program and "PRINTF" not in program
+    assert execute(pc_start, program, data_segment) == 9
+    assert capsys.readouterr().out == "exit(9)\nexit(9)\n"
+
+
+def test_inline(tmp_path, capsys):
+    for name in ("calls", "linked_list", "fib"):
+        text = open(f"examples/{name}.c").read()
+        exit_code, _ = run(text)
+        expected = capsys.readouterr().out
+        compiler = Compiler(tokenize(text))
+        pc_start, program, data_segment = compiler.parse_global_declarations()
+        pc_start, program, report = optimize(
+            pc_start, program, compiler.functions(), 2, inline_threshold=32
+        )
+        for engine in ENGINES:  # the jit reads the arguments pushed for inlined calls
+            assert execute(pc_start, program, data_segment, engine) == exit_code
+            assert capsys.readouterr().out == expected
+        path = tmp_path / f"{name}.py"  # as do translated modules
+        translate_file(path, pc_start, program, data_segment)
+        spec = importlib.util.spec_from_file_location(path.stem, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        assert module.run() == exit_code
+        assert capsys.readouterr().out == expected
+        if name == "calls":
+            assert report.inlined == {"square": 1, "clamp": 1, "max": 1}
+            assert "JSR" not in program
+        if name == "fib":  # recursive
+            assert not report.inlined
+
+    # a call that can never run is left as it is
+    text = "int sq(int x) { return x * x; } int main() { return 3; return sq(4); }"
+    compiler = Compiler(tokenize(text))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    pc_start, program, report = optimize(
+        pc_start, program, compiler.functions(), 0, inline_threshold=32
+    )
+    assert execute(pc_start, program, data_segment) == 3
+
+
+TAIL_CALL = """
+int sum(int n, int acc) {
+    if (n == 0) return acc;
+    return sum(n - 1, acc + n);
+}
+int count(int n) { return sum(n, 0); }  // more arguments than count
+int main() {
+    return count(1000) % 256;
+}
+"""
+
+
+def test_tail_call():
+    for level in (0, 2):
+        exit_code, program = run(TAIL_CALL, level)
+        assert exit_code == 500500 % 256
+        assert program.count("TCALL") == 1 and "JSR" in program
+
+
+ESCAPING_FRAME = """
+int f(int *p) {
+    int y;
+    y = 5;
+    return *p + y;
+}
+int g(int a) {
+    int x;
+    x = a;
+    return f(&x);
+}
+int h(int a) {
+    return f(&a);
+}
+int z;
+int main() {
+    z = 1;
+    printf("%d %d\\n", g(10), h(10));
+    return f(&z);
+}
+"""
+
+
+def test_tail_call_escaping_frame(capsys):
+    for level in (0, 2):  # g and h pass the address of their frame to f
+        compiler = Compiler(tokenize(ESCAPING_FRAME))
+        pc_start, program, data_segment = compiler.parse_global_declarations()
+        pc_start, program, _ = optimize(pc_start, program, compiler.functions(), level)
+        assert "TCALL" not in program
+        for engine in ENGINES:
+            assert execute(pc_start, program, data_segment, engine) == 6
+            assert capsys.readouterr().out == "15 15\nexit(6)\n"
+
+
+def test_cache(tmp_path, monkeypatch):
+    source = tmp_path / "fib.c"
+    source.write_text(open("examples/fib.c").read())
+    key = source_key(str(source), 0, 0)
+    assert key == source_key(str(source), 0, 0) != source_key(str(source), 2, 0)
+
+    compiler = Compiler(tokenize(source.read_text()))
+    image = assemble(*compiler.parse_global_declarations())
+    cache = Cache(tmp_path / "cache")
+    assert cache.get(key) is None
+    cache.put(key, image)
+    cached = cache.get(key)
+    assert cached.to_bytes() == image.to_bytes()
+    assert execute(cached.pc_start, cached.code, cached.data) == 0
+    assert list(cache.directory.iterdir()) == [cache.path(key)]
+
+    # the least recently used entries go once the cache is full
+    cache.max_size = cache.path(key).stat().st_size * 5 // 2
+    os.utime(cache.path(key), (0, 0))
+    cache.put("other", image)
+    cache.put("newest", image)
+    assert cache.get(key) is None and cache.get("newest") is not None
+
+    def utime(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(os, "utime", utime)  # a read-only cache still hits
+    assert cache.get("newest").to_bytes() == image.to_bytes()
+
+
+def test_bytecode(tmp_path, capsys):
+    text = open("examples/linked_list.c").read()
+    exit_code, _ = run(text)
+    expected = capsys.readouterr().out
+
+    compiler = Compiler(tokenize(text))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    image = assemble(pc_start, program, data_segment)
+    assert len(image.code) == len(program) + len(EXIT_STUB)
+    assert image.code[pc_start] == Opcode.ADJ and program[pc_start] == "ADJ"
+    assert bytes(image.data).startswith(b"%d -> \0")
+
+    image.save(tmp_path / "linked_list.sbc")
+    assert is_image(tmp_path / "linked_list.sbc")
+    loaded = load(tmp_path / "linked_list.sbc")
+    assert loaded.pc_start == pc_start and list(loaded.code) == list(image.code)
+    assert execute(loaded.pc_start, loaded.code, loaded.data) == exit_code
+    assert capsys.readouterr().out == expected
+
+
+def test_engines(capsys):
+    for name in ("fib", "linked_list", "calls", "star"):
+        for level in (0, 2):
+            compiler = Compiler(tokenize(open(f"examples/{name}.c").read()))
+            pc_start, program, data_segment = compiler.parse_global_declarations()
+            compiled = optimize(pc_start, program, compiler.functions(), level)
+            image = assemble(compiled[0], compiled[1], data_segment)
+            results = []
+            for engine in ENGINES:
+                exit_code = execute(image.pc_start, image.code, image.data, engine)
+                results.append((exit_code, capsys.readouterr().out))
+            assert results == [results[0]] * len(ENGINES)
+
+
+def test_jit(capsys):
+    text = open("examples/calls.c").read()
+    exit_code, _ = run(text)
+    expected = capsys.readouterr().out
+    image = assemble(*Compiler(tokenize(text)).parse_global_declarations())
+    key = program_key(image.code)
+    assert execute(image.pc_start, image.code, image.data, "jit") == exit_code
+    assert capsys.readouterr().out == expected
+    # the main loop and the hot callees were compiled, once per program
+    compiled = [start for (k, start), region in REGIONS.items() if k == key and region]
+    assert len(compiled) >= 2
+    size = len(REGIONS)
+    execute(image.pc_start, image.code, image.data, "jit")
+    assert len(REGIONS) == size
+
+    # the least recently used regions go once the cache is full
+    jit.MAX_REGIONS = 1
+    try:
+        text = "int main() { int i; i = 0; while (i < 1000) i++; return i % 7; }"
+        assert (
+            execute(*Compiler(tokenize(text)).parse_global_declarations(), "jit") == 6
+        )
+        assert len(REGIONS) == 1 and all(k != key for k, _ in REGIONS)
+    finally:
+        jit.MAX_REGIONS = MAX_REGIONS
+
+
+def test_translate_program(tmp_path, capsys):
+    examples = {
+        name: open(f"examples/{name}.c").read()
+        for name in ("fib", "linked_list", "calls")
+    }
+    for name, text in {
+        **examples,
+        "tail_call": TAIL_CALL,
+        "branches": BRANCHES,
+        "overflow": "int main() { int a; a = 2147483647; return a + 1; }",
+    }.items():
+        for level in (0, 2):
+            compiler = Compiler(tokenize(text))
+            pc_start, program, data_segment = compiler.parse_global_declarations()
+            pc_start, program, _ = optimize(
+                pc_start, program, compiler.functions(), level
+            )
+            exit_code = execute(pc_start, program, data_segment)
+            expected = capsys.readouterr().out
+
+            path = tmp_path / f"{name}_{level}.py"
+            translate_file(path, pc_start, program, data_segment)
+            spec = importlib.util.spec_from_file_location(path.stem, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            assert module.run() == exit_code
+            assert capsys.readouterr().out == expected
+            source = path.read_text()
+            assert "import subc" not in source and "from subc" not in source
+            if name == "fib":  # the recursion is a Python call
+                assert "ax = f_0(memory, sp - 8, sp - 8)" in source
+
+
+MEMORY = """
+int g;
+char c;
+int big;
+int depth(int n) {
+    if (n == 0) return 0;
+    return 1 + depth(n - 1);
+}
+int main() {
+    char a;
+    char *s;
+    int *p;
+    s = "hello";
+    a = 300;
+    c = 200;
+    big = 2147483647;
+    big = big + 1;
+    p = malloc(8);
+    *p = 7;
+    g = depth(10000) / 100;
+    printf("%d %d %d %c %d\\n", a, c, big, s[1], *p);
+    return g;
+}
+"""
+
+
+def test_memory(tmp_path, capsys):
+    compiler = Compiler(tokenize(MEMORY))
+    image = assemble(*compiler.parse_global_declarations())
+    # the globals have their own zeroed bytes in the data segment
+    assert bytes(image.data).startswith(bytes(12) + b"hello\0")
+    for engine in ENGINES:
+        # 10000 frames of 12 bytes do not fit in the default memory
+        exit_code = execute(image.pc_start, image.code, image.data, engine, 1 << 20)
+        assert exit_code == 100
+        assert capsys.readouterr().out == "44 -56 -2147483648 e 7\nexit(100)\n"
+
+    # each call of depth nests a Python call in the translated module
+    path = tmp_path / "memory.py"
+    translate_file(path, image.pc_start, image.code, image.data)
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.run(1 << 20) == 100
+    assert capsys.readouterr().out == "44 -56 -2147483648 e 7\nexit(100)\n"
+
+
+def test_heap(tmp_path, capsys):
+    heap = Heap(bytearray(1 << 16), 13)
+    small = heap.malloc(8, 1 << 16)
+    a, b, c = (heap.malloc(200, 1 << 16) for _ in range(3))
+    assert small % 8 == 0 and small < a < b < c
+    heap.free(small)
+    assert heap.malloc(12, 1 << 16) == small  # from the free list of its class
+    heap.free(a)
+    heap.free(b)  # coalesces with a
+    assert heap.stats.fragmentation == 0 and heap.malloc(400, 1 << 16) == a
+    heap.free(c)
+    assert heap.top == c - 4 and heap.stats.live == 16 + 416  # too little left to split
+    assert heap.malloc(1 << 16, 1 << 16) == 0
+
+    text = open("examples/allocator.c").read()
+    image = assemble(*Compiler(tokenize(text)).parse_global_declarations())
+    for engine in ENGINES:
+        stats = HeapStats()
+        assert (
+            execute(image.pc_start, image.code, image.data, engine, heap_stats=stats)
+            == 0
+        )
+        assert capsys.readouterr().out == "19000\nexit(0)\n"
+        # 4000 blocks of up to 416 bytes, reused rather than piled up
+        assert stats.mallocs == stats.frees == 4000 and stats.live == 0
+        assert stats.peak < 8000
+    path = tmp_path / "allocator.py"
+    translate_file(path, image.pc_start, image.code, image.data)
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.run() == 0 and capsys.readouterr().out == "19000\nexit(0)\n"
+
+
+def test_profile(capsys):
+    text = open("examples/fib.c").read()
+    exit_code, _ = run(text)
+    expected = capsys.readouterr().out
+    compiler = Compiler(tokenize(text))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    pc_start, program, report = optimize(pc_start, program, compiler.functions(), 2)
+    profile = Profile(report.functions)
+    assert execute(pc_start, program, data_segment, "jit", profile=profile) == exit_code
+    assert capsys.readouterr().out == expected
+
+    cycles = profile.cycles()
+    assert cycles == sum(profile.opcodes.values())
+    assert profile.opcodes["JSR"] == profile.opcodes["RET"] - 1  # main returns too
+    functions = profile.functions()
+    assert list(functions) == ["main", "fibonacci"]
+    assert functions["main"][0] == cycles
+    assert functions["main"][1] + functions["fibonacci"][1] == cycles
+    # the loop over the 15 numbers, one stack per depth of the recursion
+    assert list(profile.loops.values()) == [15]
+    lines = profile.collapsed().splitlines()
+    assert "main;fibonacci;fibonacci 357" in lines
+    assert sum(int(line.split()[1]) for line in lines) == cycles
+    assert json.loads(profile.to_json())["functions"]["fibonacci"]["exclusive"] > 0
+
+
+class Recorder(Hooks):
+    def __init__(self) -> None:
+        self.events = []
+
+    def on_call(self, pc, target, tail):
+        self.events.append(("call", target, tail))
+
+    def on_return(self, pc, address):
+        self.events.append(("return", address))
+
+    def on_syscall(self, pc, name, args):
+        self.events.append((name, args))
+
+    def on_memory_write(self, pc, address, data):
+        if len(data) == 1:
+            self.events.append(("write", address, data))
+
+
+def test_hooks(tmp_path, capsys):
+    compiler = Compiler(tokenize(TAIL_CALL))
+    pc_start, program, data_segment = compiler.parse_global_declarations()
+    functions = compiler.functions()
+    image = assemble(pc_start, program, data_segment)
+    recorder = Recorder()
+    assert (
+        execute(image.pc_start, image.code, image.data, hooks=recorder) == 500500 % 256
+    )
+    events = recorder.events
+    assert events[0] == ("call", functions["count"], False)
+    assert events[1] == ("call", functions["sum"], False)  # more arguments than count
+    assert events.count(("call", functions["sum"], True)) == 1000
+    assert events[-1] == ("EXIT", (500500 % 256,))
+    returns = [event[0] for event in events[-4:-1]]  # count, main, the stub
+    assert returns == ["return"] * 3
+
+    compiler = Compiler(tokenize(MEMORY))
+    image = assemble(*compiler.parse_global_declarations())
+    recorder = Recorder()
+    execute(image.pc_start, image.code, image.data, memory_size=1 << 20, hooks=recorder)
+    capsys.readouterr()
+    assert ("write", 4, bytes([200])) in recorder.events  # c = 200, after g
+    assert ("MALLOC", (8,)) in recorder.events
+
+    text = open("examples/fib.c").read()
+    image = assemble(*Compiler(tokenize(text)).parse_global_declarations())
+    last = Trace(capacity=8)
+    with open(tmp_path / "fib.trace", "wb") as file:
+        trace = Trace(capacity=1000, file=file)
+        execute(image.pc_start, image.code, image.data, hooks=trace)
+        trace.flush()
+    execute(image.pc_start, image.code, image.data, hooks=last)
+    with open(tmp_path / "fib.trace", "rb") as file:
+        records = list(read_trace(file))
+    assert len(records) == trace.count == last.count > 50000
+    assert list(last.records()) == records[-8:]
+    assert Opcode(records[-1][1]) == Opcode.EXIT and records[0][0] == image.pc_start
+    with pytest.raises(ValueError):  # the profile would run the program alone
+        execute(image.pc_start, image.code, image.data, profile=Profile(), hooks=last)
+
+
+OUTPUT = """
+int main() {
+    char *s;
+    int i;
+    s = malloc(4);
+    s[1] = 0;
+    i = 0;
+    while (i < 3) {
+        s[0] = 'a' + i;
+        printf(s);
+        printf("%d\\n", i);
+        i++;
+    }
+    return 0;
+}
+"""
+
+
+def test_output(tmp_path, capsys):
+    image = assemble(*Compiler(tokenize(OUTPUT)).parse_global_declarations())
+    for engine in ENGINES:
+        sink = io.BytesIO()
+        assert execute(image.pc_start, image.code, image.data, engine, sink=sink) == 0
+        # the string changed in place is decoded again
+        assert sink.getvalue() == b"a0\nb1\nc2\nexit(0)\n"
+    assert execute(image.pc_start, image.code, image.data, sink=NULL) == 0
+    assert capsys.readouterr().out == ""
+
+    path = tmp_path / "output.py"
+    translate_file(path, image.pc_start, image.code, image.data)
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sink = io.BytesIO()
+    assert module.run(sink=sink) == 0 and sink.getvalue() == b"a0\nb1\nc2\nexit(0)\n"
+
+
+BUILTINS = """
+int main() {
+    char *s;
+    char *a;
+    char *b;
+    int n;
+    s = "abcdef";
+    a = malloc(16);
+    b = malloc(16);
+    n = strlen(s);
+    memcpy(a, s, n + 1);
+    memmove(a + 1, a, 5);
+    memset(b, 'z', 3);
+    b[3] = 0;
+    printf(a);
+    printf(" %d %d %d %d\\n", n, strcmp(a, s), strcmp(s, a), strcmp(b, b));
+    return strlen(b);
+}
+"""
+
+
+def test_builtins(tmp_path, capsys):
+    for level in (0, 2):
+        compiler = Compiler(tokenize(BUILTINS))
+        pc_start, program, data_segment = compiler.parse_global_declarations()
+        pc_start, program, _ = optimize(pc_start, program, compiler.functions(), level)
+        assert program.count("SYS") == 8
+        image = assemble(pc_start, program, data_segment)
+        for engine in ENGINES:
+            assert execute(image.pc_start, image.code, image.data, engine) == 3
+            assert capsys.readouterr().out == "aabcde 6 -1 1 0\nexit(3)\n"
+
+    path = tmp_path / "builtins.py"
+    translate_file(path, image.pc_start, image.code, image.data)
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.run() == 3
+    assert capsys.readouterr().out == "aabcde 6 -1 1 0\nexit(3)\n"
+
+    class Writes(Recorder):
+        def on_memory_write(self, pc, address, data):
+            self.events.append(data)
+
+    writes = Writes()
+    execute(image.pc_start, image.code, image.data, hooks=writes)
+    capsys.readouterr()
+    assert ("strlen", (0,)) in writes.events  # of the first literal
+    assert b"abcdef\0" in writes.events and b"zzz" in writes.events
+
+    # the program's own functions shadow the builtins
+    text = 'int strlen(char *s) { return 42; } int main() { return strlen("abc"); }'
+    pc_start, program, data_segment = Compiler(
+        tokenize(text)
+    ).parse_global_declarations()
+    assert "SYS" not in program and execute(pc_start, program, data_segment) == 42
+    capsys.readouterr()
+
+    # unterminated strings fault like accesses outside the memory
+    for function, args in ((strlen, (4,)), (strcmp, (0, 4))):
+        with pytest.raises(IndexError):
+            function(bytearray(b"abc\0de"), *args)
+
+
+SPIN = """
+int main() {
+    while (1) {}
+    return 0;
+}
+"""
+
+
+def test_scheduler():
+    image = assemble(
+        *Compiler(tokenize(open("examples/fib.c").read())).parse_global_declarations()
+    )
+    sink = io.BytesIO()
+    execute(image.pc_start, image.code, image.data, sink=sink)
+    expected = sink.getvalue()
+
+    vm = VM(image.pc_start, image.code, image.data, output=Output(NULL))
+    while vm.run(1000) is None:  # resumed after any instruction
+        assert vm.cycles % 1000 == 0
+    assert vm.run() == vm.exit_code == 0
+
+    spin = assemble(*Compiler(tokenize(SPIN)).parse_global_declarations())
+    sinks = [io.BytesIO() for _ in range(20)]
+    vms = [
+        VM(image.pc_start, image.code, image.data, output=Output(sink))
+        for sink in sinks
+    ]
+    vms.insert(10, VM(spin.pc_start, spin.code, spin.data, output=Output(NULL)))
+    results = asyncio.run(Scheduler(slice=997, max_cycles=vm.cycles).gather(vms))
+    assert results[:10] + results[11:] == [0] * 20
+    assert isinstance(results[10], CycleLimitError) and vms[10].cycles == vm.cycles
+    assert all(sink.getvalue() == expected for sink in sinks)
+
+
+def test_batch():
+    compiler = Compiler(tokenize(open("examples/collatz.c").read()))
+    collatz = assemble(*compiler.parse_global_declarations())
+    variables = compiler.globals()
+    fib = assemble(
+        *Compiler(tokenize(open("examples/fib.c").read())).parse_global_declarations()
+    )
+    sink = io.BytesIO()
+    execute(fib.pc_start, fib.code, fib.data, sink=sink)
+
+    jobs = [(0, inputs(variables, {"n": n})) for n in (1, 7, 27)] + [(1, {})]
+    jobs.append((0, {len(collatz.data): b"\1"}))  # outside the data segment
+    stats = BatchStats()
+    results = run_batch([collatz, fib], jobs, workers=2, stats=stats)
+    assert [result.exit_code for result in results] == [0, 16, 111, 0, None]
+    assert (
+        results[2].output == b"111\nexit(111)\n"
+        and results[3].output == sink.getvalue()
+    )
+    assert results[4].error.startswith("IndexError")
+    assert stats.jobs == 5 and stats.failures == 1 and stats.workers == 2
+
+
+SNAPSHOT = """
+int *squares;
+
+int main() {
+    int i;
+    squares = malloc(400);
+    i = 0;
+    while (i < 100) {
+        squares[i] = i * i;
+        i++;
+    }
+    printf("%d\\n", snapshot());
+    printf("%d\\n", squares[99]);
+    return 7;
+}
+"""
+
+
+def test_snapshot(tmp_path):
+    image = assemble(*Compiler(tokenize(SNAPSHOT)).parse_global_declarations())
+    for engine in ENGINES:  # snapshot() does nothing unless told to stop
+        sink = io.BytesIO()
+        assert execute(image.pc_start, image.code, image.data, engine, sink=sink) == 7
+        assert sink.getvalue() == b"0\n9801\nexit(7)\n"
+    whole = VM(image.pc_start, image.code, image.data, output=Output(NULL))
+    whole.run()
+
+    vm = VM(image.pc_start, image.code, image.data, output=Output(NULL))
+    vm.stop_at_snapshot = True
+    assert vm.run() is None and vm.at_snapshot
+    path = tmp_path / "squares.snap"
+    save(vm, path)
+    assert is_snapshot(path)
+    for _ in range(2):
+        stats = HeapStats()
+        sink = io.BytesIO()
+        restored = restore(path, stats, Output(sink))
+        assert restored.run() == 7 and sink.getvalue() == b"1\n9801\nexit(7)\n"
+        assert (
+            restored.cycles == whole.cycles and stats.mallocs == 1 and stats.live == 408
+        )
+
+    vm = VM(
+        image.pc_start, image.code, image.data, memory_size=1 << 20, output=Output(NULL)
+    )
+    vm.run(1000)
+    save(vm, path)
+    sink = io.BytesIO()
+    restored = restore(path, output=Output(sink))
+    assert restored.run() == 7 and sink.getvalue() == b"0\n9801\nexit(7)\n"
+    assert restored.cycles == whole.cycles